@@ -8,7 +8,7 @@ class Bin2Cont:
         """バイナリ時系列の連続具合を数値化する
 
         Attributes:
-            in_arr  : 入力時系列バイナリ ([0,1,1,1,0,0,...])
+            in_arr  : 入力時系列バイナリ ([0,1,1,1,0,0,...]). (N, T)の配列なら最終軸ごとに計算する
             serial  : 1の塊ごとに番号をふった配列 ([0,1,2,3,0,0,...])
             inv_arr : 逆方向に番号を振った配列 ([0,3,2,1,0,0,...])
 
@@ -27,47 +27,39 @@ class Bin2Cont:
 
     def calc_serial(self):
         """元の時系列を0,1,2,0,0,1,0のように変換する
+        直前の0の位置を累積最大で求め, そこからの距離を番号にする. (N, T)の配列は最終軸ごとに計算する
+        出力は入力と同じdtype(boolのみint). uint8などで型の最大値を超える長さは元のループ版と同じくオーバーフローする
         """
-        out_ls = []
-        for i, val in enumerate(self.in_arr):
-            if i==0:
-                out_ls.append(val)
-                continue
-
-            out_ls.append((out_ls[i-1]+1)*val)
-        self.serial = np.array(out_ls)
+        in_arr = np.asarray(self.in_arr)
+        idx = np.arange(in_arr.shape[-1])
+        last_zero = np.maximum.accumulate(np.where(in_arr==0, idx, -1), axis=-1)
+        self.serial = np.where(in_arr!=0, idx-last_zero, 0).astype(out_dtype(in_arr))
         return self
     
     def calc_length(self):
-        out_ls = []
-        for i, (in_val, ser_val) in enumerate(zip(self.in_arr[::-1], self.serial[::-1])):
-            if i==0:
-                out_ls.append(ser_val)
-                continue
-            if out_ls[i-1]>ser_val:
-                out_ls.append(out_ls[i-1]*in_val)
-            elif ser_val>0:
-                out_ls.append(ser_val)
-            else:
-                out_ls.append(0)
-                
-        self.len_arr = np.array(out_ls[::-1])
+        """1の塊の長さを塊の全要素に入れる([0,3,3,3,0,0,...])
+        直後の0の位置を逆向きの累積最小で求め, 直前の0との間隔を長さにする. dtypeはserialと同じ
+        """
+        in_arr = np.asarray(self.in_arr)
+        t = in_arr.shape[-1]
+        idx = np.arange(t)
+        last_zero = np.maximum.accumulate(np.where(in_arr==0, idx, -1), axis=-1)
+        next_zero = np.flip(np.minimum.accumulate(np.flip(np.where(in_arr==0, idx, t), axis=-1), axis=-1), axis=-1)
+        self.len_arr = np.where(in_arr!=0, next_zero-last_zero-1, 0).astype(self.serial.dtype)
         return self
     
     def calc_inverse(self):
         self.inv_arr = np.where(self.serial>0, self.len_arr-self.serial+1, 0)
         return self
     
-def osero(arr):
-    """バイナリデータで、前後が1で観測値が0の箇所を1に変換する"""
-    out_ls = []
+def out_dtype(arr):
+    """出力のdtype. 数値型は入力のまま, boolなどはintにする"""
+    return arr.dtype if arr.dtype.kind in 'iuf' else np.result_type(arr.dtype, int)
 
-    for i, val in enumerate(arr):
-        if (i==0)|(i==(len(arr)-1)):
-            out_ls.append(val)
-            continue
-        if (arr[i-1]==1)&(arr[i+1]==1):
-            out_ls.append(1)
-            continue
-        out_ls.append(val)
-    return np.array(out_ls)
\ No newline at end of file
+def osero(arr):
+    """バイナリデータで、前後が1で観測値が0の箇所を1に変換する
+    (N, T)の配列は最終軸ごとに, 元の配列の前後の値で判定する. dtypeは入力のまま(boolのみint)"""
+    arr = np.asarray(arr)
+    out_arr = arr.astype(out_dtype(arr))
+    out_arr[..., 1:-1] = np.where((arr[..., :-2]==1)&(arr[..., 2:]==1), 1, arr[..., 1:-1])
+    return out_arr
\ No newline at end of file
@@ -26,4 +26,133 @@ def bise_smoother(x, over_diff_size):
     # 線形補間
     smoothed_arr = pd.Series(null_padding_arr).interpolate(method='linear').values
 
-    return smoothed_arr
\ No newline at end of file
+    return smoothed_arr
+
+# %%
+def interpolate_linear_2d(x):
+    """最終軸方向のnanを線形補間する(pd.Series.interpolate(method='linear')と同じ扱い)
+    先頭のnanはそのまま, 末尾のnanは最後の値で埋める
+
+    Args:
+        x (Array like): (..., T)の配列
+
+    Returns:
+        Array like: 補間した配列
+    """
+    x = np.asarray(x, dtype=np.float64)
+    t = x.shape[-1]
+    idx = np.arange(t)
+    valid = ~np.isnan(x)
+
+    # 各時点の直前・直後の有効値のインデックス(累積最大・最小で求める)
+    prev_idx = np.maximum.accumulate(np.where(valid, idx, -1), axis=-1)
+    next_idx = np.flip(np.minimum.accumulate(np.flip(np.where(valid, idx, t), axis=-1), axis=-1), axis=-1)
+
+    prev_val = np.take_along_axis(x, np.clip(prev_idx, 0, t-1), axis=-1)
+    next_val = np.take_along_axis(x, np.clip(next_idx, 0, t-1), axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (next_val - prev_val) / (next_idx - prev_idx)
+        interp = slope * (idx - prev_idx) + prev_val
+
+    out = np.where(next_idx>=t, prev_val, interp)  # 末尾は最後の値で埋める
+    out = np.where(prev_idx<0, np.nan, out)  # 先頭は補間しない
+    return np.where(valid, x, out)
+
+
+def bise_sliding_mask(x, sliding_period=3, threshold=0.2):
+    """スライディング期間によるBISE法の前方探索で採用する点を求める(全ピクセル同時に1ステップずつ進める)
+
+    採用点の次の値が増加していれば採用する. 減少している場合は, sliding_period内に
+    減少幅のthreshold倍以上回復する点があれば減少を棄却してその点へ進み, 無ければ減少を採用する.
+
+    Args:
+        x (Array like): (N, T)の配列(nanなし)
+        sliding_period (int): 前方探索の期間. Defaults to 3.
+        threshold (float): 減少幅に対する回復の割合. Defaults to 0.2.
+
+    Returns:
+        Array like (bool): 採用する点ならTrue
+    """
+    n, t = x.shape
+    rows = np.arange(n)
+    accepted = np.zeros((n, t), dtype=bool)
+    accepted[:, 0] = True
+    cur = np.zeros(n, dtype=np.intp)  # 各ピクセルの最後の採用点
+    offsets = np.arange(2, sliding_period+2)
+
+    while True:
+        active = cur < t-1
+        if not active.any():
+            break
+        nxt = np.minimum(cur+1, t-1)
+        cur_val, nxt_val = x[rows, cur], x[rows, nxt]
+
+        # 探索期間内で回復しきい値を超える最初の点
+        window_idx = cur[:, None] + offsets[None, :]
+        in_range = window_idx < t
+        window_val = x[rows[:, None], np.minimum(window_idx, t-1)]
+        recover = in_range & (window_val > (nxt_val + threshold*(cur_val-nxt_val))[:, None])
+        has_recover = recover.any(axis=1)
+        first_recover = window_idx[rows, np.argmax(recover, axis=1)]
+
+        new_cur = np.where((nxt_val<cur_val) & has_recover, first_recover, nxt)
+        new_cur = np.where(active, new_cur, cur)
+        accepted[rows[active], new_cur[active]] = True
+        cur = new_cur
+    return accepted
+
+
+def bise_smoother_2d(
+    x, over_diff_size=None, mode='dropout', sliding_period=3, threshold=0.2,
+    chunk_size=100000, n_workers=1
+    ):
+    """BISE法のスムージングを(h, w, T)や(N, T)の配列に対してまとめて行う
+
+    Args:
+        x (Array like): (..., T)の配列. 最終軸が時間. numpy.memmapでもよい
+        over_diff_size (float): mode='dropout'で前後の値との差がこれを超える点を外れ値とする(bise_smootherと同じ).
+        mode (str): 'dropout'なら前後差による外れ値検出, 'sliding'ならスライディング期間による前方探索. Defaults to 'dropout'.
+        sliding_period (int): mode='sliding'の前方探索期間. Defaults to 3.
+        threshold (float): mode='sliding'の回復しきい値(減少幅に対する割合). Defaults to 0.2.
+        chunk_size (int): 1回に処理するピクセル数. Defaults to 100000.
+        n_workers (int): チャンクを並列に処理するスレッド数. Defaults to 1.
+
+    Returns:
+        Array like: スムージング後の配列(入力と同じ形)
+    """
+    if mode=='dropout' and (over_diff_size is None or np.sign(over_diff_size)==0):
+        raise ValueError('over_diff_size must be non-zero in dropout mode')
+    if mode not in ('dropout', 'sliding'):
+        raise ValueError(f'mode must be "dropout" or "sliding" (got {mode})')
+
+    t = x.shape[-1]
+    flat_x = x.reshape(-1, t)
+    out_arr = np.empty(flat_x.shape, dtype=np.float64)
+
+    def process_chunk(start):
+        chunk = np.asarray(flat_x[start:start+chunk_size], dtype=np.float64)
+        if mode=='dropout':
+            diff = np.diff(chunk, axis=1)
+            zeros = np.zeros((chunk.shape[0], 1))
+            before_diff = np.concatenate([zeros, diff], axis=1)  # 前のデータとの差分
+            after_diff = -1*np.concatenate([diff, zeros], axis=1)  # 後のデータとの差分
+            if np.sign(over_diff_size)==-1:
+                drop = (before_diff<=over_diff_size)&(after_diff<=over_diff_size)
+            else:
+                drop = (before_diff>=over_diff_size)&(after_diff>=over_diff_size)
+        else:
+            # 欠損は補間してから探索し, 最後に補間し直す
+            filled = interpolate_linear_2d(chunk)
+            filled = np.where(np.isnan(filled), -np.inf, filled)  # 先頭の欠損は採用しない
+            drop = ~bise_sliding_mask(filled, sliding_period, threshold) | np.isnan(chunk)
+        out_arr[start:start+chunk_size] = interpolate_linear_2d(np.where(drop, np.nan, chunk))
+
+    starts = range(0, flat_x.shape[0], chunk_size)
+    if n_workers==1:
+        for start in starts:
+            process_chunk(start)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(process_chunk, starts))
+    return out_arr.reshape(x.shape)
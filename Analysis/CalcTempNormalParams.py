@@ -4,52 +4,146 @@
 #%%
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+import hashlib
+import os
+
+def make_year_doy_arr(temp1day_df, temp_element='MeanTEMP', input_min_year=1991):
+    """日別データフレームを(年, DOY)の配列にする
+
+    Args:
+        temp1day_df (pandas.DataFrame): 'year', 'doy', temp_elementの列を持つ日別データ
+        temp_element (str): 気温の列名. Defaults to 'MeanTEMP'.
+        input_min_year (int): 平年値の開始年. Defaults to 1991.
+
+    Returns:
+        Array like: (31, 366)の配列. input_min_year年からの31年分(DOY364, 365は翌年からの30年を使うため). データが無い日はnan
+    """
+    year_doy_arr = np.full((31, 366), np.nan)
+    year_idx = temp1day_df['year'].values.astype(int) - input_min_year
+    doy_idx = temp1day_df['doy'].values.astype(int) - 1
+    inside = (year_idx>=0) & (year_idx<31) & (doy_idx>=0) & (doy_idx<366)
+    year_doy_arr[year_idx[inside], doy_idx[inside]] = temp1day_df[temp_element].values[inside]
+    return year_doy_arr
+
+def doy_window_arr(year_doy_arr):
+    """DOYごとの使用データ(30年 x 周辺5日間)を(..., 365, 150)にまとめる
+    周辺5日間は年内で折り返し(DOY1ならDOY364, 365, 1, 2, 3), 年はDOY363までがinput_min_year年からの30年,
+    DOY364, 365が翌年からの30年(calc_temp_normal_paramsの元の抽出条件と同じ)
+
+    Args:
+        year_doy_arr (Array like): (..., 年, 366)の配列. 年の軸はinput_min_year年から
+
+    Returns:
+        Array like: (..., 365, 150)
+    """
+    year_doy_arr = np.asarray(year_doy_arr, dtype=np.float64)
+    n_years = year_doy_arr.shape[-2]
+    if n_years<31:  # 足りない年はnanで埋める
+        pad_shape = year_doy_arr.shape[:-2] + (31-n_years, 366)
+        year_doy_arr = np.concatenate([year_doy_arr, np.full(pad_shape, np.nan)], axis=-2)
+
+    # 5CD: 年内で折り返したDOY軸の移動窓(ビュー)
+    doy365_arr = year_doy_arr[..., :31, :365]
+    padded_arr = np.concatenate([doy365_arr[..., -2:], doy365_arr, doy365_arr[..., :2]], axis=-1)
+    window_arr = sliding_window_view(padded_arr, 5, axis=-1)  # (..., 31, 365, 5)
+
+    out_shape = year_doy_arr.shape[:-2] + (365, 150)
+    out_arr = np.empty(out_shape)
+    out_arr[..., :363, :] = np.moveaxis(window_arr[..., 0:30, :363, :], -3, -2).reshape(out_shape[:-2] + (363, 150))
+    out_arr[..., 363:, :] = np.moveaxis(window_arr[..., 1:31, 363:, :], -3, -2).reshape(out_shape[:-2] + (2, 150))
+    return out_arr
+
+def bootstrap_stats(sample_arr, n_draws=29*5*29, rng=None):
+    """各DOYのデータから復元抽出したときの平均と標準偏差(ddof=1)
+    抽出結果そのものではなく各データの抽出回数(多項分布)を引き, 重み付きで平均と標準偏差を求める. nanは抽出しない
+
+    Args:
+        sample_arr (Array like): (..., 150)のデータ
+        n_draws (int): 抽出回数. Defaults to 29*5*29.
+        rng (numpy.random.Generator, optional): 乱数生成器. Defaults to None.
+
+    Returns:
+        (Array like, Array like): (...,)の平均と標準偏差
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    valid = ~np.isnan(sample_arr)
+    n_valid = valid.sum(axis=-1, keepdims=True)
+    pvals = np.where(n_valid>0, valid/np.maximum(n_valid, 1), 1/sample_arr.shape[-1])
+    count_arr = rng.multinomial(n_draws, pvals)
+
+    value_arr = np.where(valid, sample_arr, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu = (count_arr*value_arr).sum(axis=-1) / n_draws
+        sigma = np.sqrt((count_arr*(value_arr-mu[..., None])**2).sum(axis=-1) / (n_draws-1))
+    no_data = n_valid[..., 0]==0
+    return np.where(no_data, np.nan, mu), np.where(no_data, np.nan, sigma)
+
+def calc_temp_normal_params_batch(
+    year_doy_arr, input_min_year=1991, temp_element='MeanTEMP',
+    n_draws=29*5*29, seed=None, block_size=256, cache_dir=None):
+    """多数の地点・ピクセルのDOY別の平年値(平均, 標準偏差)をまとめて計算する
+
+    Args:
+        year_doy_arr (Array like): (..., 年, 366)の気温. 年の軸はinput_min_year年から31年分(make_year_doy_arrで作成)
+        input_min_year (int): 平年値の開始年. Defaults to 1991.
+        temp_element (str): 気温の要素名(キャッシュのファイル名に使う). Defaults to 'MeanTEMP'.
+        n_draws (int): ブートストラップの抽出回数. Defaults to 29*5*29.
+        seed (int, optional): 乱数のシード. Defaults to None.
+        block_size (int): 一度に処理する地点数. Defaults to 256.
+        cache_dir (str, optional): 指定すると結果を要素・平年期間・入力のチェックサムごとに保存し, 同じ条件なら読み込む. Defaults to None.
+
+    Returns:
+        (Array like, Array like, Array like): (..., 365)の平均, 標準偏差, DOY
+    """
+    year_doy_arr = np.asarray(year_doy_arr, dtype=np.float64)
+    spatial_shape = year_doy_arr.shape[:-2]
+    doy_arr = np.arange(1, 365+1)
+
+    if cache_dir is not None:
+        checksum = hashlib.sha1(np.ascontiguousarray(year_doy_arr).tobytes())
+        checksum.update(f'{year_doy_arr.shape}-{n_draws}-{seed}'.encode())
+        cache_path = f'{cache_dir}/{temp_element}_{input_min_year}-{input_min_year+29}_{checksum.hexdigest()[:16]}.npz'
+        if os.path.exists(cache_path):
+            cache = np.load(cache_path)
+            return cache['mu'], cache['sigma'], cache['doy']
+
+    rng = np.random.default_rng(seed)
+    flat_arr = year_doy_arr.reshape((-1,) + year_doy_arr.shape[-2:])
+    mu_arr = np.empty((len(flat_arr), 365))
+    sigma_arr = np.empty((len(flat_arr), 365))
+    for start in range(0, len(flat_arr), block_size):
+        sample_arr = doy_window_arr(flat_arr[start:start+block_size])
+        mu_arr[start:start+block_size], sigma_arr[start:start+block_size] = bootstrap_stats(sample_arr, n_draws, rng)
+    mu_arr = mu_arr.reshape(spatial_shape + (365,))
+    sigma_arr = sigma_arr.reshape(spatial_shape + (365,))
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_path, mu=mu_arr, sigma=sigma_arr, doy=doy_arr)
+    return mu_arr, sigma_arr, doy_arr
 
 def calc_temp_normal_params(
     temp1day_df,
     temp_element='MeanTEMP',
-    input_min_year=1991):
-    # 処理
-
-    mu_ls =[]
-    sigma_ls=[]
-    doy_ls=[]
-
-    # doyごとに平年値を算出
-    for doy in np.arange(1, 365+1):
-
-        get_doy_ls = []
-        # 周辺5日間のデータを使用してデータ量を増やす(5CDの実行)
-        for delta in np.arange(-2, 2+1):
-            get_doy = doy + delta
-            if get_doy<=0:  # 前年にわたる時
-                get_doy = get_doy+ 365
-                min_year = input_min_year-1
-
-            elif get_doy>=366:
-                get_doy = get_doy - 365
-                min_year = input_min_year+1
-
-            else:
-                min_year = input_min_year
-            get_doy_ls.append(get_doy)
-            year_ls = list(np.arange(min_year, min_year+30))
-        # /*5CDここまで*/
-
-        # ブートストラップ実行前のtempデータのリスト(length:150)
-        before_bootstrap_value = temp1day_df.query(
-            f'year=={year_ls} and doy=={get_doy_ls}'
-        )[temp_element].values
-
-        # ブートストラップ実行後のtempデータのリスト(length: 4205)
-        all_value = np.random.choice(before_bootstrap_value, 29*5*29)
-
-        # 各統計量の算出
-        mu = np.nanmean(all_value)
-        sigma = np.nanstd(all_value, ddof=1)
-
-        mu_ls.append(mu)
-        sigma_ls.append(sigma)
-        doy_ls.append(doy)
-    return np.array(mu_ls), np.array(sigma_ls), np.array(doy_ls)
+    input_min_year=1991,
+    n_draws=29*5*29, seed=None, cache_dir=None):
+    """1地点の日別データからDOY別の平年値(平均, 標準偏差)を計算する
+    DOYごとに周辺5日間 x 30年のデータを復元抽出(ブートストラップ)して平均と標準偏差を求める
+
+    Args:
+        temp1day_df (pandas.DataFrame): 'year', 'doy', temp_elementの列を持つ日別データ
+        temp_element (str): 気温の列名. Defaults to 'MeanTEMP'.
+        input_min_year (int): 平年値の開始年. Defaults to 1991.
+        n_draws (int): ブートストラップの抽出回数. Defaults to 29*5*29.
+        seed (int, optional): 乱数のシード. Defaults to None.
+        cache_dir (str, optional): 結果のキャッシュを保存するディレクトリ. Defaults to None.
+
+    Returns:
+        (Array like, Array like, Array like): (365,)の平均, 標準偏差, DOY
+    """
+    year_doy_arr = make_year_doy_arr(temp1day_df, temp_element, input_min_year)
+    return calc_temp_normal_params_batch(
+        year_doy_arr, input_min_year, temp_element, n_draws=n_draws, seed=seed, cache_dir=cache_dir
+    )
 # %%
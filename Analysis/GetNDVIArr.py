@@ -2,32 +2,45 @@
 import numpy as np
 import pandas as pd
 from .SpecifyCoodinatesSinusoidal import SpecifyCoodinatesSinusoidal as scs
+from ..Convert.DatasetCatalog import DatasetCatalog
 
 
 # %%
 class GetNDVIArr:
-    def __init__(self, h=2400, w=2400):
-        self.h, self.w = h, w
+    def __init__(self, h=None, w=None, catalog=None, key='MOD13A1', start_year=2001, end_year=2021):
+        """MODIS NDVI画像を読み込み, 指定地点のNDVI時系列を抽出する
+
+        Args:
+            h (int, optional): 画像の高さ. Defaults to None (カタログの値).
+            w (int, optional): 画像の幅. Defaults to None (カタログの値).
+            catalog (DatasetCatalog, optional): データセットのカタログ. Defaults to None (既定のカタログ).
+            key (str): 読み込む変数名. Defaults to 'MOD13A1'.
+            start_year (int): 読み込み開始年. Defaults to 2001.
+            end_year (int): 読み込み終了年. Defaults to 2021.
+        """
+        self.catalog = catalog if catalog is not None else DatasetCatalog()
+        self.key = key
+        if (h is not None) and (w is not None):
+            self.catalog = self.catalog.override(shape_dict={key: [h, w]})  # 渡されたカタログは変更しない
+        self.h, self.w = self.catalog.shape(key)
+        self.date_arr = self.catalog.date_arr(key, start_year, end_year)
         self.get_all_data()
     
     # 画像データセットの読込
     def get_all_data(self):
-        self.all_ndvi_img = np.full((self.h,self.w,21*23), np.nan, dtype=np.int16)
-        c=0
-        for year in np.arange(2001, 2021+1):
-            for doy in np.arange(1, 366, 16):
-                get_img = np.fromfile(
-                    f'D:/ResearchData2/Level3/MOD13A1_JA/MOD13A1_JA_RAW_500m/MOD13A1.A{year}{str(doy).zfill(3)}.int16_h{self.h}w{self.w}.raw',
-                    count=self.h*self.w, dtype=np.int16
-                ).reshape(self.h,self.w)
-                self.all_ndvi_img[:,:,c] = get_img
-                c+=1
-            print(year)
+        self.all_ndvi_img = np.full(
+            (self.h,self.w,len(self.date_arr)), self.catalog.fill_value(self.key), dtype=self.catalog.dtype(self.key)
+        )
+        available_arr = self.catalog.available(self.key, self.date_arr)  # 存在するファイルを先に確認
+        for c, (date, available) in enumerate(zip(self.date_arr, available_arr)):
+            if available:
+                self.all_ndvi_img[:,:,c] = self.catalog.read(self.key, date)
+            if c==len(self.date_arr)-1 or self.date_arr[c+1].year!=date.year:
+                print(date.year)
 
     # 緯度経度と画像座標の計算
     def get_proj(self, area_name):
-        area_df = pd.read_csv(f'D:/ResearchData2/LevelExtra/TargetArea.csv')
-
+        area_df = pd.read_csv(self.catalog.path('TargetArea'))
         self.lat = area_df.query(f'Name=="{area_name}"')['Lat'].values[0]
         self.lon = area_df.query(f'Name=="{area_name}"')['Lon'].values[0]
         self.img_y, self.img_x = scs(lat=self.lat, lon=self.lon)
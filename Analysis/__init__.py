@@ -1,8 +1,8 @@
 from .SpecifyCoodinatesSinusoidal import SpecifyCoodinatesSinusoidal, calc_img_proj_epsg4326
 from .MoveFunction import MoveFunction
-from .CalcTempNormalParams import calc_temp_normal_params
+from .CalcTempNormalParams import calc_temp_normal_params, calc_temp_normal_params_batch, make_year_doy_arr
 from .GetNDVIArr import GetNDVIArr
-from .BiseSmoother import bise_smoother
+from .BiseSmoother import bise_smoother, bise_smoother_2d
 from .calc_zscore import calc_zscore
 from .Bin2Cont import Bin2Cont
 from .Bin2Cont import osero
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# DatasetCatalog.py: データセットの保存先・ファイル名・dtype・形状を宣言的にまとめ, ファイルを解決する
+
+# %%
+import numpy as np
+import pandas as pd
+import datetime
+import json
+import copy
+import os
+import re
+
+from .RasterCube import RasterCube
+
+# %%
+# データセットの定義
+#   roots     : ルートディレクトリの名前と実際のパス
+#   defaults  : 各変数で省略した項目の既定値
+#   variables : 変数ごとの定義(root, dir, template, dtype, shape, geotrans, cadence, nodata)
+#   cadence   : '16days', '8days', 'daily', 'monthly', 'static' のいずれか
+default_catalog = {
+    'roots': {
+        'ResearchData2': 'D:/ResearchData2',
+        'ResearchData3': 'D:/ResearchData3',
+    },
+    'cube_dir': None,
+    'defaults': {
+        'root'    : 'ResearchData3',
+        'template': '{key}.A{date:%Y%j}.{dtype}_h{h}w{w}.raw',
+        'dtype'   : 'float32',
+        'shape'   : [1600, 1500],
+        'geotrans': [-20, 0.05, 0, 40, 0, -0.05],
+        'cadence' : '16days',
+        'nodata'  : None,
+    },
+    'variables': {
+        # Level4 (16日合成)
+        'mR95pT'       : {'dir': 'Level4/MOD16days/CCIs/mR95pT',  'dtype': 'float64'},
+        'PRCPTOT'      : {'dir': 'Level4/MOD16days/CCIs/PRCPTOT', 'dtype': 'float64'},
+        'SPI3'         : {'dir': 'Level4/MOD16days/SPI3'},
+        'DayZ'         : {'dir': 'Level4/MOD16days/LST/DayZ'},
+        'VZI'          : {'dir': 'Level4/MOD16days/VZI'},
+        'STI'          : {'dir': 'Level4/MOD16days/STI'},
+        'PAR'          : {'dir': 'Level4/MOD16days/PAR/JASMES'},
+        'MeanTEMP'     : {'dir': 'Level4/MOD16days/TEMP/MeanTEMP'},
+        'PARRZ'        : {'dir': 'Level4/MOD16days/PARRZ'},
+        'NDVI_Smoothed': {'dir': 'Level4/MOD16days/NDVI_Smoothed', 'dtype': 'float64'},
+
+        # Level3
+        'DayLST'       : {'dir': 'Level3/MOD11C4/DayLST'},
+        'MaxTemp'      : {'dir': 'Level3/CPCTemp/MaxTEMP'},
+        'MOD13C1'      : {'dir': 'Level3/MOD13C1', 'dtype': 'int16'},
+        'chirps_005'   : {'dir': 'Level3/chirps005_RAW_f32', 'cadence': 'daily'},
+        'MOD13A1'      : {
+            'root': 'ResearchData2', 'dir': 'Level3/MOD13A1_JA/MOD13A1_JA_RAW_500m',
+            'dtype': 'int16', 'shape': [2400, 2400], 'geotrans': None, 'nodata': -3000
+            },
+
+        # 時間変化しないもの
+        'AIKoppen'     : {'dir': 'LevelExtra/RAW', 'template': '{key}.C19912020.{dtype}_h{h}w{w}.raw', 'cadence': 'static'},
+        'MCD12C1'      : {'dir': 'Level3/MCD12C1', 'template': '{key}.A2010001.{dtype}_h{h}w{w}.raw', 'dtype': 'uint8', 'cadence': 'static'},
+        'TargetArea'   : {'root': 'ResearchData2', 'dir': 'LevelExtra', 'template': '{key}.csv', 'dtype': None, 'shape': None, 'cadence': 'static'},
+    }
+}
+
+# %%
+class DatasetCatalog:
+    def __init__(self, catalog=None, roots=None, cube_dir=None):
+        """データセットの定義からファイルパスを解決し, 読み込む
+
+        Args:
+            catalog (dict or str (path), optional): データセットの定義. jsonファイルのパスでもよい.
+                Defaults to None (環境変数GEOTOOL_CATALOGがあればそのjson, なければdefault_catalog).
+            roots (dict, optional): ルートディレクトリの上書き. 例: {'ResearchData3': '/mnt/nvme/ResearchData3'}. Defaults to None.
+            cube_dir (str (path), optional): キューブ(RasterCube)の保存先. Defaults to None.
+
+        Attributes:
+            .catalog (dict)             : データセットの定義
+            .scan_dict (dict)           : 変数ごとの存在する日付(scanの結果を保持)
+        """
+        if catalog is None:
+            catalog = os.environ.get('GEOTOOL_CATALOG', default_catalog)
+        if isinstance(catalog, str):
+            with open(catalog, 'r') as f:
+                catalog = json.load(f)
+        self.catalog = copy.deepcopy(catalog)
+        self.catalog.setdefault('roots', {})
+        self.catalog.setdefault('defaults', {})
+        self.catalog.setdefault('cube_dir', None)
+        if roots is not None:
+            self.catalog['roots'].update(roots)
+        if cube_dir is not None:
+            self.catalog['cube_dir'] = cube_dir
+        self.scan_dict = {}
+
+    @property
+    def cube_dir(self):
+        return self.catalog['cube_dir']
+
+    def override(self, cube_dir=None, shape_dict=None):
+        """一部の定義を変えたカタログの複製を返す(元のカタログは変更しない)
+
+        Args:
+            cube_dir (str (path), optional): キューブの保存先. Defaults to None (変更しない).
+            shape_dict (dict, optional): 変数ごとの形状の上書き. 例: {'MOD13A1': [2400, 2400]}. Defaults to None.
+        """
+        catalog = copy.deepcopy(self.catalog)
+        for key, shape in (shape_dict or {}).items():
+            catalog['variables'][key]['shape'] = list(shape)
+        return DatasetCatalog(catalog, cube_dir=cube_dir)
+
+    def variable(self, key):
+        """既定値を補った変数の定義を返す"""
+        if key not in self.catalog['variables']:
+            raise KeyError(f'{key} is not registered in the catalog')
+        var = {**default_catalog['defaults'], **self.catalog['defaults'], **self.catalog['variables'][key]}
+        var.setdefault('key', key)
+        return var
+
+    def dtype(self, key):
+        return np.dtype(self.variable(key)['dtype'])
+
+    def shape(self, key):
+        return tuple(self.variable(key)['shape'])
+
+    def geotrans(self, key):
+        geotrans = self.variable(key)['geotrans']
+        return tuple(geotrans) if geotrans is not None else None
+
+    def dir(self, key):
+        """変数の保存先ディレクトリ"""
+        var = self.variable(key)
+        root = self.catalog['roots'].get(var['root'], var['root'])
+        return f'{root}/{var["dir"]}'
+
+    def filename(self, key, date=None):
+        """変数・日付のファイル名"""
+        var = self.variable(key)
+        h, w = var['shape'] if var['shape'] is not None else (None, None)
+        return var['template'].format(key=var['key'], date=date, dtype=var['dtype'], h=h, w=w)
+
+    def path(self, key, date=None):
+        """変数・日付のファイルパス"""
+        return f'{self.dir(key)}/{self.filename(key, date)}'
+
+    def cube_path(self, key):
+        """変数のキューブのパス. キューブの保存先が未設定ならNone"""
+        if self.cube_dir is None:
+            return None
+        return f'{self.cube_dir}/{key}.cube'
+
+    def has_cube(self, key):
+        return (self.cube_path(key) is not None) and os.path.exists(self.cube_path(key))
+
+    def date_arr(self, key, start_year, end_year):
+        """変数の時間間隔に従った, 期間内の日付リストを返す
+
+        Args:
+            key (str): 変数名
+            start_year (int): 開始年
+            end_year (int): 終了年(この年を含む)
+
+        Returns:
+            pandas.DatetimeIndex: 日付リスト
+        """
+        cadence = self.variable(key)['cadence']
+        if cadence=='16days':
+            return pd.to_datetime(
+                [f'{year}/{doy}' for year in range(start_year, end_year+1) for doy in range(1, 366, 16)],
+                format='%Y/%j')
+        elif cadence=='8days':
+            return pd.to_datetime(
+                [f'{year}/{doy}' for year in range(start_year, end_year+1) for doy in range(1, 366, 8)],
+                format='%Y/%j')
+        elif cadence=='daily':
+            return pd.to_datetime(np.arange(
+                datetime.datetime(start_year, 1, 1),
+                datetime.datetime(end_year, 12, 31, 1),
+                datetime.timedelta(days=1)
+            ))
+        elif cadence=='monthly':
+            return pd.date_range(f'{start_year}-01-01', f'{end_year}-12-01', freq='MS')
+        raise ValueError(f'{key} has no date cadence ({cadence})')
+
+    def scan(self, key, rescan=False):
+        """ディレクトリを1回だけ走査し, 存在する日付を調べる
+
+        Args:
+            key (str): 変数名
+            rescan (bool): 走査をやり直すかどうか. Defaults to False.
+
+        Returns:
+            pandas.DatetimeIndex: ファイルが存在する日付
+        """
+        if (key in self.scan_dict) and (not rescan):
+            return self.scan_dict[key]
+
+        var = self.variable(key)
+        match = re.match(r'(.*)\{date:([^}]*)\}(.*)', var['template'])
+        if match is None:
+            raise ValueError(f'{key} has no date in its template ({var["template"]})')
+        head, date_fmt, tail = match.groups()
+        h, w = var['shape'] if var['shape'] is not None else (None, None)
+        fmt_kwargs = dict(key=var['key'], dtype=var['dtype'], h=h, w=w)
+        pattern = re.compile(
+            re.escape(head.format(**fmt_kwargs)) + '(?P<date>.+?)' + re.escape(tail.format(**fmt_kwargs)) + '$'
+        )
+
+        date_ls = []
+        if os.path.isdir(self.dir(key)):
+            with os.scandir(self.dir(key)) as it:
+                for entry in it:
+                    match = pattern.match(entry.name)
+                    if match is None:
+                        continue
+                    try:
+                        date_ls.append(datetime.datetime.strptime(match.group('date'), date_fmt))
+                    except ValueError:
+                        continue
+        self.scan_dict[key] = pd.DatetimeIndex(sorted(date_ls))
+        return self.scan_dict[key]
+
+    def available(self, key, date_arr):
+        """指定した日付のファイルが存在するかどうか(キューブがあればキューブの中身で判定)"""
+        date_arr = pd.to_datetime(date_arr)
+        if self.has_cube(key):
+            cube = RasterCube(self.cube_path(key))
+            return date_arr.isin(cube.date_arr) & ~date_arr.isin(pd.to_datetime(cube.meta['missing']))
+        return date_arr.isin(self.scan(key))
+
+    def fill_value(self, key):
+        """ファイルが無い日付を埋める値"""
+        var = self.variable(key)
+        if var['nodata'] is not None:
+            return var['nodata']
+        return np.nan if np.issubdtype(self.dtype(key), np.floating) else 0
+
+    def read(self, key, date=None):
+        """1日付分の画像を読み込む. ファイルが無ければfill_valueで埋めた画像を返す
+
+        Args:
+            key (str): 変数名
+            date (datetime.datetime, optional): 日付. 'static'な変数はNone
+
+        Returns:
+            Array like (2d): 画像
+        """
+        h, w = self.shape(key)
+        path = self.path(key, date)
+        if not os.path.exists(path):
+            print(f'{path} is not found. filled with {self.fill_value(key)}')
+            return np.full((h, w), self.fill_value(key), dtype=self.dtype(key))
+        return np.fromfile(path, count=h*w, dtype=self.dtype(key)).reshape(h, w)
+
+    def read_points(self, key, rows, cols, date_arr):
+        """複数地点の時系列を読み込む. キューブがあればキューブから, なければ各日付の画像を1回ずつ読み込む
+
+        Args:
+            key (str): 変数名
+            rows (Array like): 画像座標の行番号
+            cols (Array like): 画像座標の列番号
+            date_arr (pandas.DatetimeIndex): 読み込む日付
+
+        Returns:
+            Array like (2d, (地点, T)): 時系列. ファイルが無い日付はfill_value
+        """
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        date_arr = pd.to_datetime(date_arr)
+        if self.has_cube(key):
+            return RasterCube(self.cube_path(key)).get_points(rows, cols, date_arr)
+
+        available_arr = self.available(key, date_arr)
+        if not available_arr.all():
+            print(f'{key}: {(~available_arr).sum()} of {len(date_arr)} dates are not found. filled with {self.fill_value(key)}')
+
+        out_arr = np.full((len(rows), len(date_arr)), self.fill_value(key), dtype=self.dtype(key))
+        for i, (date, available) in enumerate(zip(date_arr, available_arr)):
+            if available:
+                out_arr[:, i] = self.read(key, date)[rows, cols]
+        return out_arr
+
+    def pack_cube(self, key, date_arr, layout='pixel'):
+        """変数のRAWデータをキューブにまとめる
+
+        Args:
+            key (str): 変数名
+            date_arr (pandas.DatetimeIndex): キューブに含める日付
+            layout (str): キューブの並び('pixel' or 'time'). Defaults to 'pixel'.
+        """
+        h, w = self.shape(key)
+        return RasterCube.pack(
+            [self.path(key, date) for date in date_arr], date_arr, self.cube_path(key),
+            dtype=self.dtype(key), h=h, w=w, geotrans=self.geotrans(key),
+            layout=layout, fill_value=self.fill_value(key)
+            )
+
+    def latlon2rowcol(self, key, lat, lon):
+        """緯度経度を変数の画像座標に変換する(0方向への切り捨て)"""
+        x_min, x_d, _, y_max, _, y_d = self.geotrans(key)
+        row = np.asarray((np.asarray(lat) - y_max) / y_d).astype(int)
+        col = np.asarray((np.asarray(lon) - x_min) / x_d).astype(int)
+        return row, col
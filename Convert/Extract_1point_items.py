@@ -5,58 +5,77 @@
 import numpy as np
 from matplotlib import pyplot as plt
 import pandas as pd
+
+from .DatasetCatalog import DatasetCatalog
 # %%
+# 抽出する変数(保存先やdtypeはDatasetCatalogで定義)
+item_ls = ['SPI3', 'mR95pT', 'PRCPTOT', 'NDVI_Smoothed', 'VZI', 'STI', 'PAR', 'MeanTEMP', 'PARRZ']
 
-def Extract_1point_items(lat, lon, area_name, sample_dir_path='./sample/dataset/africa_csv/', lulc=None):
-
-    h,w = 1600, 1500
-    ai_img = np.fromfile(
-        f'D:/ResearchData3/LevelExtra/RAW/AIKoppen.C19912020.float32_h1600w1500.raw',
-        dtype=np.float32
-    ).reshape(h,w)
-    lulc_img = np.fromfile(
-        f'D:/ResearchData3/Level3/MCD12C1/MCD12C1.A2010001.uint8_h1600w1500.raw',
-        dtype=np.uint8
-    ).reshape(h,w)
-    date_arr = pd.to_datetime(
-        [f'{year}/{doy}' for year in range(2001, 2020+1) for doy in range(1, 366, 16)],
-        format='%Y/%j')
-    srs_df = pd.read_csv(f'{sample_dir_path}/srs.csv', index_col=0)  # 座標系の記録
+def Extract_1point_items(lat, lon, area_name, sample_dir_path='./sample/dataset/africa_csv/', lulc=None, cube_dir=None, catalog=None):
+    """指定したlon latの観測情報をcsvにまとめる
+
+    Args:
+        lat (float): 緯度
+        lon (float): 経度
+        area_name (str): 地点名(出力csvのファイル名)
+        sample_dir_path (str, path): 出力先ディレクトリ
+        lulc (str, optional): 土地被覆の名称. Defaults to None.
+        cube_dir (str, path, optional): キューブ(RasterCube)の保存先. キューブがある変数はキューブから読み込む. Defaults to None.
+        catalog (DatasetCatalog, optional): データセットのカタログ. Defaults to None (既定のカタログ).
+    """
+    site_df = pd.DataFrame({'lat': [lat], 'lon': [lon], 'LULC': [lulc]}, index=[area_name])
+    return Extract_multipoint_items(site_df, sample_dir_path, cube_dir, catalog)[area_name]
 
 
-    row, col = int((40-lat)/0.05), int((-20-lon) / (-0.05))  # 画像座標に変換s
+def Extract_multipoint_items(site_df, sample_dir_path='./sample/dataset/africa_csv/', cube_dir=None, catalog=None):
+    """複数地点の観測情報をまとめて抜き出し, 地点ごとのcsvにまとめる
+    各日付の画像は1回だけ読み込み, 全地点の値をまとめて取り出す
 
-    meta_dict = {'SPI3': ['SPI3',           'float32'],
-             'mR95pT'  : ['ccis/mR95pT',    'float64'],
-             'PRCPTOT' : ['ccis/PRCPTOT',   'float64'],
-             'NDVI_Smoothed' : ['NDVI_Smoothed',  'float64'],
-             'VZI'     : ['VZI',            'float32'],
-             'STI'     : ['STI',            'float32'],
-             'PAR'     : ['PAR/JASMES',     'float32'],
-             'MeanTEMP': ['TEMP/MeanTEMP',  'float32'],
-             'PARRZ'   : ['PARRZ',          'float32']
-             }
-    out_df = pd.DataFrame(columns=meta_dict.keys())
+    Args:
+        site_df (pandas.DataFrame): 地点表. indexが地点名, 列に'lat', 'lon'(, 'LULC')を持つ
+        sample_dir_path (str, path): 出力先ディレクトリ
+        cube_dir (str, path, optional): キューブ(RasterCube)の保存先. キューブがある変数はキューブから読み込む. Defaults to None.
+        catalog (DatasetCatalog, optional): データセットのカタログ. Defaults to None (既定のカタログ).
 
+    Returns:
+        out_df_dict (dict, pandas.DataFrame): 地点名をkeyとした観測情報
+    """
 
-    for key, (dir, dtype) in meta_dict.items():
-        for i, date in enumerate(date_arr):
-            get_img = np.fromfile(
-                f'D:/ResearchData3/Level4/MOD16days/{dir}/{key}.A{date.strftime("%Y%j")}.{dtype}_h1600w1500.raw',
-                count=h*w, dtype=dtype
-            ).reshape(h,w)
+    catalog = catalog if catalog is not None else DatasetCatalog()
+    if cube_dir is not None:
+        catalog = catalog.override(cube_dir=cube_dir)  # 渡されたカタログは変更しない
 
-            get_val = get_img[row, col]
-            out_df.loc[date.strftime("%Y/%m/%d"), key] = get_val
+    ai_img = catalog.read('AIKoppen')
+    lulc_img = catalog.read('MCD12C1')
+    date_arr = catalog.date_arr('SPI3', 2001, 2020)
+    srs_df = pd.read_csv(f'{sample_dir_path}/srs.csv', index_col=0)  # 座標系の記録
+
+    lat_arr, lon_arr = site_df['lat'].values, site_df['lon'].values
+    rows, cols = catalog.latlon2rowcol('SPI3', lat_arr, lon_arr)  # 画像座標に変換
 
+    # 変数ごとに(地点, 日付)の値をまとめる(各日付の画像は1回だけ読み込む)
+    val_dict = {}
+    for key in item_ls:
+        val_dict[key] = catalog.read_points(key, rows, cols, date_arr)
         print(key)
-    
-    out_df['NDVI'] = out_df['NDVI_Smoothed']/10000
 
-    srs_df.loc[area_name, ['lat', 'lon', 'LULC']] = lat, lon, lulc
-    srs_df.loc[area_name,['LULC_code', 'KoppenAI']] = lulc_img[row, col], ai_img[row, col]
+    # 地点ごとにcsvを出力
+    out_df_dict = {}
+    for i, area_name in enumerate(site_df.index):
+        out_df = pd.DataFrame(
+            {key: val_arr[i] for key, val_arr in val_dict.items()},
+            index=date_arr.strftime("%Y/%m/%d")
+        )
+        out_df['NDVI'] = out_df['NDVI_Smoothed']/10000
+        out_df.to_csv(f'{sample_dir_path}/{area_name}.csv')
+        print(f'Export {area_name}.csv')
+        out_df_dict[area_name] = out_df
+
+    # 座標系の記録は最後に1回だけ書き出す
+    lulc_arr = site_df['LULC'].values if 'LULC' in site_df.columns else [None]*len(site_df)
+    for area_name, lat, lon, lulc, row, col in zip(site_df.index, lat_arr, lon_arr, lulc_arr, rows, cols):
+        srs_df.loc[area_name, ['lat', 'lon', 'LULC']] = lat, lon, lulc
+        srs_df.loc[area_name,['LULC_code', 'KoppenAI']] = lulc_img[row, col], ai_img[row, col]
     srs_df.to_csv(f'{sample_dir_path}/srs.csv')
-    out_df.to_csv(f'{sample_dir_path}/{area_name}.csv')
-    print(f'Export {area_name}.csv')
 
-    return out_df
\ No newline at end of file
+    return out_df_dict
@@ -3,16 +3,26 @@ import numpy as np
 from matplotlib import pyplot as plt
 import pandas as pd
 
+from .DatasetCatalog import DatasetCatalog
+
 # %%
 class Raster2Arr:
-    def __init__(self):
+    def __init__(self, cube_dir=None, catalog=None):
+        """指定した画像座標の時系列を抜き出す
+
+        Args:
+            cube_dir (str (path), optional): キューブ(RasterCube)の保存先. 指定した場合はキューブから読み込む. Defaults to None.
+            catalog (DatasetCatalog, optional): データセットのカタログ. Defaults to None (既定のカタログ).
+        """
         self.VZI    = None
         self.SPI3   = None
         self.mR95pT = None
         self.NDVI   = None
 
-        self.h      = 1600
-        self.w      = 1500
+        self.catalog = catalog if catalog is not None else DatasetCatalog()
+        if cube_dir is not None:
+            self.catalog = self.catalog.override(cube_dir=cube_dir)  # 渡されたカタログは変更しない
+        self.h, self.w = self.catalog.shape('VZI')
     
     def fit(self, row, col, date_arr):
         
@@ -22,50 +32,22 @@ class Raster2Arr:
         self.capture_NDVI(row, col, date_arr)
         return self
 
+    def capture(self, key, row, col, date_arr):
+        """カタログの変数から1地点の時系列を取得する(キューブがあればキューブから)"""
+        return self.catalog.read_points(key, [row], [col], date_arr)[0].astype(np.float32)
+
     def capture_VZI(self, row, col, date_arr):
         print('Initializing capture VZI...')
-        VZI_ls  = []
-        for date in date_arr:
-            get_img = np.fromfile(
-                f'D:/ResearchData3/Level4/MOD16days/VZI/VZI.A{date.strftime("%Y%j")}.float32_h1600w1500.raw',
-                count=self.h*self.w, dtype=np.float32
-            ).reshape(self.h, self.w)
-
-            VZI_ls.append(get_img[row, col])
-
-        self.VZI = np.array(VZI_ls)
+        self.VZI = self.capture('VZI', row, col, date_arr)
     
     def capture_SPI3(self, row, col, date_arr):
         print('Initializing capture SPI3...')
-        SPI_ls  = []
-        for date in date_arr:
-            get_img = np.fromfile(
-                f'D:/ResearchData3/Level4/MOD16days/SPI3/SPI3.A{date.strftime("%Y%j")}.float32_h1600w1500.raw',
-                count=self.h*self.w, dtype=np.float32
-            ).reshape(self.h,self.w)
-
-            SPI_ls.append(get_img[row, col])
-        self.SPI3 = np.array(SPI_ls)
+        self.SPI3 = self.capture('SPI3', row, col, date_arr)
 
     def capture_mR95pT(self, row, col, date_arr):
         print('Initializing capture mR95pT...')
-        mR95pT_ls  = []
-        for date in date_arr:
-            get_img = np.fromfile(
-                f'D:/ResearchData3/Level4/MOD16days/CCIs/mR95pT/mR95pT.A{date.strftime("%Y%j")}.float64_h1600w1500.raw',
-                count=self.h*self.w, dtype=np.float32
-            ).reshape(self.h,self.w).astype(np.float32)
-            mR95pT_ls.append(get_img[row, col])
-        self.mR95pT = np.array(mR95pT_ls)
+        self.mR95pT = self.capture('mR95pT', row, col, date_arr)
         
     def capture_NDVI(self, row, col, date_arr):
         print('Initializing capture NDVI...')
-        NDVI_ls  = []
-        for date in date_arr:
-            get_img = np.fromfile(
-                f'D:/ResearchData3/Level3/MOD13C1/MOD13C1.A{date.strftime("%Y%j")}.int16_h1600w1500.raw',
-                count=self.h*self.w, dtype=np.int16
-            ).reshape(self.h,self.w).astype(np.float32)
-
-            NDVI_ls.append(get_img[row, col])
-        self.NDVI = np.array(NDVI_ls)
+        self.NDVI = self.capture('MOD13C1', row, col, date_arr)
@@ -9,18 +9,25 @@ import pandas as pd
 import datetime
 import json
 
+from .DatasetCatalog import DatasetCatalog
+
 # %%
 class Raster2Dict:
-    def __init__(self, lat, lon, area_name):
+    def __init__(self, lat, lon, area_name, cube_dir=None, catalog=None):
         """指定した座標のデータをcsvにまとめる
 
         Args:
             lat (float): 指定したい緯度
             lon (float): 指定したい経度
             area_name (str): 地点名
+            cube_dir (str (path), optional): キューブ(RasterCube)の保存先. 指定した場合はキューブから読み込む. Defaults to None.
+            catalog (DatasetCatalog, optional): データセットのカタログ. Defaults to None (既定のカタログ).
         """
         self.lat=lat
         self.lon=lon
+        self.catalog = catalog if catalog is not None else DatasetCatalog()
+        if cube_dir is not None:
+            self.catalog = self.catalog.override(cube_dir=cube_dir)  # 渡されたカタログは変更しない
 
         # メタデータの保存
         self.meta_csv_path = 'C:/Users/koki1/Google ドライブ/develop/ForReseach/sample/dataset/meta.csv'
@@ -34,7 +41,7 @@ class Raster2Dict:
         self.meta_df.loc[area_name, 'lon'] = lon
         self.meta_df.to_csv(self.meta_csv_path)
 
-        self.h, self.w  = 1600, 1500
+        self.h, self.w  = self.catalog.shape('mR95pT')
         self._convert_row_col()  # lat_lon -> row_col
 
 
@@ -47,85 +54,43 @@ class Raster2Dict:
 
     def capture(self):
 
-        # mR95pTの取得
-        self.get_index(
-            key     = 'mR95pT',
-            dir     = 'D:/ResearchData3/Level4/MOD16days/CCIs/mR95pT/',
-            dtype   = 'float64'
-            )
-        
-        # SPI3の取得
-        self.get_index(
-            key     = 'SPI3',
-            dir     = 'D:/ResearchData3/Level4/MOD16days/SPI3/',
-            dtype   = 'float32'
-        )
-
-        # DayLSTZの取得
-        self.get_index(
-            key     = 'DayZ',
-            dir     = 'D:/ResearchData3/Level4/MOD16days/LST/DayZ/',
-            dtype   = 'float32',
-        )
-
-        # VZIの取得
-        self.get_index(
-            key     = 'VZI',
-            dir     = 'D:/ResearchData3/Level4/MOD16days/VZI/',
-            dtype   = 'float32'
-        )
-
-        # DayLSTの取得
-        self.get_index(
-            key     = 'DayLST',
-            dir     = 'D:/ResearchData3/Level3/MOD11C4/DayLST/',
-            dtype   = 'float32'
-        )
-
-        # MaxTEMPの取得
-        self.get_index(
-            key     = 'MaxTemp',
-            dir     = 'D:/ResearchData3/Level3/CPCTemp/MaxTEMP/',
-            dtype   = 'float32'
-        )
-
-        # NDVIの取得
-        self.get_index(
-            key     = 'MOD13C1',
-            dir     = 'D:/ResearchData3/Level3/MOD13C1/',
-            dtype   = 'int16'
-        )
+        # mR95pT, SPI3, DayLSTZ, VZI, DayLST, MaxTEMP, NDVIの取得
+        for key in ['mR95pT', 'SPI3', 'DayZ', 'VZI', 'DayLST', 'MaxTemp', 'MOD13C1']:
+            self.get_index(key)
     
         return self.dataset_df
 
 
 
 
-    def get_index(self, key, dir, dtype):
+    def get_index(self, key):
         """指定したインデックスを取得し、self.dataset_dfにまとめる
+        保存先やdtypeはself.catalogから解決する. キューブがあればキューブから読み込む
 
         Args:
-            key (str): インデックス名
-            dir (str (path)): 保存先ディレクトリのパス
-            dtype (str): データのdtype
+            key (str): インデックス名(カタログの変数名)
 
         Returns:
-            _type_: _description_
+            pandas.DataFrame: self.dataset_df
         """
         print(f'Getting {key} has initialized...')
-        all_img_arr = np.zeros((self.h, self.w, len(self.date_arr)), dtype=np.float32)
-        for c, date in enumerate(self.date_arr):
-            get_img = np.fromfile(
-                f'{dir}/{key}.A{date.strftime("%Y%j")}.{dtype}_h1600w1500.raw',
-                count=self.h * self.w, dtype=dtype
-            ).reshape(self.h, self.w).astype(np.float32)
-            all_img_arr[:,:,c] = get_img
-        
-        self.dataset_df[key] = all_img_arr[self.row, self.col, :]
+        self.dataset_df[key] = self.catalog.read_points(
+            key, [self.row], [self.col], self.date_arr
+        )[0].astype(np.float32)
         return self.dataset_df
 
+    def pack_cube(self, key, layout='pixel'):
+        """指定したインデックスのRAWデータをキューブとしてまとめる
+
+        Args:
+            key (str): インデックス名(カタログの変数名)
+            layout (str): キューブの並び('pixel' or 'time'). Defaults to 'pixel'.
+        """
+        return self.catalog.pack_cube(key, self.date_arr, layout=layout)
+
     def _convert_row_col(self):
-        self.row, self.col = int((self.lat - 40) / (-0.05)), int((self.lon - (-20)) / (0.05))
+        row, col = self.catalog.latlon2rowcol('mR95pT', self.lat, self.lon)
+        self.row, self.col = int(row), int(col)
         return self.row, self.col
 
 # %%
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# RasterCube.py: 日付別のRAWデータを1つのメモリマップファイル(キューブ)にまとめて読み書きする
+
+# %%
+import numpy as np
+import pandas as pd
+import json
+import os
+
+# %%
+class RasterCube:
+    def __init__(self, cube_path, mode='r'):
+        """パック済みのキューブを開く
+
+        Args:
+            cube_path (str, path): キューブ本体(.cube)のパス. インデックス(.json)は同名のものを読む
+            mode (str): メモリマップのモード. 書き込む場合は'r+'. Defaults to 'r'.
+
+        Attributes:
+            .cube_path (str, path)              : キューブ本体のパス
+            .meta (dict)                        : サイドカーインデックスの内容
+            .date_arr (pandas.DatetimeIndex)    : キューブに含まれる日付
+            .dtype (numpy.dtype)                : キューブのdtype
+            .h, .w (int)                        : 画像の高さと幅
+            .layout (str)                       : 'time'なら(T, h, w), 'pixel'なら(h, w, T)の並び
+            .geotrans (tuple)                   : 左上ピクセルの座標情報
+            .cube (numpy.memmap)                : キューブ本体
+        """
+        self.cube_path = cube_path
+        with open(self.index_path(cube_path), 'r') as f:
+            self.meta = json.load(f)
+
+        self.date_arr = pd.to_datetime(self.meta['dates'])
+        self.dtype    = np.dtype(self.meta['dtype'])
+        self.h, self.w = self.meta['shape']
+        self.layout   = self.meta['layout']
+        self.geotrans = tuple(self.meta['geotrans']) if self.meta['geotrans'] is not None else None
+
+        self.cube = np.memmap(
+            cube_path, dtype=self.dtype, mode=mode,
+            shape=self.cube_shape(self.h, self.w, len(self.date_arr), self.layout)
+        )
+
+    @staticmethod
+    def index_path(cube_path):
+        """キューブ本体のパスからサイドカーインデックスのパスを求める"""
+        return os.path.splitext(cube_path)[0] + '.json'
+
+    @staticmethod
+    def cube_shape(h, w, n_dates, layout):
+        if layout=='time':
+            return (n_dates, h, w)
+        elif layout=='pixel':
+            return (h, w, n_dates)
+        raise ValueError(f'layout must be "time" or "pixel" (got {layout})')
+
+    @classmethod
+    def pack(
+        cls, path_ls, date_arr, cube_path, dtype, h, w,
+        geotrans=(-20, 0.05, 0, 40, 0, -0.05), layout='pixel',
+        fill_value=None, block_rows=100
+        ):
+        """日付別のRAWデータを1つのキューブにまとめて保存する
+
+        Args:
+            path_ls (list, str): 日付ごとのRAWデータのパス. date_arrと同じ順番
+            date_arr (pandas.DatetimeIndex): 各RAWデータの日付
+            cube_path (str, path): 出力するキューブのパス(.cube)
+            dtype (str or numpy.dtype): RAWデータのdtype
+            h (int): 画像の高さ
+            w (int): 画像の幅
+            geotrans (set(lon, Δlon, 0, lat, 0, -Δlat)): 左上ピクセルの座標情報
+            layout (str): 'pixel'なら(h, w, T)で保存(地点抽出向き), 'time'なら(T, h, w)で保存(画像読込向き). Defaults to 'pixel'.
+            fill_value (float, optional): ファイルが存在しない日付を埋める値. Defaults to None (float型はnan, 整数型は0).
+            block_rows (int): 'pixel'で保存する際に一度に並べ替える行数. Defaults to 100.
+
+        Returns:
+            RasterCube: 保存したキューブ
+        """
+        dtype = np.dtype(dtype)
+        date_arr = pd.to_datetime(date_arr)
+        if fill_value is None:
+            fill_value = np.nan if np.issubdtype(dtype, np.floating) else 0
+
+        exists_ls = [os.path.exists(path) for path in path_ls]
+        missing_ls = [date.strftime('%Y-%m-%d') for date, exists in zip(date_arr, exists_ls) if not exists]
+
+        os.makedirs(os.path.dirname(os.path.abspath(cube_path)), exist_ok=True)
+        cube = np.memmap(
+            cube_path, dtype=dtype, mode='w+',
+            shape=cls.cube_shape(h, w, len(date_arr), layout)
+        )
+
+        if layout=='time':
+            # 1枚ずつそのまま書き込む
+            for i, (path, exists) in enumerate(zip(path_ls, exists_ls)):
+                if exists:
+                    cube[i] = np.fromfile(path, count=h*w, dtype=dtype).reshape(h, w)
+                else:
+                    cube[i] = fill_value
+        else:
+            # 行ブロックごとに全日付を読み込んで(h, w, T)に並べ替える
+            for row_start in range(0, h, block_rows):
+                rows = min(block_rows, h-row_start)
+                block = np.full((rows, w, len(date_arr)), fill_value, dtype=dtype)
+                for i, (path, exists) in enumerate(zip(path_ls, exists_ls)):
+                    if not exists:
+                        continue
+                    block[:, :, i] = np.fromfile(
+                        path, count=rows*w, dtype=dtype,
+                        offset=row_start*w*dtype.itemsize
+                    ).reshape(rows, w)
+                cube[row_start:row_start+rows] = block
+                print(f'pack {os.path.basename(cube_path)} (row:{row_start+rows}/{h})')  # CHECK LOG
+        cube.flush()
+        del cube
+
+        cls.write_index(cube_path, date_arr, dtype, h, w, geotrans, layout, missing_ls)
+        return cls(cube_path)
+
+    @classmethod
+    def create(cls, cube_path, date_arr, dtype, h, w, geotrans=(-20, 0.05, 0, 40, 0, -0.05), layout='pixel'):
+        """計算結果を書き込むための空のキューブを確保する
+
+        Args:
+            cube_path (str, path): 出力するキューブのパス(.cube)
+            date_arr (pandas.DatetimeIndex): キューブの日付
+            dtype (str or numpy.dtype): キューブのdtype
+            h (int): 画像の高さ
+            w (int): 画像の幅
+            geotrans (set(lon, Δlon, 0, lat, 0, -Δlat)): 左上ピクセルの座標情報
+            layout (str): 'pixel'なら(h, w, T), 'time'なら(T, h, w). Defaults to 'pixel'.
+
+        Returns:
+            RasterCube: 書き込み可能('r+')で開いたキューブ
+        """
+        dtype = np.dtype(dtype)
+        date_arr = pd.to_datetime(date_arr)
+        os.makedirs(os.path.dirname(os.path.abspath(cube_path)), exist_ok=True)
+        cube = np.memmap(cube_path, dtype=dtype, mode='w+', shape=cls.cube_shape(h, w, len(date_arr), layout))
+        cube.flush()
+        del cube
+
+        cls.write_index(cube_path, date_arr, dtype, h, w, geotrans, layout)
+        return cls(cube_path, mode='r+')
+
+    @classmethod
+    def write_index(cls, cube_path, date_arr, dtype, h, w, geotrans, layout, missing_ls=None):
+        """サイドカーインデックス(.json)を書き出す"""
+        meta = {
+            'dates'   : [date.strftime('%Y-%m-%d') for date in date_arr],
+            'missing' : [] if missing_ls is None else list(missing_ls),
+            'dtype'   : np.dtype(dtype).str,
+            'shape'   : [h, w],
+            'layout'  : layout,
+            'geotrans': list(geotrans) if geotrans is not None else None
+        }
+        with open(cls.index_path(cube_path), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    def date_index(self, date_arr=None):
+        """指定した日付のキューブ内インデックスを返す
+
+        Args:
+            date_arr (pandas.DatetimeIndex, optional): 取得したい日付. Defaults to None (全日付).
+        """
+        if date_arr is None:
+            return slice(None)
+        idx = self.date_arr.get_indexer(pd.to_datetime(date_arr))
+        if (idx<0).any():
+            raise KeyError(f'{self.cube_path} does not contain {list(pd.to_datetime(date_arr)[idx<0])}')
+        return idx
+
+    def get_point(self, row, col, date_arr=None):
+        """1地点の時系列を取得する
+
+        Args:
+            row (int): 画像座標の行番号
+            col (int): 画像座標の列番号
+            date_arr (pandas.DatetimeIndex, optional): 取得したい日付. Defaults to None (全日付).
+
+        Returns:
+            Array like (1d): 時系列
+        """
+        t = self.date_index(date_arr)
+        if self.layout=='time':
+            return np.array(self.cube[t, row, col])
+        return np.array(self.cube[row, col, t])
+
+    def get_points(self, rows, cols, date_arr=None):
+        """複数地点の時系列をまとめて取得する
+
+        Args:
+            rows (Array like): 画像座標の行番号
+            cols (Array like): 画像座標の列番号
+            date_arr (pandas.DatetimeIndex, optional): 取得したい日付. Defaults to None (全日付).
+
+        Returns:
+            Array like (2d, (地点, T)): 時系列
+        """
+        t = self.date_index(date_arr)
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        if self.layout=='time':
+            t_idx = np.arange(len(self.date_arr)) if isinstance(t, slice) else t
+            return np.array(self.cube[t_idx[:, None], rows[None, :], cols[None, :]].T)
+        return np.array(self.cube[rows, cols][:, t])
+
+    def get_window(self, row_off, col_off, height, width, date_arr=None):
+        """矩形範囲の時系列を取得する
+
+        Args:
+            row_off (int): 左上の行番号
+            col_off (int): 左上の列番号
+            height (int): 範囲の高さ
+            width (int): 範囲の幅
+            date_arr (pandas.DatetimeIndex, optional): 取得したい日付. Defaults to None (全日付).
+
+        Returns:
+            Array like (3d, (height, width, T)): 矩形範囲の時系列
+        """
+        t = self.date_index(date_arr)
+        if self.layout=='time':
+            return np.array(self.cube[t, row_off:row_off+height, col_off:col_off+width].transpose(1, 2, 0))
+        return np.array(self.cube[row_off:row_off+height, col_off:col_off+width, t])
+
+    def get_frame(self, date):
+        """1日付分の画像を取得する
+
+        Args:
+            date (datetime.datetime): 取得したい日付
+
+        Returns:
+            Array like (2d): 画像
+        """
+        t = self.date_index([date])[0]
+        if self.layout=='time':
+            return np.array(self.cube[t])
+        return np.array(self.cube[:, :, t])
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# WindowReader.py: GeoTIFF / RAWデータをブロック単位の窓で逐次読み込む
+
+# %%
+import numpy as np
+from collections import namedtuple
+import os
+import re
+
+# %%
+# 読み込んだ窓の位置. innerは読み込んだ配列のうち, 重なり(overlap)を除いた中心部分のスライス
+Window = namedtuple('Window', ['row_off', 'col_off', 'height', 'width', 'inner'])
+
+# %%
+class WindowReader:
+    def __init__(self, path, h=None, w=None, dtype=None, n_bands=1, block_size=None, overlap=0, target_mb=16):
+        """ラスタをブロック境界に揃えた窓ごとに読み込む
+
+        Args:
+            path (str, path): GeoTIFF(.tif)またはRAWデータ(.raw)のパス
+            h (int, optional): RAWデータの高さ. Defaults to None (ファイル名の'_h{h}w{w}'から取得).
+            w (int, optional): RAWデータの幅. Defaults to None (ファイル名から取得).
+            dtype (str, optional): RAWデータのdtype. Defaults to None (ファイル名の'.{dtype}_h'から取得).
+            n_bands (int): RAWデータのバンド数. 2以上なら(h, w, n_bands)の並びとみなす. Defaults to 1.
+            block_size (int or set(int, int), optional): 窓の大きさ(高さ, 幅). ファイルのブロックの倍数に切り上げる.
+                Defaults to None (ファイルのブロックを並べて約target_mbになる大きさ).
+            overlap (int): 窓の周囲に余分に読み込むピクセル数. Defaults to 0.
+            target_mb (float): block_size未指定時の1窓あたりの目安サイズ(MB). Defaults to 16.
+
+        Attributes:
+            .h, .w (int)                    : 画像の高さと幅
+            .n_bands (int)                  : バンド数
+            .dtype (numpy.dtype)            : データ型
+            .native_block (set(int, int))   : ファイル上のブロックの大きさ(高さ, 幅)
+            .block_size (set(int, int))     : 窓の大きさ(高さ, 幅)
+        """
+        self.path = path
+        self.overlap = overlap
+        self.is_raw = os.path.splitext(path)[1].lower()=='.raw'
+
+        if self.is_raw:
+            match = re.search(r'\.([a-z]+\d*)_h(\d+)w(\d+)', os.path.basename(path))
+            if match is not None:
+                dtype = match.group(1) if dtype is None else dtype
+                h = int(match.group(2)) if h is None else h
+                w = int(match.group(3)) if w is None else w
+            self.h, self.w, self.n_bands = h, w, n_bands
+            self.dtype = np.dtype(dtype)
+            shape = (h, w) if n_bands==1 else (h, w, n_bands)
+            self.src = np.memmap(path, dtype=self.dtype, mode='r', shape=shape)
+            self.native_block = (1, w)  # RAWは行単位で連続
+        else:
+            from osgeo import gdal, gdal_array
+            self.src = gdal.Open(path)
+            self.h, self.w = self.src.RasterYSize, self.src.RasterXSize
+            self.n_bands = self.src.RasterCount
+            band = self.src.GetRasterBand(1)
+            self.dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+            block_x, block_y = band.GetBlockSize()
+            self.native_block = (block_y, block_x)
+
+        self.block_size = self.align_block_size(block_size, target_mb)
+
+    def align_block_size(self, block_size, target_mb=16):
+        """窓の大きさをファイルのブロックの倍数に揃える"""
+        block_y, block_x = self.native_block
+        if block_size is None:
+            # ブロックを横に全幅まで並べ, 目安サイズになるまで縦に積む
+            if block_x < self.w:
+                block_x = block_x * max(1, int(np.sqrt(target_mb*1024**2 / (block_y*block_x*self.dtype.itemsize*self.n_bands))))
+            n_rows = int(target_mb*1024**2 // (min(block_x, self.w)*self.dtype.itemsize*self.n_bands))
+            block_y = block_y * max(1, n_rows // block_y)
+            return (min(block_y, self.h), min(block_x, self.w))
+
+        if isinstance(block_size, int):
+            block_size = (block_size, block_size)
+        height = int(np.ceil(block_size[0] / block_y)) * block_y
+        width  = int(np.ceil(block_size[1] / block_x)) * block_x
+        return (min(height, self.h), min(width, self.w))
+
+    def windows(self):
+        """窓の位置を順番に返すジェネレータ
+
+        Yields:
+            Window: 窓の位置(重なりを含む)と, 重なりを除いた中心部分のスライス
+        """
+        height, width = self.block_size
+        for row in range(0, self.h, height):
+            for col in range(0, self.w, width):
+                core_h, core_w = min(height, self.h-row), min(width, self.w-col)
+                row_off, col_off = max(0, row-self.overlap), max(0, col-self.overlap)
+                row_end = min(self.h, row+core_h+self.overlap)
+                col_end = min(self.w, col+core_w+self.overlap)
+                inner = (
+                    slice(row-row_off, row-row_off+core_h),
+                    slice(col-col_off, col-col_off+core_w)
+                )
+                yield Window(row_off, col_off, row_end-row_off, col_end-col_off, inner)
+
+    def read(self, window):
+        """窓の範囲を読み込む
+
+        Args:
+            window (Window): 読み込む窓
+
+        Returns:
+            Array like: (height, width) または (height, width, n_bands)
+        """
+        if self.is_raw:
+            return np.array(self.src[window.row_off:window.row_off+window.height, window.col_off:window.col_off+window.width])
+
+        arr = self.src.ReadAsArray(window.col_off, window.row_off, window.width, window.height)
+        if arr.ndim==3:
+            arr = arr.transpose(1, 2, 0)  # (bands, h, w) -> (h, w, bands)
+        return arr
+
+    def __iter__(self):
+        return self.iter_windows()
+
+    def iter_windows(self):
+        """窓ごとに(窓, 配列)を返すジェネレータ
+
+        Yields:
+            (Window, Array like): 窓の位置と読み込んだ配列
+        """
+        for window in self.windows():
+            yield window, self.read(window)
+
+    def apply(self, func, out_path, out_dtype=None, out_bands=1):
+        """窓ごとに関数を適用し, 重なりを除いた中心部分をRAWデータ(メモリマップ)に書き出す
+        メモリ使用量は窓の大きさで抑えられる
+
+        Args:
+            func (function): 配列を受け取り, 同じ高さ・幅の配列を返す関数
+            out_path (str, path): 出力するRAWデータのパス
+            out_dtype (str, optional): 出力のdtype. Defaults to None (入力と同じ).
+            out_bands (int): 出力のバンド数. Defaults to 1.
+
+        Returns:
+            numpy.memmap: 出力データ
+        """
+        out_dtype = self.dtype if out_dtype is None else np.dtype(out_dtype)
+        shape = (self.h, self.w) if out_bands==1 else (self.h, self.w, out_bands)
+        out_arr = np.memmap(out_path, dtype=out_dtype, mode='w+', shape=shape)
+        for window, arr in self.iter_windows():
+            res = func(arr)[window.inner]
+            row_sl, col_sl = window.inner
+            out_arr[
+                window.row_off+row_sl.start:window.row_off+row_sl.stop,
+                window.col_off+col_sl.start:window.col_off+col_sl.stop
+            ] = res
+        out_arr.flush()
+        return out_arr
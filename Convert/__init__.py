@@ -3,7 +3,7 @@ from .nc2tif import Nc2Tif
 from .base import Convert
 from .Raster2Dict import Raster2Dict
 from .Raster2Arr import Raster2Arr
-from .Extract_1point_items import Extract_1point_items
+from .Extract_1point_items import Extract_1point_items, Extract_multipoint_items
 from .MergeTrans import MergeTrans
 from .MakeSentinelDataset import MakeSentinelDataset
 from .MakeProjectDirectory import MakeProjectDirectory
@@ -12,4 +12,7 @@ from .VisualInspectionMaterials import VisualInspectinMaterials
 from .CalcVelocityFromGeoDataFrame import CalcVelocityFromGeoDataFrame
 from .Gpx2GeoDataFrame import Gpx2GeoDataFrame
 from .vec2ras import vec2ras
-from .ras2vec import ras2vec
\ No newline at end of file
+from .ras2vec import ras2vec
+from .RasterCube import RasterCube
+from .DatasetCatalog import DatasetCatalog
+from .WindowReader import WindowReader, Window
\ No newline at end of file
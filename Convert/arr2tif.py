@@ -11,14 +11,27 @@ def arr2tif(
     arr:np.ndarray,
     out_file_path,
     geotrans=(-20, 0.05, 0, 40, 0, -0.05), projection=4326,
+    dtype=None, nodata=None,
+    tiled=False, blocksize=256, compress=None, predictor=None, bigtiff=None,
+    overviews=None, resampling='NEAREST', cog=False,
     ):
     """np.ndarrayをgeotiff形式で保存
 
     Args:
-        arr (np.ndarray): データセット本体.\n
+        arr (np.ndarray): データセット本体. (rows, cols) または (rows, cols, bands).\n
         out_file_path (str): 出力ファイルパス.\n
         geotrans (set(lon, Δlon, 0, lat, 0, -Δlat)): 左上ピクセルの座標情報\n
-        projection (int or str): 座標系.int型ならEPSGコード,strならWktコード. Defaults to 4326.
+        projection (int or str): 座標系.int型ならEPSGコード,strならWktコード. Defaults to 4326.\n
+        dtype (numpy.dtype or int, optional): 出力のデータ型. numpyのdtypeかgdal.GDT_*. Defaults to None (arrのdtype).\n
+        nodata (float, optional): 各バンドのnodata値. Defaults to None.\n
+        tiled (bool): タイル形式で保存するかどうか. Defaults to False (ストリップ形式).\n
+        blocksize (int): タイルの一辺のピクセル数(16の倍数). Defaults to 256.\n
+        compress (str, optional): 圧縮形式('DEFLATE', 'ZSTD', 'LZW'など). Defaults to None (無圧縮).\n
+        predictor (int, optional): 圧縮の予測子. Defaults to None (圧縮時は整数型なら2, 浮動小数点型なら3).\n
+        bigtiff (str, optional): BIGTIFFの作成オプション('YES', 'NO', 'IF_SAFER', 'IF_NEEDED'). Defaults to None.\n
+        overviews (list or str, optional): 内部オーバービューの縮小率. 'auto'ならblocksize未満になるまで2倍ずつ. Defaults to None (作成しない).\n
+        resampling (str): オーバービュー作成時のリサンプリング法. Defaults to 'NEAREST'.\n
+        cog (bool): Cloud Optimized GeoTIFFの配置で保存するかどうか(タイル化とオーバービュー作成を伴う). Defaults to False.
     """
     
     rows, cols = arr.shape[0], arr.shape[1]
@@ -26,18 +39,44 @@ def arr2tif(
         n_bands = arr.shape[2]
     elif arr.ndim==2:
         n_bands = 1
-    driver = gdal.GetDriverByName('GTiff')
-    gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(arr.dtype)  # numpy.dtype をgdal.DataTypeに変換
-    outRaster = driver.Create(out_file_path, cols, rows, n_bands, gdal_type)
-    outRaster.SetGeoTransform(geotrans)
 
-    if arr.ndim==2:
-        outband = outRaster.GetRasterBand(1)
-        outband.WriteArray(arr)
-    elif arr.ndim==3:
-        for i in range(arr.shape[2]):
-            outband = outRaster.GetRasterBand(i+1)
-            outband.WriteArray(arr[:,:,i])
+    # データ型の決定(gdal.GDT_*で指定された場合はnumpyのdtypeに戻す)
+    if dtype is None:
+        dtype = arr.dtype
+    elif isinstance(dtype, int):
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(dtype)
+    dtype = np.dtype(dtype)
+    arr = arr.astype(dtype, copy=False)
+    gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(dtype)  # numpy.dtype をgdal.DataTypeに変換
+
+    # 作成オプション
+    if cog:
+        tiled = True
+        if overviews is None:
+            overviews = 'auto'
+    creation_options = []
+    if tiled:
+        creation_options += ['TILED=YES', f'BLOCKXSIZE={blocksize}', f'BLOCKYSIZE={blocksize}']
+    if compress is not None:
+        if predictor is None:
+            predictor = 3 if np.issubdtype(dtype, np.floating) else 2
+        creation_options += [f'COMPRESS={compress.upper()}', f'PREDICTOR={predictor}']
+    if bigtiff is not None:
+        creation_options += [f'BIGTIFF={bigtiff}']
+    if overviews=='auto':
+        overviews = []
+        factor = 2
+        while max(rows, cols) / factor >= blocksize:
+            overviews.append(factor)
+            factor *= 2
+
+    # COGはメモリ上で作成してからオーバービューごとコピーする
+    if cog:
+        outRaster = gdal.GetDriverByName('MEM').Create('', cols, rows, n_bands, gdal_type)
+    else:
+        driver = gdal.GetDriverByName('GTiff')
+        outRaster = driver.Create(out_file_path, cols, rows, n_bands, gdal_type, options=creation_options)
+    outRaster.SetGeoTransform(geotrans)
 
     # projectionがEPSGコードだった場合の処理
     if type(projection) is int:
@@ -45,5 +84,29 @@ def arr2tif(
         outRasterSRS.ImportFromEPSG(projection)
         projection = outRasterSRS.ExportToWkt()
     outRaster.SetProjection(projection)
-    outband.FlushCache()
+
+    if nodata is not None:
+        for i in range(n_bands):
+            outRaster.GetRasterBand(i+1).SetNoDataValue(nodata)
+
+    # 書き込み(多バンドはデータセットに1回で書き込む)
+    if arr.ndim==2:
+        outRaster.GetRasterBand(1).WriteArray(arr)
+    elif hasattr(outRaster, 'WriteArray'):
+        outRaster.WriteArray(arr.transpose(2, 0, 1))
+    else:
+        for i in range(arr.shape[2]):
+            outRaster.GetRasterBand(i+1).WriteArray(arr[:,:,i])
+
+    if overviews:
+        outRaster.BuildOverviews(resampling, list(overviews))
+
+    if cog:
+        out_cog = gdal.GetDriverByName('GTiff').CreateCopy(
+            out_file_path, outRaster, options=creation_options+['COPY_SRC_OVERVIEWS=YES']
+        )
+        out_cog.FlushCache()
+        del out_cog
+    else:
+        outRaster.FlushCache()
     del outRaster
\ No newline at end of file
@@ -6,6 +6,12 @@
 import numpy as np
 from matplotlib import pyplot as plt
 import glob
+import os
+import json
+import time
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # 自作ツール
 from .arr2tif import arr2tif
@@ -51,17 +57,8 @@ class Convert:
         print(out_file_path)
     
     # [入力]をndarrayに変換して保存(ディレクトリ内)
-    def save_arr_multi(self, in_dir_path, out_dir_path):
-        get_file_ls = glob.glob(in_dir_path+'/*'+self.in_extension)
-        for get_file_name in get_file_ls:
-            in_file_name = get_file_name.split('\\')[-1]
-            in_file_path = in_dir_path + '/' + in_file_name
-
-            self.in2arr(in_file_path)  # self.imgを入手
-            out_file_name = self.make_out_file_name(in_file_name)+self.arr_extension  # 出力画像のファイル名
-            out_file_path = f'{out_dir_path}/{out_file_name}'
-            self.img.tofile(out_file_path)  # ndarrayを保存
-            print(out_file_path)  # DEBUG
+    def save_arr_multi(self, in_dir_path, out_dir_path, n_workers=1, overwrite=False, manifest_path=None):
+        return self.run_multi('arr', in_dir_path, out_dir_path, n_workers, overwrite, manifest_path)
 
     # [入力]を[出力]に変換して保存(1枚だけ)
     def save_out_single(self, in_file_path, out_file_path):
@@ -69,14 +66,140 @@ class Convert:
         self.arr2out(out_file_path)  # self.imgを[出力]に変換する
 
     # [入力]を[出力]に変換して保存(ディレクトリ内)
-    def save_out_multi(self, in_dir_path, out_dir_path):
-        get_file_ls = glob.glob(f'{in_dir_path}/*{self.in_extension}')
-        for get_file_path in get_file_ls:
-            in_file_name = get_file_path.split('\\')[-1]
-            in_file_path = in_dir_path + '/' + in_file_name  # 入力画像のファイルパス
-            self.in2arr(in_file_path)  # [入力] -> self.imgに変換
+    def save_out_multi(self, in_dir_path, out_dir_path, n_workers=1, overwrite=False, manifest_path=None):
+        return self.run_multi('out', in_dir_path, out_dir_path, n_workers, overwrite, manifest_path)
 
-            out_file_name = self.make_out_file_name(in_file_name)+self.out_extension  # 出力画像のファイル名
-            out_file_path = f'{out_dir_path}/{out_file_name}'  # 出力画像のファイルパス
-            self.arr2out(out_file_path)  # 出力
+    # ディレクトリ内のファイルをまとめて変換する(並列・再開可能)
+    def run_multi(self, mode, in_dir_path, out_dir_path, n_workers=1, overwrite=False, manifest_path=None):
+        """ディレクトリ内の[入力]をまとめて変換する
+        変換結果はマニフェスト(jsonl)に1ファイルずつ追記するので, 途中で止まっても続きから再開できる
 
+        Args:
+            mode (str): 'arr'ならndarray(.raw), 'out'なら[出力]で保存する
+            in_dir_path (str, path): 入力ディレクトリ
+            out_dir_path (str, path): 出力ディレクトリ
+            n_workers (int): 並列数. 1ならプロセスプールを使わず逐次処理(Windowsで並列化する場合は呼び出し側を if __name__=='__main__': で囲む). Defaults to 1.
+            overwrite (bool): 変換済み・最新のファイルも再変換するかどうか. Defaults to False.
+            manifest_path (str, path, optional): マニフェストのパス. Defaults to None ({out_dir_path}/convert_manifest_{mode}.jsonl).
+
+        Returns:
+            stats (dict): 処理件数と処理時間の統計
+        """
+        os.makedirs(out_dir_path, exist_ok=True)
+        if manifest_path is None:
+            manifest_path = f'{out_dir_path}/convert_manifest_{mode}.jsonl'
+        done_dict = {} if overwrite else self.load_manifest(manifest_path)
+
+        in_path_ls = sorted(glob.glob(f'{in_dir_path}/*{self.in_extension}'))
+        todo_ls = [in_path for in_path in in_path_ls if not self.is_up_to_date(in_path, done_dict)]
+        print(f'{len(in_path_ls)} files found, {len(in_path_ls)-len(todo_ls)} files are up to date')
+
+        start = time.perf_counter()
+        record_ls = []
+        with open(manifest_path, 'a') as manifest:
+            for record in self.iter_convert(mode, todo_ls, out_dir_path, n_workers):
+                manifest.write(json.dumps(record)+'\n')  # 1ファイルごとに記録
+                manifest.flush()
+                record_ls.append(record)
+                if record['status']=='done':
+                    print(record['out'])
+                else:
+                    print(f'FAILED {record["in"]}: {record["error"]}')
+
+        stats = self.summarize(record_ls, time.perf_counter()-start, len(in_path_ls)-len(todo_ls))
+        return stats
+
+    def iter_convert(self, mode, in_path_ls, out_dir_path, n_workers=1):
+        """ファイルを変換し, 記録をin_path_lsの順に返すジェネレータ
+        プロセスプールには常に2*n_workers件まで投入しておく(途中で例外が起きてもプールは閉じる)
+        """
+        if n_workers==1:
+            for in_path in in_path_ls:
+                yield _convert_file(self, mode, in_path, out_dir_path)
+            return
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            path_iter = iter(in_path_ls)
+            futures = deque([
+                executor.submit(_convert_file, self, mode, in_path, out_dir_path)
+                for in_path in itertools.islice(path_iter, 2*n_workers)
+            ])
+            while len(futures)>0:
+                future = futures.popleft()
+                for in_path in itertools.islice(path_iter, 1):
+                    futures.append(executor.submit(_convert_file, self, mode, in_path, out_dir_path))
+                yield future.result()
+
+    @staticmethod
+    def load_manifest(manifest_path):
+        """マニフェストから変換済みのファイルを読み込む(同じ入力は後の記録を優先)"""
+        done_dict = {}
+        if not os.path.exists(manifest_path):
+            return done_dict
+        with open(manifest_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 書き込み途中で止まった行は無視
+                if record['status']=='done':
+                    done_dict[record['in']] = record
+                else:
+                    done_dict.pop(record['in'], None)
+        return done_dict
+
+    @staticmethod
+    def is_up_to_date(in_path, done_dict):
+        """変換済みで, 出力が入力より新しいかどうか"""
+        if in_path not in done_dict:
+            return False
+        record = done_dict[in_path]
+        if not os.path.exists(record['out']):
+            return False
+        in_stat = os.stat(in_path)
+        return (in_stat.st_size==record['in_size']) & (os.path.getmtime(record['out'])>=in_stat.st_mtime)
+
+    @staticmethod
+    def summarize(record_ls, elapsed, n_skipped):
+        """変換の処理時間・スループットを集計して表示する"""
+        done_ls = [record for record in record_ls if record['status']=='done']
+        seconds_arr = np.array([record['seconds'] for record in done_ls])
+        in_mb = sum([record['in_size'] for record in done_ls]) / 1024**2
+        stats = {
+            'done'          : len(done_ls),
+            'failed'        : len(record_ls) - len(done_ls),
+            'skipped'       : n_skipped,
+            'elapsed'       : elapsed,
+            'files_per_sec' : len(done_ls) / elapsed if elapsed>0 else np.nan,
+            'mb_per_sec'    : in_mb / elapsed if elapsed>0 else np.nan,
+            'file_sec_mean' : np.mean(seconds_arr) if len(seconds_arr)>0 else np.nan,
+            'file_sec_max'  : np.max(seconds_arr) if len(seconds_arr)>0 else np.nan,
+        }
+        print(
+            f'done:{stats["done"]} failed:{stats["failed"]} skipped:{stats["skipped"]} '
+            f'elapsed:{elapsed:.1f}s ({stats["files_per_sec"]:.2f} files/s, {stats["mb_per_sec"]:.1f} MB/s, '
+            f'mean {stats["file_sec_mean"]:.2f} s/file, max {stats["file_sec_max"]:.2f} s/file)'
+        )
+        return stats
+
+
+# %%
+def _convert_file(converter, mode, in_path, out_dir_path):
+    """1ファイルを変換して結果を記録用の辞書で返す(プロセスプールから呼ぶためモジュール直下に置く)"""
+    start = time.perf_counter()
+    in_file_name = os.path.basename(in_path)
+    record = {'in': in_path, 'in_size': os.path.getsize(in_path)}
+    try:
+        converter.in2arr(in_path)  # [入力] -> self.imgに変換
+        extension = converter.arr_extension if mode=='arr' else converter.out_extension
+        out_file_path = f'{out_dir_path}/{converter.make_out_file_name(in_file_name)}{extension}'  # 出力画像のファイルパス
+        if mode=='arr':
+            converter.img.tofile(out_file_path)  # ndarrayを保存
+        else:
+            converter.arr2out(out_file_path)  # 出力
+        record.update({'status': 'done', 'out': out_file_path})
+    except Exception as e:
+        record.update({'status': 'failed', 'error': f'{type(e).__name__}: {e}'})
+    record['seconds'] = time.perf_counter() - start
+    converter.img = None  # メモリの開放
+    return record
@@ -1,5 +1,8 @@
 import numpy as np
+import pandas as pd
+import os
 from ..Analysis import Bin2Cont
+from ..Analysis.Bin2Cont import osero as osero_arr
 
 class Search_near_SPIDrought:
     def __init__(self):
@@ -26,19 +29,31 @@ class Search_near_SPIDrought:
                 out_2d[i,:shiftsize*-1]=0
         return out_2d
     
-    def osero(self, vci_drought):
-        """前後が干ばつで、真ん中が違う点を干ばつに置き換える"""
-        out_ls = []
+    @staticmethod
+    def near_count(spi_drought, start, end):
+        """各時点tについて, [t+start, t+end]の範囲(系列外は除く)の気象干ばつの数を最終軸の累積和で求める
+        shift_2dの各行を足し合わせたものと同じ(0以外を干ばつとして数える)
+
+        Args:
+            spi_drought (Array like): (..., T)の気象干ばつの発生の有無
+            start (int): 探索範囲の開始ポイント
+            end (int): 探索範囲の終了ポイント
+
+        Returns:
+            Array like: (..., T)の範囲内の気象干ばつの数
+        """
+        spi_drought = np.asarray(spi_drought)
+        t = spi_drought.shape[-1]
+        pad = np.zeros(spi_drought.shape[:-1] + (1,), dtype=int)
+        drought_cumsum = np.concatenate([pad, np.cumsum(spi_drought!=0, axis=-1)], axis=-1)
+        time_arr = np.arange(t)
+        lower = np.clip(time_arr+start, 0, t)
+        upper = np.clip(time_arr+end+1, 0, t)
+        return np.where(upper>lower, drought_cumsum[..., upper]-drought_cumsum[..., lower], 0)
 
-        for i, val in enumerate(vci_drought):
-            if (i==0)|(i==(len(vci_drought)-1)):
-                out_ls.append(val)
-                continue
-            if (vci_drought[i-1]==1)&(vci_drought[i+1]==1):
-                out_ls.append(1)
-                continue
-            out_ls.append(val)
-        return np.array(out_ls)
+    def osero(self, vci_drought):
+        """前後が干ばつで、真ん中が違う点を干ばつに置き換える((N, T)なら最終軸ごと)"""
+        return osero_arr(vci_drought)
 
 
     def fit(self, vci_drought, spi_drought, start, end, vci_size=2, osero=False):
@@ -54,11 +69,90 @@ class Search_near_SPIDrought:
         if osero:
             vci_drought = self.osero(vci_drought)
         b2c_vci = Bin2Cont().fit(vci_drought)
-        shifted_ts = self.shift_2d(spi_drought, start, end)
+        near = self.near_count(spi_drought, start, end)>0
 
         term = vci_drought.astype(bool)&(b2c_vci.serial==1)&(b2c_vci.len_arr>=vci_size)
 
-        self.include_spi_drought = shifted_ts[:,term].any(axis=0)
+        self.include_spi_drought = near[term]
         self.term = term
 
-        return shifted_ts[:,term].any(axis=0)
+        return near[term]
+
+    def fit_grid(
+        self, vci_drought, spi_drought, start, end, vci_size=2, osero=False,
+        date_arr=None, block_rows=256, out_dir=None, geotrans=None, keep_cube=False
+        ):
+        """全ピクセルについて, 農業干ばつの発生時期周辺で気象干ばつが発生しているかどうかを判断する(fitのグリッド版)
+        探索範囲のずらしは作らず, 気象干ばつの累積和の差で範囲内の発生数を求める.
+        行ブロックごとに読み込み, ラスタとイベント表もブロックごとに作るので, (h, w, T)の配列は確保しない
+
+        Args:
+            vci_drought (Array like): (h, w, T)の農業干ばつの発生の有無(RasterCube.cubeなどのメモリマップも可)
+            spi_drought (Array like): (h, w, T)の気象干ばつの発生の有無
+            start (int): 探索の開始ポイント
+            end (int): 探索の終了ポイント
+            vci_size (int, optional): 農業干ばつの最小期間長. Defaults to 2.
+            osero (bool, optional): 前後が干ばつの点を干ばつに置き換えるかどうか. Defaults to False.
+            date_arr (Array like, optional): 最終軸の日付. 指定するとイベント表に日付を入れる. Defaults to None.
+            block_rows (int, optional): 1度に処理する行数. Defaults to 256.
+            out_dir (str, optional): 指定するとラスタ(n_onset.tif, n_include.tif, include_rate.tif)とイベント表(events.csv)を保存する. Defaults to None.
+            geotrans (set(lon, Δlon, 0, lat, 0, -Δlat), optional): 保存するラスタの座標情報. Defaults to None (arr2tifの既定値).
+            keep_cube (bool, optional): ピクセル・時点ごとの判定結果(.term, .include_spi_drought)を(h, w, T)で保持するかどうか. Defaults to False.
+
+        Attributes:
+            .term (Array like, (h, w, T))                   : 農業干ばつ(vci_size以上)の開始時点(keep_cube=Trueのときのみ)
+            .include_spi_drought (Array like, (h, w, T))    : 開始時点の周辺で気象干ばつが発生しているかどうか(keep_cube=Trueのときのみ)
+            .raster_dict (dict)                             : ピクセルごとの開始回数(n_onset), 気象干ばつを伴う回数(n_include), その割合(include_rate)
+            .event_df (pandas.DataFrame)                    : 開始時点ごとのイベント表(row, col, t, date, vci_length, include_spi_drought)
+
+        Returns:
+            pandas.DataFrame: イベント表
+        """
+        h, w, t = vci_drought.shape
+        if keep_cube:
+            self.term = np.zeros((h, w, t), dtype=bool)
+            self.include_spi_drought = np.zeros((h, w, t), dtype=bool)
+        n_onset = np.zeros((h, w), dtype=np.int32)
+        n_include = np.zeros((h, w), dtype=np.int32)
+        event_ls = []
+
+        for row in range(0, h, block_rows):
+            vci_block = np.asarray(vci_drought[row:row+block_rows])
+            if osero:
+                vci_block = self.osero(vci_block)
+            b2c_vci = Bin2Cont().fit(vci_block)
+            term = vci_block.astype(bool)&(b2c_vci.serial==1)&(b2c_vci.len_arr>=vci_size)
+            include = term & (self.near_count(np.asarray(spi_drought[row:row+block_rows]), start, end)>0)
+            if keep_cube:
+                self.term[row:row+block_rows] = term
+                self.include_spi_drought[row:row+block_rows] = include
+
+            n_onset[row:row+block_rows] = term.sum(axis=-1)
+            n_include[row:row+block_rows] = include.sum(axis=-1)
+            row_idx, col_idx, t_idx = np.nonzero(term)
+            event_ls.append(pd.DataFrame({
+                'row'                   : (row_idx + row).astype(np.int32),
+                'col'                   : col_idx.astype(np.int32),
+                't'                     : t_idx.astype(np.int32),
+                'vci_length'            : b2c_vci.len_arr[row_idx, col_idx, t_idx].astype(np.int32),
+                'include_spi_drought'   : include[row_idx, col_idx, t_idx],
+            }))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            include_rate = np.where(n_onset>0, n_include/n_onset, np.nan)
+        self.raster_dict = {'n_onset': n_onset, 'n_include': n_include, 'include_rate': include_rate}
+
+        self.event_df = pd.concat(event_ls, ignore_index=True)
+        if date_arr is not None:
+            self.event_df.insert(3, 'date', pd.to_datetime(date_arr)[self.event_df['t'].values])
+
+        if out_dir is not None:
+            from ..Convert.arr2tif import arr2tif
+            os.makedirs(out_dir, exist_ok=True)
+            geotrans_kwargs = {} if geotrans is None else {'geotrans': geotrans}
+            arr2tif(n_onset, f'{out_dir}/n_onset.tif', **geotrans_kwargs)
+            arr2tif(n_include, f'{out_dir}/n_include.tif', **geotrans_kwargs)
+            arr2tif(include_rate.astype(np.float32), f'{out_dir}/include_rate.tif', nodata=np.nan, **geotrans_kwargs)
+            self.event_df.to_csv(f'{out_dir}/events.csv', index=False)
+
+        return self.event_df
\ No newline at end of file
@@ -8,9 +8,15 @@ NDVI異常を検出するためのクラス
 
 # %%
 import numpy as np
+import pandas as pd
 from scipy import stats
 from statsmodels.tsa.seasonal import STL
-from ..Smoothing import whittaker_smooth
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import itertools
+import os
+from ..Smoothing import whittaker_smooth, whittaker_smooth_batch, whittaker_smooth_weighted
+from ..Convert.RasterCube import RasterCube
 
 # %%
 class ExtractNDVIAnomaly:
@@ -32,7 +38,8 @@ class ExtractNDVIAnomaly:
         平滑化手法
 
     seasonal_adjustment_method : function
-        季節調整法
+        季節調整法. STLのほか, SeasonalDecompositionのHarmonicDecomposition,
+        MovingAverageDecomposition(全ピクセルをまとめて処理できる)を設定できる
 
     """
 
@@ -59,6 +66,7 @@ class ExtractNDVIAnomaly:
             解析対象のndvi 配列
         smoothing_kwargs : dict, default None
             平滑化のパラメータ(辞書型)
+            Noneの場合, 欠損(nan)の重みを0としたwhittaker_smooth_weightedでλをGCVにより自動選択する
 
         Returns
         -------
@@ -70,7 +78,10 @@ class ExtractNDVIAnomaly:
         if ndvi_arr is not None:
             self.ndvi_arr = ndvi_arr
 
-        smoothed_arr = self.smoothing_method(self.ndvi_arr, **smoothing_kwargs)  # 平滑化の実行
+        if smoothing_kwargs is None and self.smoothing_method is whittaker_smooth:
+            smoothed_arr = whittaker_smooth_weighted(self.ndvi_arr)  # λを自動選択して平滑化
+        else:
+            smoothed_arr = self.smoothing_method(self.ndvi_arr, **(smoothing_kwargs or {}))  # 平滑化の実行
         seasonalized_res = self.seasonal_adjustment_method(smoothed_arr, period=self.period).fit()  # 季節調整の実行
 
         # ここからanomalyの計算
@@ -116,6 +127,150 @@ class ExtractNDVIAnomaly:
         return lulc_sim_ls
 
 
+    def fit_cube(
+        self, ndvi_cube, smoothing_kwargs=None, p=0.05, n_workers=1, chunk_size=2000,
+        out_path=None, start_year=2001, geotrans=(-20, 0.05, 0, 40, 0, -0.05)
+        ):
+        """
+        (h, w, T)のndviキューブの全ピクセルに平滑化, 季節調整, 異常検知を適用する
+
+        Parameters
+        ----------
+        ndvi_cube : numpy.array or numpy.memmap or RasterCube
+            解析対象のndviキューブ. 配列なら(h, w, T), RasterCubeなら全日付を使う
+        smoothing_kwargs : dict, default None
+            平滑化のパラメータ(辞書型). fitと同じ
+        p : float, default 0.05
+            統計検定に利用するp値
+        n_workers : int, default 1
+            並列数. 1ならプロセスプールを使わず逐次処理. プールに投入するチャンクは2*n_workers個まで
+        chunk_size : int, default 2000
+            1タスクで処理するピクセル数. キューブはチャンクごとに読み込むので, メモリ使用量はチャンクの数で決まる
+        out_path : str, default None
+            lulc_simの保存先. '.tif'ならGeoTIFF(バンド=年), '.cube'ならRasterCube(h, w, 年)で保存する
+        start_year : int, default 2001
+            最初の年(出力の日付に使う). RasterCubeの場合はキューブの日付から取得する
+        geotrans : set(lon, Δlon, 0, lat, 0, -Δlat)
+            出力の座標情報. RasterCubeの場合はキューブのものを使う
+
+        Returns
+        -------
+        lulc_sim_arr : numpy.array
+            (h, w, 年)の前年とのseasonal成分の近似度
+
+        Notes
+        -----
+        lulc_sim_arrはself.anomaly_dictにkey='lulc_sim'として記録
+        """
+
+        if isinstance(ndvi_cube, RasterCube):
+            start_year = ndvi_cube.date_arr[0].year
+            geotrans = ndvi_cube.geotrans
+            h, w = ndvi_cube.h, ndvi_cube.w
+            pixel_layout = ndvi_cube.layout=='pixel'
+            cube = ndvi_cube.cube
+        else:
+            h, w = ndvi_cube.shape[:2]
+            pixel_layout = True
+            cube = ndvi_cube
+        # メモリマップのままピクセル軸を1次元にする(どちらのレイアウトでもビューになる)
+        if pixel_layout:
+            t = cube.shape[-1]
+            flat_cube = cube.reshape(h*w, t)
+        else:
+            t = cube.shape[0]
+            flat_cube = cube.reshape(t, h*w)
+        n_years = t // self.period
+
+        def read_chunk(start):
+            """チャンク(ピクセル, T)だけを読み込む"""
+            if pixel_layout:
+                return np.array(flat_cube[start:start+chunk_size])
+            return np.array(flat_cube[:, start:start+chunk_size].T)
+
+        if out_path is not None and os.path.splitext(out_path)[1]=='.cube':
+            date_arr = pd.date_range(f'{start_year}-01-01', periods=n_years, freq='YS')
+            out_cube = RasterCube.create(out_path, date_arr, np.float32, h, w, geotrans, layout='pixel')
+            lulc_sim_arr = out_cube.cube.reshape(h*w, n_years)
+        else:
+            lulc_sim_arr = np.full((h*w, n_years), np.nan)
+
+        args = (self.period, self.smoothing_method, smoothing_kwargs, self.seasonal_adjustment_method, p)
+        starts = range(0, h*w, chunk_size)
+        if n_workers==1:
+            for i, start in enumerate(starts):
+                lulc_sim_chunk = _fit_chunk(start, read_chunk(start), *args)[1]
+                lulc_sim_arr[start:start+len(lulc_sim_chunk)] = lulc_sim_chunk
+                print(f'fit_cube ({i+1}/{len(starts)})')  # CHECK LOG
+        else:
+            # 読み込んだチャンクが溜まらないよう, 投入済みのタスクを2*n_workers個までにする
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                start_iter = iter(starts)
+                futures = deque([
+                    executor.submit(_fit_chunk, start, read_chunk(start), *args)
+                    for start in itertools.islice(start_iter, 2*n_workers)
+                ])
+                i = 0
+                while len(futures)>0:
+                    start, lulc_sim_chunk = futures.popleft().result()
+                    for next_start in itertools.islice(start_iter, 1):
+                        futures.append(executor.submit(_fit_chunk, next_start, read_chunk(next_start), *args))
+                    lulc_sim_arr[start:start+len(lulc_sim_chunk)] = lulc_sim_chunk
+                    i += 1
+                    print(f'fit_cube ({i}/{len(starts)})')  # CHECK LOG
+
+        lulc_sim_arr = lulc_sim_arr.reshape(h, w, n_years)
+        if out_path is not None:
+            if os.path.splitext(out_path)[1]=='.cube':
+                out_cube.cube.flush()
+                lulc_sim_arr = np.array(lulc_sim_arr)
+            else:
+                from ..Convert.arr2tif import arr2tif
+                arr2tif(lulc_sim_arr.astype(np.float32), out_path, geotrans=geotrans, nodata=np.nan)
+
+        self.anomaly_dict['lulc_sim'] = lulc_sim_arr
+        return lulc_sim_arr
+
+    @staticmethod
+    def spearman_by_year(seasonal_arr, period, p=0.05):
+        """
+        全ピクセル・全年について前年とのスピアマンの順位相関をまとめて計算する
+
+        Parameters
+        ----------
+        seasonal_arr : numpy.array
+            (N, T)のseasonal成分. Tはperiodの倍数
+        period : int
+            データのサンプリング周期
+        p : float, default 0.05
+            統計検定に利用するp値
+
+        Returns
+        -------
+        lulc_sim_arr : numpy.array
+            (N, 年)の前年との順位相関係数. 最初の年は1, 有意でない場合はnan
+            (extract_lulc_changeのstats.spearmanrと同じ順位(同順位は平均)とt分布による検定)
+        """
+
+        n = seasonal_arr.shape[0]
+        year_arr = seasonal_arr.reshape(n, -1, period)  # (N, 年, sampling日)
+        rank_arr = stats.rankdata(year_arr, axis=-1)
+        rank_arr[np.isnan(year_arr).any(axis=-1)] = np.nan  # 欠損を含む年は計算しない
+        rank_arr = rank_arr - rank_arr.mean(axis=-1, keepdims=True)
+
+        before_rank, after_rank = rank_arr[:, :-1], rank_arr[:, 1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.sum(before_rank*after_rank, axis=-1) / np.sqrt(
+                np.sum(before_rank**2, axis=-1) * np.sum(after_rank**2, axis=-1)
+            )
+            r = np.clip(r, -1, 1)
+            dof = period - 2
+            t_value = r * np.sqrt(dof / ((r+1)*(1-r)))
+        p_value = 2 * stats.t.sf(np.abs(t_value), dof)
+
+        lulc_sim_arr = np.where(p_value<p, r, np.nan)  # 帰無仮説を棄却できない場合はnull埋め
+        return np.concatenate([np.ones((n, 1)), lulc_sim_arr], axis=1)
+
     def test(self):
         """
         テスト用関数
@@ -123,6 +278,29 @@ class ExtractNDVIAnomaly:
         print('test')
 
 
-    
+# %%
+def _fit_chunk(start, ndvi_chunk, period, smoothing_method, smoothing_kwargs, seasonal_adjustment_method, p):
+    """ピクセルのチャンクに平滑化, 季節調整, 異常検知を適用する(プロセスプールから呼ぶためモジュール直下に置く)"""
+    # 平滑化は全ピクセル分をまとめて解く
+    if smoothing_method is whittaker_smooth:
+        if smoothing_kwargs is None:
+            smoothed_chunk = whittaker_smooth_weighted(ndvi_chunk)
+        else:
+            smoothed_chunk = whittaker_smooth_batch(ndvi_chunk, **smoothing_kwargs)
+    else:
+        smoothed_chunk = np.array([smoothing_method(ndvi, **(smoothing_kwargs or {})) for ndvi in ndvi_chunk])
+
+    detrended_chunk = np.full(smoothed_chunk.shape, np.nan)
+    valid = ~np.isnan(smoothed_chunk).any(axis=1)
+    if getattr(seasonal_adjustment_method, 'supports_batch', False):
+        # 全ピクセルをまとめて季節調整する
+        seasonalized_res = seasonal_adjustment_method(smoothed_chunk[valid], period=period).fit()
+        detrended_chunk[valid] = smoothed_chunk[valid] - seasonalized_res.trend
+    else:
+        for i in np.where(valid)[0]:
+            seasonalized_res = seasonal_adjustment_method(smoothed_chunk[i], period=period).fit()
+            detrended_chunk[i] = smoothed_chunk[i] - seasonalized_res.trend
 
-    
\ No newline at end of file
+    n_years = ndvi_chunk.shape[1] // period
+    lulc_sim_chunk = ExtractNDVIAnomaly.spearman_by_year(detrended_chunk[:, :n_years*period], period, p)
+    return start, lulc_sim_chunk
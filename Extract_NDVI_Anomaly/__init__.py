@@ -1 +1,2 @@
-from .Extract_NDVI_Anomaly import ExtractNDVIAnomaly
\ No newline at end of file
+from .Extract_NDVI_Anomaly import ExtractNDVIAnomaly
+from .SeasonalDecomposition import HarmonicDecomposition, MovingAverageDecomposition
\ No newline at end of file
@@ -6,10 +6,13 @@
 from turtle import circle
 import numpy as np
 from matplotlib import pyplot as plt
-import glob
 import cv2
-import threading
 import datetime
+import itertools
+import time
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import warnings
 warnings.simplefilter('ignore')
@@ -19,12 +22,21 @@ else:
     from . import calc_sinh
 
 # %% 
-def get_circle_img(dir_path='E:/ResearchData4/Level1/circle_img/', degree_ls = [75]):
+# JPEGを縮小して読み込む場合のcv2.imreadのフラグ(1/reduce)
+reduce_flag_dict = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def get_circle_img(dir_path='E:/ResearchData4/Level1/circle_img/', degree_ls = [75], reduce=1):
     """サークル画像を入手する
 
     Args:
         dir_path (str, optional): サークル画像が保存されたディレクトリパス.
         degree_ls (list, optional): サークル画像の開口度. Defaults to [75].
+        reduce (int, optional): 全天画像を1/reduceに縮小して読み込む場合の縮小率(1, 2, 4, 8). JPEGの縮小読み込みと同じ大きさ(切り上げ)に最近傍で縮小する. Defaults to 1.
 
     Returns:
         circle_img_dict (dictionary, Array like)    : サークル画像
@@ -35,6 +47,9 @@ def get_circle_img(dir_path='E:/ResearchData4/Level1/circle_img/', degree_ls = [
     for degree in degree_ls:
         file_path = f'{dir_path}/Mask{degree}circle.tif'
         circle_3d = cv2.imread(file_path)
+        if reduce!=1:
+            h, w = circle_3d.shape[:2]
+            circle_3d = cv2.resize(circle_3d, (-(-w//reduce), -(-h//reduce)), interpolation=cv2.INTER_NEAREST)
         circle_2d = np.where(circle_3d[:,:,0]==0, np.nan, 1).astype(np.float32)
         circle_dict[degree] = [
             circle_2d,
@@ -42,13 +57,61 @@ def get_circle_img(dir_path='E:/ResearchData4/Level1/circle_img/', degree_ls = [
             ]
     return circle_dict
 
+def make_circle_label(circle_dict):
+    """サークル画像から, 各ピクセルが入る最も小さいサークルの番号を持つラベル画像(1次元)を作る
+    サークルが同心円で入れ子になっていれば, 1回のbincountで全サークルのヒストグラムが求まる
+
+    Args:
+        circle_dict (dict): get_circle_imgで入手したサークル画像のディクショナリ
+
+    Returns:
+        dict: 'keys'(面積の小さい順のサークルのキー), 'nested'(入れ子かどうか),
+            'label'(ラベル画像. どのサークルにも入らないピクセルはサークルの数),
+            'index_ls'(入れ子でない場合に使う, サークルごとのピクセル番号)
+    """
+    key_ls = sorted(circle_dict.keys(), key=lambda key: circle_dict[key][1])
+    mask_ls = [(circle_dict[key][0]==1).ravel() for key in key_ls]
+    nested = all([np.all(inner<=outer) for inner, outer in zip(mask_ls[:-1], mask_ls[1:])])
+
+    label = np.full(mask_ls[0].shape, len(key_ls), dtype=np.int32)
+    index_ls = None
+    if nested:
+        for i in range(len(key_ls))[::-1]:  # 外側から順に小さいサークルの番号で上書きする
+            label[mask_ls[i]] = i
+    else:
+        index_ls = [np.flatnonzero(mask) for mask in mask_ls]
+    return {'keys': key_ls, 'nested': nested, 'label': label, 'index_ls': index_ls}
+
+def circle_histogram(bi_flat, circle_label, valid=None):
+    """サークルごとのBI値(0-255)のヒストグラム
+
+    Args:
+        bi_flat (Array like (1d, uint8)): BI画像を1次元にしたもの
+        circle_label (dict): make_circle_labelの戻り値
+        valid (Array like (1d, bool), optional): 使用するピクセル. Defaults to None (全ピクセル).
+
+    Returns:
+        Array like: (サークルの数, 256)のヒストグラム(circle_label['keys']の順)
+    """
+    n_circles = len(circle_label['keys'])
+    if circle_label['nested']:
+        label = circle_label['label'] if valid is None else np.where(valid, circle_label['label'], n_circles)
+        hist_arr = np.bincount(label*256 + bi_flat, minlength=(n_circles+1)*256).reshape(n_circles+1, 256)
+        return np.cumsum(hist_arr[:n_circles], axis=0)  # 内側のサークルのピクセルを外側に足し込む
+
+    hist_ls = []
+    for index_arr in circle_label['index_ls']:
+        value_arr = bi_flat[index_arr] if valid is None else bi_flat[index_arr][valid[index_arr]]
+        hist_ls.append(np.bincount(value_arr, minlength=256))
+    return np.array(hist_ls)
+
 # %%
-class ProcessWsiImage(threading.Thread):
+class ProcessWsiImage:
     """BI値を計算する
 
     """
 
-    def __init__(self, wsi_path=None, masking=True, circle_dict=None, threshold_area=0.95):
+    def __init__(self, wsi_path=None, masking=True, circle_dict=None, threshold_area=0.95, circle_label=None, reduce=1):
         """RGB画像からBI画像を作成する
         しきい値を設定することでカラス抜き画像や白飛び抜き画像を作成する
 
@@ -57,6 +120,8 @@ class ProcessWsiImage(threading.Thread):
             masking (bool): マスキングを実行するかどうか
             circle_dict (dict): サークル画像のディクショナリ
             threshold_area (float): 使用可能となる画素の面積
+            circle_label (dict, optional): make_circle_labelで作成したラベル. Defaults to None (必要なときに作成).
+            reduce (int, optional): 全天画像(JPEG)を1/reduceに縮小して読み込む(1, 2, 4, 8). サークル画像も同じ縮小率で作成しておく. Defaults to 1.
 
         Attributes:
             .wsi_path (str)                         : 全天画像のパス
@@ -72,7 +137,6 @@ class ProcessWsiImage(threading.Thread):
             .used_area_rate (float)                 : 使用できるピクセルの割合
             .masking_flag (bool)                    : マスキングを実行するかどうか Default to True.
         """
-        super().__init__()  # スレッドクラスをオーバーライド
         self.wsi_path               = wsi_path      # 全天画像のパスを保持
         self.circle_dict            = circle_dict   # サークル画像のディクショナリ
         self.wsi_3d                 = None          # 使用する全天画像(RGB画像)
@@ -82,6 +146,8 @@ class ProcessWsiImage(threading.Thread):
         self.used_bi                = True          # BIの計算に使用できるかどうかを判定する
         self.masking_flag           = masking       # minmaxでマスキングを実行するかどうか
         self.threshold_area         = threshold_area
+        self.circle_label           = circle_label  # サークルのラベル画像
+        self.reduce                 = reduce        # 読み込み時の縮小率
 
     def run(self):
         """実行用メソッド
@@ -99,12 +165,27 @@ class ProcessWsiImage(threading.Thread):
         
         self.masking_circle(area=self.threshold_area)
 
-    def get_wsi_img(self, path):
+    def process(self):
+        """BI画像の作成からサークルごとの統計量の算出まで行う(マスキングした画像は作らない)
+
+        Returns:
+            dict: サークルごとの統計量(circle_statsの戻り値)
+        """
+        self.get_wsi_img(self.wsi_path, rgb=False)  # BIはチャンネルの順番によらないので色変換しない
+        self.calc_bi_img()
+        return self.circle_stats(area=self.threshold_area)
+
+    def get_wsi_img(self, path, rgb=True):
         """指定パスの全天画像をメモリに取り込む
         Args:
             path (str): 全天画像のパス(全天画像はjpg or png or tif)
+            rgb (bool, optional): RGBの順に並べ替えるかどうか. FalseならOpenCVのBGRのまま. Defaults to True.
         """
-        self.wsi_3d = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+        self.wsi_3d = cv2.imread(path, reduce_flag_dict[self.reduce])
+        if self.wsi_3d is None:
+            raise ValueError(f'cannot read image: {path}')
+        if rgb:
+            self.wsi_3d = cv2.cvtColor(self.wsi_3d, cv2.COLOR_BGR2RGB)
     
     def bi_masking_minmax(self, min=15, max=250):
         """指定強度のピクセルを用いて画像を再構成
@@ -127,11 +208,16 @@ class ProcessWsiImage(threading.Thread):
 
     def calc_bi_img(self):
         """取り込んでいるWSIイメージからBI画像を算出
+        BI = (R+G+B)//3 をuint16の整数演算で求める(チャンネルの順番によらない)
 
         Returns:
             Array like(2d, uint8); BIイメージ画像
         """
-        self.bi_img = np.nansum(self.wsi_3d/3, axis=2).astype(np.uint8)
+        sum_img = self.wsi_3d[:, :, 0].astype(np.uint16)
+        sum_img += self.wsi_3d[:, :, 1]
+        sum_img += self.wsi_3d[:, :, 2]
+        sum_img //= 3
+        self.bi_img = sum_img.astype(np.uint8)
         return self.bi_img
     
     def masking_circle(self, area=0.95):
@@ -149,39 +235,148 @@ class ProcessWsiImage(threading.Thread):
                 available_rate>area
             ]
 
+    def circle_stats(self, area=0.95, min=15, max=250):
+        """サークル内の有効なピクセルの統計量を求める. 複数枚の画像の統計量はこれらを足し合わせて求められる
+        BI画像(uint8)のサークル別ヒストグラムから求めるので, nanの画像は作らない
+
+        Args:
+            area (float): 使用可能となる画素の面積. Defaults to 0.95.
+            min (int, optional): マスキングする場合の下限(この値は含まない). Defaults to 15.
+            max (int, optional): マスキングする場合の上限(この値は含まない). Defaults to 250.
+
+        Returns:
+            dict: サークルごとの{'used'(使用可能か), 'count'(ピクセル数), 'sum'(合計), 'sumsq'(二乗和), 'max', 'min'}
+        """
+        if self.circle_label is None:
+            self.circle_label = make_circle_label(self.circle_dict)
+        bi_flat = self.bi_img.ravel()
+        valid = (bi_flat>min)&(bi_flat<max) if self.masking_flag else None
+        hist_arr = circle_histogram(bi_flat, self.circle_label, valid)
+
+        value_arr = np.arange(256)
+        count_arr = hist_arr.sum(axis=1)
+        sum_arr = hist_arr @ value_arr
+        sumsq_arr = hist_arr @ value_arr**2
+        nonzero = hist_arr>0
+        max_arr = 255 - np.argmax(nonzero[:, ::-1], axis=1)
+        min_arr = np.argmax(nonzero, axis=1)
+
+        stats_dict = {}
+        for i, key in enumerate(self.circle_label['keys']):
+            stats_dict[key] = {
+                'used' : count_arr[i]/self.circle_dict[key][1] > area,
+                'count': int(count_arr[i]),
+                'sum'  : float(sum_arr[i]),
+                'sumsq': float(sumsq_arr[i]),
+                'max'  : float(max_arr[i]) if count_arr[i]>0 else np.nan,
+                'min'  : float(min_arr[i]) if count_arr[i]>0 else np.nan,
+            }
+        return {key: stats_dict[key] for key in self.circle_dict.keys()}
+
+# %%
+# プロセスプールの各ワーカーが保持する設定(initializerで1回だけ受け取る)
+_worker_setting = {}
+
+def _init_worker(circle_dict, masking, threshold_area, reduce=1):
+    """ワーカーの初期化. サークル画像を画像ごとに送らないようにワーカー内に保持する"""
+    _worker_setting['circle_dict'] = circle_dict
+    _worker_setting['masking'] = masking
+    _worker_setting['threshold_area'] = threshold_area
+    _worker_setting['circle_label'] = make_circle_label(circle_dict)
+    _worker_setting['reduce'] = reduce
+
+def _process_wsi(wsi_path):
+    """1枚の全天画像のサークルごとの統計量を求める(プロセスプールから呼ぶためモジュール直下に置く)"""
+    pwi = ProcessWsiImage(
+        wsi_path=wsi_path,
+        masking=_worker_setting['masking'],
+        circle_dict=_worker_setting['circle_dict'],
+        threshold_area=_worker_setting['threshold_area'],
+        circle_label=_worker_setting['circle_label'],
+        reduce=_worker_setting['reduce']
+    )
+    try:
+        return pwi.process()
+    except Exception as e:  # 壊れた画像は使用不可として扱い, 全体の処理は止めない
+        print(f'failed to process {wsi_path} ({type(e).__name__}: {e})')  # CHECK LOG
+        return empty_stats(_worker_setting['circle_dict'])
+
+def empty_stats(circle_dict):
+    """読み込めなかった画像の統計量(全サークルで使用不可)"""
+    return {
+        key: {'used': False, 'count': 0, 'sum': 0.0, 'sumsq': 0.0, 'max': np.nan, 'min': np.nan}
+        for key in circle_dict.keys()
+    }
+
+def merge_stats(stats_ls, min_used=1):
+    """同じ10分間の画像の統計量をまとめ, 全ピクセルのmean, std, max, minを求める
+    使用可能な画像のピクセルをまとめてnanmean, nanstd等を計算したものと同じ(丸め誤差を除く)
+
+    Args:
+        stats_ls (list): 画像ごとの1サークルの統計量(ProcessWsiImage.circle_statsの各値)
+        min_used (int): 統計量を算出する際に必要な画像の枚数. Defaults to 1.
+
+    Returns:
+        dict: 'usedimg', 'mean', 'std', 'max', 'min'
+    """
+    used_ls = [stats for stats in stats_ls if stats['used']]
+    count = sum([stats['count'] for stats in used_ls])
+    if (len(used_ls)<min_used) | (count==0):
+        return {'usedimg': len(used_ls), 'mean': np.nan, 'std': np.nan, 'max': np.nan, 'min': np.nan}
+    mean = sum([stats['sum'] for stats in used_ls]) / count
+    var = sum([stats['sumsq'] for stats in used_ls]) / count - mean**2
+    return {
+        'usedimg': len(used_ls),
+        'mean'   : mean,
+        'std'    : np.sqrt(max(var, 0)),
+        'max'    : max([stats['max'] for stats in used_ls]),
+        'min'    : min([stats['min'] for stats in used_ls]),
+    }
 
 # %%
-#マルチスレッド処理(10分間隔5枚ずつ)
+#マルチプロセス処理(10分間隔5枚ずつ)
 class MultiWsiImage:
+    stat_ls = ['usedimg', 'mean', 'std', 'max', 'min']  # 10分ごとに記録する統計量
+
     def __init__(
         self,
         input_dir_path = 'E:/ResearchData4/Level1/wsi_202209/',
         circle_dir = 'E:/ResearchData4/Level1/circle_img/',
         circle_ls = [75],
-        masking_flag = True):
+        masking_flag = True,
+        reduce = 1):
         """WSI画像の10分平均処理
-        BI10分平均値を計算する。マルチスレッド対応済み
+        BI10分平均値を計算する。全期間の画像をまとめてプロセスプールで処理する
 
         Args:
             input_dir_path (str, path)              : 元画像の保存先ディレクトリ.
             masking_dir (str, path)                 : マスキング用サークル画像のディレクトリ
             circle_ls (list)                        : マスキング用サークルの開口角
             masking (bool)                          : カラス等のマスキングを実行するかどうか Default to True.
+            reduce (int)                            : 確認用に全天画像(JPEG)を1/reduceに縮小して読み込む(1, 2, 4, 8). Defaults to 1.
 
         Attributes:
             .input_dir_path (str, path)             : 元画像の保存先ディレクトリ
             .circle_dict (dict, (Array like, 2d))   : マスク用画像の配列をまとめた辞書
             .out_df (pandas.DataFrame)              : 出力用DataFrame
             .masking_flag (bool)                    : マスキングを実行するかどうか Default to True.
+            .path_index (dict)                      : 撮影時刻('%Y%m%d_%H%M')→画像パスの索引. Defaults to None (runで作成).
+            .timing_dict (dict)                     : runの各段階(ディレクトリ走査, スケジュール作成, 画像処理)の所要時間(秒)
         """
         
         self.input_dir_path = input_dir_path
-        self.circle_dict    = get_circle_img(circle_dir, circle_ls)
+        self.circle_dict    = get_circle_img(circle_dir, circle_ls, reduce)
         self.out_df         = pd.DataFrame()  # 統計量記録用データフレーム
         self.masking_flag   = masking_flag
+        self.reduce         = reduce
+        self.path_index     = None
+        self.timing_dict    = {}
     
-    def run(self, start, end, min_sun_height=5, min_used=1, lon=139.48, lat = 35.68, threshold_area=0.95):
+    def run(
+        self, start, end, min_sun_height=5, min_used=1, lon=139.48, lat = 35.68, threshold_area=0.95,
+        n_workers=None, prefetch=4):
         """複数時刻用(メイン関数)
+        対象期間の全画像を1つのリストにしてプロセスプールで処理し, 10分ごとに統計量をまとめる
 
         Args:
             start (datetime.datetime): 計算開始時刻
@@ -191,119 +386,154 @@ class MultiWsiImage:
             lon (float, optional)               : 全天カメラの設置場所の緯度. Defaults to 139.48.
             lat (float, optional)               : 全天カメラの設置場所の経度. Defaults to 35.68.
             threshold_area (float, optional)    : 統計量を算出するのに必要なピクセル割合. Defaults to 0.95.
+            n_workers (int, optional)           : プロセス数. 1ならプロセスプールを使わず逐次処理(Windowsでは呼び出し側を if __name__=='__main__': で囲む). Defaults to None (os.cpu_count()).
+            prefetch (int, optional)            : 1プロセスあたりに先行して投入しておく画像の枚数. Defaults to 4.
         """
-        threshold_sinh = np.sin(np.deg2rad(min_sun_height))
-        date_loop_ls = np.arange(start, end, datetime.timedelta(minutes=10))
-        for basedate_64 in date_loop_ls:
-            basedate = pd.to_datetime(basedate_64)
+        start_time = time.perf_counter()
+        if self.path_index is None:
+            self.scan_dir()
+        scan_time = time.perf_counter()
 
+        # 全時刻の太陽高度を1回で計算し, 日中の時刻だけを処理する
+        threshold_sinh = np.sin(np.deg2rad(min_sun_height))
+        slot_idx = pd.date_range(start, end, freq='10min', inclusive='left')
+        sinh_arr = np.asarray(calc_sinh(lon=lon, lat=lat, date=slot_idx))
+        slot_ls = [[basedate, self.slot_paths(basedate)] for basedate in slot_idx[sinh_arr>=threshold_sinh]]
+        schedule_time = time.perf_counter()
+
+        task_ls = [path for _, path_ls in slot_ls for path in path_ls]
+        n_workers = os.cpu_count() if n_workers is None else n_workers
+        results = self.iter_stats(task_ls, threshold_area, n_workers, prefetch)
+        result_dict = self.allocate_result(len(slot_ls))
+        last_day = None
+        for slot_i, (basedate, path_ls) in enumerate(slot_ls):
             # 経過観察用
-            if (basedate.hour==0)&(basedate.minute==0):
+            if basedate.date()!=last_day:
                 print(f'Processing...{basedate.strftime("%Y/%m/%d")} (now:{datetime.datetime.now()})')
+                last_day = basedate.date()
+            stats_dict_ls = [next(results) for _ in path_ls]
+            self.set_slot(result_dict, slot_i, stats_dict_ls, min_used)
+        self.append_result(result_dict, [basedate for basedate, _ in slot_ls])
+        end_time = time.perf_counter()
+
+        self.timing_dict = {
+            'scan'    : scan_time - start_time,
+            'schedule': schedule_time - scan_time,
+            'process' : end_time - schedule_time,
+        }
+        print(
+            f'scan {self.timing_dict["scan"]:.1f}s ({len(self.path_index)} images), '
+            f'schedule {self.timing_dict["schedule"]:.1f}s ({len(slot_ls)} slots, {len(task_ls)} images), '
+            f'process {self.timing_dict["process"]:.1f}s'
+        )  # CHECK LOG
+
+    def scan_dir(self):
+        """入力ディレクトリを1回だけ走査し, 撮影時刻('%Y%m%d_%H%M')→画像パスの索引を作る
+        同じ時刻の画像が複数あればファイル名順で最初のものを使う
+        """
+        name_ls = sorted([
+            entry.name for entry in os.scandir(self.input_dir_path)
+            if entry.is_file() and entry.name.endswith('.jpg')
+        ])
+        self.path_index = {}
+        for name in name_ls:
+            self.path_index.setdefault(name[:13], f'{self.input_dir_path}/{name}')
+        return self.path_index
+
+    def slot_paths(self, basedate):
+        """10分平均に使う画像(基準時刻から前5枚分)のパスのリスト"""
+        if self.path_index is None:
+            self.scan_dir()
+        path_ls = []
+        for i in range(5):
+            date = basedate - datetime.timedelta(minutes=i*2)
+            date_str = datetime.datetime.strftime(date, '%Y%m%d_%H%M')
+            if date_str in self.path_index:  # 画像が見つからないときはスルー
+                path_ls.append(self.path_index[date_str])
+        return path_ls
 
-            now_sinh = calc_sinh(lon=lon, lat=lat, date=basedate)
-            if now_sinh<threshold_sinh:  # 太陽高度が低すぎれば無視
-                continue
-            self.make_10min_img(basedate=basedate, threshold_area=threshold_area, min_used=min_used)
-
-    
-    def set_df(self, df, basedate, circle_key, used_img_dict, masked_img_dict, min_used):
-        df.loc[basedate, f'BI_usedimg_{circle_key}'] = int(used_img_dict[circle_key])
-        if used_img_dict[circle_key] < min_used:
-            del masked_img_dict[circle_key]
-            df.loc[basedate,f'BI_mean_{circle_key}'] = np.nan
-            df.loc[basedate,f'BI_std_{circle_key}']  = np.nan
-            df.loc[basedate,f'BI_max_{circle_key}']  = np.nan
-            df.loc[basedate,f'BI_min_{circle_key}']  = np.nan
-        else:
-            convert_img = np.array(masked_img_dict[circle_key])
-            del masked_img_dict[circle_key]
-            df.loc[basedate,f'BI_mean_{circle_key}'] = np.nanmean(convert_img)
-            df.loc[basedate,f'BI_std_{circle_key}']  = np.nanstd(convert_img)
-            df.loc[basedate,f'BI_max_{circle_key}']  = np.nanmax(convert_img)
-            df.loc[basedate,f'BI_min_{circle_key}']  = np.nanmin(convert_img)
-        return df
+    def iter_stats(self, path_ls, threshold_area=0.95, n_workers=1, prefetch=4):
+        """画像ごとのサークル別統計量を, path_lsの順に返すジェネレータ
+        プロセスプールには常にn_workers*prefetch枚まで先行して投入しておく
+        """
+        initargs = (self.circle_dict, self.masking_flag, threshold_area, self.reduce)
+        if n_workers==1:
+            _init_worker(*initargs)
+            for path in path_ls:
+                yield _process_wsi(path)
+            return
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=initargs) as executor:
+            path_iter = iter(path_ls)
+            futures = deque([executor.submit(_process_wsi, path) for path in itertools.islice(path_iter, n_workers*prefetch)])
+            while len(futures)>0:
+                future = futures.popleft()
+                for path in itertools.islice(path_iter, 1):
+                    futures.append(executor.submit(_process_wsi, path))
+                yield future.result()
+
+    def allocate_result(self, n_slots):
+        """10分ごとの統計量を書き込む列ごとの配列(列の順はサークルごとにusedimg, mean, std, max, min)"""
+        result_dict = {}
+        for circle_key in self.circle_dict.keys():
+            for stat in self.stat_ls:
+                if stat=='usedimg':
+                    result_dict[f'BI_{stat}_{circle_key}'] = np.zeros(n_slots, dtype=int)
+                else:
+                    result_dict[f'BI_{stat}_{circle_key}'] = np.full(n_slots, np.nan)
+        return result_dict
+
+    def set_slot(self, result_dict, slot_i, stats_dict_ls, min_used=1):
+        """1つの10分間の画像の統計量をサークルごとにまとめ, slot_i番目に書き込む"""
+        for circle_key in self.circle_dict.keys():
+            slot_stats = merge_stats([stats_dict[circle_key] for stats_dict in stats_dict_ls], min_used)
+            for stat in self.stat_ls:
+                result_dict[f'BI_{stat}_{circle_key}'][slot_i] = slot_stats[stat]
 
+    def append_result(self, result_dict, basedate_ls):
+        """列ごとの配列を1回でDataFrameにしてout_dfに追加する"""
+        result_df = pd.DataFrame(result_dict, index=pd.DatetimeIndex(basedate_ls))
+        self.out_df = result_df if len(self.out_df)==0 else pd.concat([self.out_df, result_df])
+        return self.out_df
 
     def make_10min_img(self, basedate, threshold_area=0.95, min_used=1):
-        """10分平均画像作成用関数
+        """1つの10分間の統計量を計算する
 
         Args:
             basedate (datetime.datetime)    : 10分平均画像の基準時刻. この時刻の前5枚分を使用する
             threshold_area (float)          : 統計量を算出するのに必要なピクセル割合. Defaults to 0.95.
             min_used (int)                  : 10分平均を算出する際に必要な画像の枚数. Defaults to 1.
         """
+        stats_dict_ls = list(self.iter_stats(self.slot_paths(basedate), threshold_area))
+        result_dict = self.allocate_result(1)
+        self.set_slot(result_dict, 0, stats_dict_ls, min_used)
+        self.append_result(result_dict, [basedate])
 
-        threads = []
-        # スレッドを立てる(RGB画像を取得)
-        for i in range(5):
-            date = basedate - datetime.timedelta(minutes=i*2)
-            date_str = datetime.datetime.strftime(date, '%Y%m%d_%H%M')
-            img_path_ls = glob.glob(f'{self.input_dir_path}/{date_str}*.jpg')
-            
-            if len(img_path_ls)==0:
-                continue  # 画像が見つからないときはスルー
-            
-            pwi = ProcessWsiImage(
-                wsi_path=img_path_ls[0],
-                masking=self.masking_flag,
-                circle_dict=self.circle_dict,
-                threshold_area=threshold_area
-                )
-            pwi.start()
-            threads.append(pwi)
-        
-        # 開口度ごとに5枚の画像を保持するための辞書を作成
-        masked_img_dict = {}
-        used_img_dict = {}  # 使用した画像の枚数
-        for circle_key in self.circle_dict.keys():
-            masked_img_dict[circle_key] = []
-            used_img_dict[circle_key] = 0
-
-        # 各スレッドで作成したBI画像を辞書にまとめる
-        for thread in threads:
-            thread.join()
-            # 
-            for circle_key, [circle_img, img_judge] in thread.circle_bi_dict.items():
-                self.used_img_num=0
-                masked_img_ls = []
-                if img_judge:
-                    masked_img_dict[circle_key].append(circle_img)  # 使用可能なら足す
-                    used_img_dict[circle_key]+=1
-        
-        set_df_threads = []
-        # 各開口度ごとに統計量を算出
-        for circle_key in self.circle_dict.keys():
+# %%
+def split_sort_df(in_df, circle_ls, save_header, parquet=False):
+    """統計量ごとに, 開口角を列に持つDataFrameに分けて保存する
 
-            set_df_thread = threading.Thread(
-                target=self.set_df,
-                args=(self.out_df, basedate, circle_key, used_img_dict, masked_img_dict, min_used)
-            )
-            set_df_thread.start()
-            set_df_threads.append(set_df_thread)
-        for set_df_thread in set_df_threads:
-            set_df_thread.join()
+    Args:
+        in_df (pandas.DataFrame): MultiWsiImage.out_df
+        circle_ls (list): 開口角のリスト
+        save_header (str): 保存先のパスの先頭部分({save_header}_mean.csvなど)
+        parquet (bool, optional): csvではなくparquet形式で保存するかどうか. Defaults to False.
 
-# %%
-def split_sort_df(in_df, circle_ls, save_header):
-    usedimg_df = pd.DataFrame()
-    mean_df = pd.DataFrame()
-    std_df = pd.DataFrame()
-    max_df = pd.DataFrame()
-    min_df = pd.DataFrame()
-    for circle_angle in circle_ls:
-        usedimg_df[circle_angle] = in_df[f'BI_usedimg_{circle_angle}']
-        mean_df[circle_angle] = in_df[f'BI_mean_{circle_angle}']
-        std_df[circle_angle] = in_df[f'BI_std_{circle_angle}']
-        max_df[circle_angle] = in_df[f'BI_max_{circle_angle}']
-        min_df[circle_angle] = in_df[f'BI_min_{circle_angle}']
-
-        usedimg_df.to_csv(f'{save_header}_usedimg.csv')
-        mean_df.to_csv(f'{save_header}_mean.csv')
-        std_df.to_csv(f'{save_header}_std.csv')
-        max_df.to_csv(f'{save_header}_max.csv')
-        min_df.to_csv(f'{save_header}_min.csv')
-    return usedimg_df, mean_df, std_df, max_df, min_df
+    Returns:
+        (pandas.DataFrame, ...): usedimg, mean, std, max, minのDataFrame
+    """
+    out_ls = []
+    for stat in MultiWsiImage.stat_ls:
+        stat_df = pd.DataFrame(
+            {circle_angle: in_df[f'BI_{stat}_{circle_angle}'] for circle_angle in circle_ls},
+            index=in_df.index
+        )
+        if parquet:
+            stat_df.rename(columns=str).to_parquet(f'{save_header}_{stat}.parquet')  # parquetの列名は文字列
+        else:
+            stat_df.to_csv(f'{save_header}_{stat}.csv')
+        out_ls.append(stat_df)
+    return tuple(out_ls)
 
 # %% 処理部分
 if __name__=='__main__':
@@ -318,7 +548,7 @@ if __name__=='__main__':
         circle_dir='T:/Uda/circle_img/',
         circle_ls=circle_ls,
         masking_flag=False)
-    masked_img_dict = mwi.run(
+    mwi.run(
         start = datetime.datetime(2022, 8, 1, 0, 0, 0),
         end = datetime.datetime(2022, 9, 1, 0, 0, 1)
         )
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# bench_calc_bi_img.py: 全天画像1枚あたりのBI画像の計算時間を比較する
+# 実行: python -m Radiation.bench_calc_bi_img [全天画像のパス]
+
+# %%
+import numpy as np
+import cv2
+import time
+import sys
+import os
+import tempfile
+from .ProcessWsiImage import ProcessWsiImage, reduce_flag_dict
+
+def bi_float(wsi_path):
+    """従来の方法(RGBに変換し, float64で1/3ずつ足す)"""
+    wsi_3d = cv2.cvtColor(cv2.imread(wsi_path), cv2.COLOR_BGR2RGB)
+    return np.nansum(wsi_3d/3, axis=2).astype(np.uint8)
+
+def bi_uint16(pwi, wsi_path):
+    """ProcessWsiImageで読み込み(色変換なし)からBI画像の計算まで行う"""
+    pwi.get_wsi_img(wsi_path, rgb=False)
+    return pwi.calc_bi_img()
+
+def timeit(func, *args, n_repeat=10):
+    """n_repeat回の実行時間の中央値(秒)"""
+    time_ls = []
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        func(*args)
+        time_ls.append(time.perf_counter() - start)
+    return np.median(time_ls)
+
+def bench(wsi_path):
+    """BI画像の計算のみ, 読み込み+計算(縮小率ごと)の時間を表示する"""
+    bi_old = bi_float(wsi_path)
+    bi_new = bi_uint16(ProcessWsiImage(), wsi_path)
+    print(f'image {bi_old.shape}, differing pixels {np.sum(bi_old!=bi_new)} (max diff {np.max(np.abs(bi_old.astype(int)-bi_new))})')
+
+    pwi = ProcessWsiImage()
+    pwi.get_wsi_img(wsi_path, rgb=False)
+    rgb_3d = cv2.cvtColor(pwi.wsi_3d, cv2.COLOR_BGR2RGB)
+    base_sec = timeit(lambda: np.nansum(rgb_3d/3, axis=2).astype(np.uint8))
+    new_sec = timeit(pwi.calc_bi_img)
+    print(f'BI only         : float64 {base_sec*1000:.1f} ms, uint16 {new_sec*1000:.1f} ms (x{base_sec/new_sec:.1f})')
+
+    base_sec = timeit(bi_float, wsi_path)
+    print(f'decode + BI     : {base_sec*1000:.1f} ms')
+    for reduce in reduce_flag_dict:
+        sec = timeit(bi_uint16, ProcessWsiImage(reduce=reduce), wsi_path)
+        print(f'  uint16, 1/{reduce:<7}: {sec*1000:.1f} ms (x{base_sec/sec:.1f})')
+
+# %%
+if __name__=='__main__':
+    if len(sys.argv)>1:
+        bench(sys.argv[1])
+    else:
+        # 全天画像が無い場合は同じ大きさの画像を一時ファイルに作る(終了後に削除)
+        fd, wsi_path = tempfile.mkstemp(suffix='.jpg')
+        os.close(fd)
+        try:
+            rng = np.random.default_rng(0)
+            wsi_3d = cv2.GaussianBlur(rng.integers(0, 256, (1920, 1920, 3), dtype=np.uint8), (15, 15), 0)
+            cv2.imwrite(wsi_path, wsi_3d)
+            bench(wsi_path)
+        finally:
+            os.remove(wsi_path)
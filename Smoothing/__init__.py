@@ -1 +1 @@
-from .whittaker_smooth import whittaker_smooth
\ No newline at end of file
+from .whittaker_smooth import whittaker_smooth, whittaker_smooth_batch, whittaker_smooth_weighted
\ No newline at end of file
@@ -15,6 +15,9 @@ of the smoother in Python.
 import numpy as np
 import scipy.sparse as sparse
 from scipy.sparse.linalg import splu
+from scipy.linalg import cholesky_banded, cho_solve_banded
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 
 
@@ -69,4 +72,270 @@ def whittaker_smooth(y, lmbd, d = 2):
     D = speyediff(m, d, format='csc')
     coefmat = E + lmbd * D.conj().T.dot(D)
     z = splu(coefmat).solve(y)
-    return z    
\ No newline at end of file
+    return z
+
+
+@lru_cache(maxsize=32)
+def whittaker_factor(m, lmbd, d = 2):
+    """
+    (utility function)
+    Banded Cholesky factor of the Whittaker system matrix (E + lmbd * D'D)
+    for a series of length m. The matrix does not depend on the data, so
+    the factor is cached and shared by every series of the same length.
+    
+    Returns the upper form (d+1) x m used by scipy.linalg.cho_solve_banded
+    """
+    
+    D = speyediff(m, d, format='csc')
+    coefmat = sparse.eye(m, format='csc') + lmbd * D.conj().T.dot(D)
+    ab = np.zeros((d+1, m))
+    for k in range(d+1):
+        ab[d-k, k:] = coefmat.diagonal(k)
+    return cholesky_banded(ab, lower=False)
+
+
+def whittaker_smooth_batch(Y, lmbd, d = 2, block_size = 10000, n_workers = 1):
+    """
+    Batched version of whittaker_smooth for many series of the same length
+    (e.g. every pixel of an NDVI cube). The banded system is factored once
+    (whittaker_factor) and solved for a block of series at a time.
+    
+    ---------
+    
+    Arguments :
+    
+    Y          : array (..., m), e.g. (n_pixels, m) or (h, w, m). The last axis is time
+    lmbd       : parameter for the smoothing algorithm (roughness penalty)
+    d          : order of the smoothing
+    block_size : number of series solved together
+    n_workers  : number of threads processing blocks in parallel
+    
+    ---------
+    Returns :
+    
+    Z          : array of the smoothed data, same shape as Y (float64).
+                 A series containing nan is returned as all nan, as in whittaker_smooth.
+    """
+    
+    Y = np.asarray(Y)
+    m = Y.shape[-1]
+    flat_Y = Y.reshape(-1, m)
+    cb = whittaker_factor(m, float(lmbd), d)
+    Z = np.empty(flat_Y.shape, dtype=np.float64)
+    
+    def solve_block(start):
+        rhs = np.array(flat_Y[start:start+block_size].T, dtype=np.float64)  # (m, n_block)
+        Z[start:start+block_size] = cho_solve_banded((cb, False), rhs, check_finite=False).T
+    
+    starts = range(0, flat_Y.shape[0], block_size)
+    if n_workers == 1:
+        for start in starts:
+            solve_block(start)
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(solve_block, starts))
+    return Z.reshape(Y.shape)
+
+
+@lru_cache(maxsize=32)
+def penalty_bands(m, d = 2):
+    """
+    (utility function)
+    Upper bands of the penalty matrix D'D for a series of length m.
+    P[k, i] = (D'D)[i, i+k] for k = 0..d (zero padded at the end)
+    """
+    
+    D = speyediff(m, d, format='csc')
+    DtD = D.conj().T.dot(D)
+    P = np.zeros((d+1, m))
+    for k in range(d+1):
+        P[k, :m-k] = DtD.diagonal(k)
+    return P
+
+
+def banded_ldl(A):
+    """
+    (utility function)
+    LDL' factorization of many symmetric banded matrices at once.
+    
+    A : array (p+1, m, n), A[k, i] = (matrix)[i, i+k] for each of n systems
+    
+    Returns L (p+1, m, n) with L[k, i] = L[i, i-k] (L[0] unused) and D (m, n)
+    """
+    
+    p, m = A.shape[0]-1, A.shape[1]
+    L = np.zeros_like(A)
+    D = np.empty(A.shape[1:])
+    for j in range(m):
+        Dj = A[0, j].copy()
+        for k in range(1, min(p, j)+1):
+            Dj -= L[k, j]**2 * D[j-k]
+        D[j] = Dj
+        for i in range(j+1, min(j+p, m-1)+1):
+            Lij = A[i-j, j].copy()
+            for k in range(max(0, i-p), j):
+                Lij -= L[i-k, i] * L[j-k, j] * D[k]
+            L[i-j, i] = Lij / Dj
+    return L, D
+
+
+def banded_ldl_solve(L, D, B):
+    """
+    (utility function)
+    Solve L D L' z = b for each column of B (m, n) using the output of banded_ldl
+    """
+    
+    p, m = L.shape[0]-1, L.shape[1]
+    Z = np.array(B, dtype=np.float64)
+    for i in range(1, m):
+        for k in range(1, min(p, i)+1):
+            Z[i] -= L[k, i] * Z[i-k]
+    Z /= D
+    for i in range(m-2, -1, -1):
+        for k in range(1, min(p, m-1-i)+1):
+            Z[i] -= L[k, i+k] * Z[i+k]
+    return Z
+
+
+def banded_inv_diag(L, D):
+    """
+    (utility function)
+    Diagonal of the inverse of L D L' (Takahashi recursion restricted to the band),
+    used for the trace of the hat matrix without forming the inverse.
+    """
+    
+    p, m = L.shape[0]-1, L.shape[1]
+    S = np.zeros((p+1, m) + D.shape[1:])  # S[k, i] = inv[i, i+k]
+    
+    def S_at(i, j):
+        return S[j-i, i] if i <= j else S[i-j, j]
+    
+    for i in range(m-1, -1, -1):
+        kmax = min(i+p, m-1)
+        for j in range(kmax, i, -1):
+            Sij = np.zeros(D.shape[1:])
+            for k in range(i+1, kmax+1):
+                Sij -= L[k-i, k] * S_at(k, j)
+            S[j-i, i] = Sij
+        Sii = 1 / D[i]
+        for k in range(i+1, kmax+1):
+            Sii -= L[k-i, k] * S[k-i, i]
+        S[0, i] = Sii
+    return S[0]
+
+
+def whittaker_smooth_weighted(
+    Y, W = None, lmbd = None, d = 2, lmbd_grid = None, criterion = 'gcv',
+    block_size = 2000, n_workers = 1, return_lmbd = False
+    ):
+    """
+    Weighted Whittaker smoother (W + lmbd * D'D) z = W y for many series,
+    with an optional per-series choice of lmbd by GCV or the V-curve [2].
+    [2] C. Frasso, P. H. C. Eilers, "L- and V-curves for optimal smoothing",
+        Stat. Modelling 2015, (15), 91-111
+    
+    Every series has its own banded system, so the factorization (banded_ldl)
+    is vectorized over the series of a block instead of being shared.
+    The trace of the hat matrix comes from the band of the inverse
+    (banded_inv_diag), so the cost stays linear in the series length.
+    
+    ---------
+    
+    Arguments :
+    
+    Y           : array (..., m), the last axis is time. nan is treated as weight 0
+    W           : weights or mask (True = valid) with the same shape as Y. None means all 1
+    lmbd        : fixed roughness penalty (scalar or array of Y.shape[:-1]).
+                  None selects it from lmbd_grid for every series
+    d           : order of the smoothing
+    lmbd_grid   : candidates of lmbd (default: 10**-2 ... 10**4, 25 values)
+    criterion   : 'gcv' (generalized cross validation) or 'vcurve'
+    block_size  : number of series processed together
+    n_workers   : number of threads processing blocks in parallel
+    return_lmbd : also return the lmbd used for every series
+    
+    ---------
+    Returns :
+    
+    Z           : array of the smoothed data, same shape as Y
+    (lmbd_arr)  : array of Y.shape[:-1], only if return_lmbd
+    """
+    
+    assert criterion in ('gcv', 'vcurve'), "criterion must be 'gcv' or 'vcurve'"
+    Y = np.asarray(Y, dtype=np.float64)
+    m = Y.shape[-1]
+    flat_Y = Y.reshape(-1, m)
+    flat_W = np.ones(flat_Y.shape) if W is None else np.asarray(W, dtype=np.float64).reshape(-1, m)
+    if lmbd is not None:
+        lmbd = np.broadcast_to(np.asarray(lmbd, dtype=np.float64), Y.shape[:-1]).reshape(-1)
+    if lmbd_grid is None:
+        lmbd_grid = np.logspace(-2, 4, 25)
+    lmbd_grid = np.sort(np.asarray(lmbd_grid, dtype=np.float64))
+    P = penalty_bands(m, d)[:, :, None]  # (d+1, m, 1)
+    
+    Z = np.empty(flat_Y.shape)
+    lmbd_arr = np.empty(flat_Y.shape[0])
+    
+    def smooth(y, w, lmbd_block):
+        # y, w: (m, n), lmbd_block: (n,)
+        A = lmbd_block * P
+        A[0] += w
+        L, D = banded_ldl(A)
+        return banded_ldl_solve(L, D, w * y), L, D
+    
+    @np.errstate(divide='ignore', invalid='ignore')
+    def process_block(start):
+        w = flat_W[start:start+block_size].T.copy()  # (m, n)
+        y = flat_Y[start:start+block_size].T.copy()
+        w[np.isnan(y)] = 0
+        y[np.isnan(y)] = 0
+        n = y.shape[1]
+        
+        if lmbd is not None:
+            lmbd_block = lmbd[start:start+n]
+            z = smooth(y, w, lmbd_block)[0]
+        else:
+            score_arr = np.empty((len(lmbd_grid), n))
+            z_arr = np.empty((len(lmbd_grid), m, n))
+            pen_arr = np.empty((len(lmbd_grid), n))
+            n_eff = w.sum(axis=0)
+            for li, lm in enumerate(lmbd_grid):
+                z, L, D = smooth(y, w, np.full(n, lm))
+                rss = np.sum(w * (y - z)**2, axis=0)
+                z_arr[li] = z
+                if criterion == 'gcv':
+                    trace = np.sum(w * banded_inv_diag(L, D), axis=0)
+                    score_arr[li] = n_eff * rss / (n_eff - trace)**2
+                else:
+                    score_arr[li] = np.log(rss)
+                    pen_arr[li] = np.log(np.sum(np.diff(z, n=d, axis=0)**2, axis=0))
+            
+            if criterion == 'gcv':
+                best = np.argmin(np.where(np.isfinite(score_arr), score_arr, np.inf), axis=0)
+                lmbd_block = lmbd_grid[best]
+                z = z_arr[best, :, np.arange(n)].T
+            else:
+                # distance between successive points of the (fit, penalty) curve per log-lambda step
+                log_grid = np.log10(lmbd_grid)
+                v = np.sqrt(np.diff(score_arr, axis=0)**2 + np.diff(pen_arr, axis=0)**2) / np.diff(log_grid)[:, None]
+                best = np.argmin(np.where(np.isfinite(v), v, np.inf), axis=0)
+                lmbd_block = 10**((log_grid[best] + log_grid[best+1]) / 2)
+                z = smooth(y, w, lmbd_block)[0]  # refit at the selected midpoint
+        
+        invalid = np.sum(w > 0, axis=0) <= d  # too few valid points to fix the solution
+        z[:, invalid] = np.nan
+        Z[start:start+n] = z.T
+        lmbd_arr[start:start+n] = np.where(invalid, np.nan, lmbd_block)
+    
+    starts = range(0, flat_Y.shape[0], block_size)
+    if n_workers == 1:
+        for start in starts:
+            process_block(start)
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(process_block, starts))
+    
+    Z = Z.reshape(Y.shape)
+    if return_lmbd:
+        return Z, lmbd_arr.reshape(Y.shape[:-1])
+    return Z
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# CompositeEngine.py: 日降水量を合成期間(16日, 8日, 半旬, 月)ごとに集計し, PRCPTOT・R95p・mR95pを求める
+
+# %%
+import numpy as np
+import pandas as pd
+import datetime
+
+if __name__=='__main__':
+    from calc_doy_percentile import sorted_percentile
+else:
+    from .calc_doy_percentile import sorted_percentile
+
+# %%
+class CompositeEngine:
+    # 1年あたりの合成期間の数と, 合成期間あたりの基準日数(PRCPTOTの期間長の補正に使う)
+    cadence_dict = {
+        '16days': {'n_per_year': 23, 'nominal_days': 16},
+        '8days' : {'n_per_year': 46, 'nominal_days': 8},
+        'pentad': {'n_per_year': 72, 'nominal_days': 5},
+        'monthly': {'n_per_year': 12, 'nominal_days': 30},
+    }
+
+    def __init__(self, cadence='16days'):
+        """日降水量を合成期間ごとに集計する
+        日付→合成期間の対応を1回だけ求め, 区切り和で全期間・全地点をまとめて集計する
+
+        Args:
+            cadence (str): '16days'(DOY 1, 17, ...), '8days'(DOY 1, 9, ...),
+                'pentad'(各月1, 6, 11, 16, 21, 26日), 'monthly'のいずれか. Defaults to '16days'.
+
+        Attributes:
+            .n_per_year (int)       : 1年あたりの合成期間の数
+            .nominal_days (int)     : 合成期間あたりの基準日数
+        """
+        if cadence not in self.cadence_dict:
+            raise ValueError(f'cadence must be one of {list(self.cadence_dict.keys())} (got {cadence})')
+        self.cadence = cadence
+        self.n_per_year = self.cadence_dict[cadence]['n_per_year']
+        self.nominal_days = self.cadence_dict[cadence]['nominal_days']
+
+    def composite_dates(self, start_year, end_year):
+        """合成期間の開始日と, 暦の上での日数を返す
+
+        Args:
+            start_year (int): 開始年
+            end_year (int): 終了年(この年を含む)
+
+        Returns:
+            (pandas.DatetimeIndex, Array like): 合成期間の開始日, 各期間の日数
+        """
+        if self.cadence in ('16days', '8days'):
+            step = self.nominal_days
+            start_ls = [
+                datetime.datetime(year, 1, 1) + datetime.timedelta(days=doy-1)
+                for year in range(start_year, end_year+2) for doy in range(1, 366, step)
+            ]
+        elif self.cadence=='pentad':
+            start_ls = [
+                datetime.datetime(year, month, day)
+                for year in range(start_year, end_year+2) for month in range(1, 12+1) for day in range(1, 27, 5)
+            ]
+        else:
+            start_ls = [
+                datetime.datetime(year, month, 1)
+                for year in range(start_year, end_year+2) for month in range(1, 12+1)
+            ]
+        # 翌年最初の期間を終端として日数を求める
+        start_arr = pd.to_datetime(start_ls[:(end_year-start_year+1)*self.n_per_year+1])
+        daycnt_arr = np.diff(start_arr.values).astype('timedelta64[D]').astype(int)
+        return start_arr[:-1], daycnt_arr
+
+    def composite_index(self, daily_date_arr, start_year, end_year):
+        """日付ごとの合成期間の番号(期間外は-1)
+
+        Args:
+            daily_date_arr (pandas.DatetimeIndex): 日付
+            start_year (int): 開始年
+            end_year (int): 終了年
+        """
+        start_arr, daycnt_arr = self.composite_dates(start_year, end_year)
+        daily_date_arr = pd.to_datetime(daily_date_arr)
+        comp_idx = np.searchsorted(start_arr.values, daily_date_arr.values, side='right') - 1
+        end_arr = start_arr.values + daycnt_arr.astype('timedelta64[D]')
+        outside = (comp_idx<0) | (daily_date_arr.values>=end_arr[-1])
+        return np.where(outside, -1, comp_idx)
+
+    @staticmethod
+    def segment_sum(value_arr, comp_idx, n_comp):
+        """最終軸を合成期間ごとに足し合わせる(期間外(-1)は無視, nanは0として足す)
+
+        Args:
+            value_arr (Array like): (..., 日)の値
+            comp_idx (Array like): 日ごとの合成期間の番号
+            n_comp (int): 合成期間の数
+
+        Returns:
+            Array like: (..., n_comp)の合計値
+        """
+        value_arr = np.asarray(value_arr, dtype=np.float64)
+        order = np.argsort(comp_idx, kind='stable')
+        sorted_idx = comp_idx[order]
+        inside = sorted_idx>=0
+        order, sorted_idx = order[inside], sorted_idx[inside]
+        sorted_arr = np.nan_to_num(value_arr[..., order])
+
+        # 各期間の先頭位置. データの無い期間は0にする
+        bounds = np.searchsorted(sorted_idx, np.arange(n_comp))
+        has_data = np.isin(np.arange(n_comp), sorted_idx)
+        sum_arr = np.zeros(value_arr.shape[:-1] + (n_comp,))
+        if has_data.any():
+            sum_arr[..., has_data] = np.add.reduceat(sorted_arr, bounds[has_data], axis=-1)
+        return sum_arr
+
+    @staticmethod
+    def calc_RRwn95(ppt_arr, q=95):
+        """全期間の降雨日(0以外)のq%ile値. np.percentile(ppt_arr[ppt_arr!=0], q)と同じ(nanを含めばnan)
+
+        Args:
+            ppt_arr (Array like): (..., 日)の日降水量
+        """
+        ppt_arr = np.asarray(ppt_arr, dtype=np.float64)
+        rain_day_arr = ppt_arr!=0
+        count_arr = np.sum(rain_day_arr, axis=-1)
+        sorted_arr = np.sort(np.where(rain_day_arr, ppt_arr, np.inf), axis=-1)
+        RRwn95 = sorted_percentile(sorted_arr, count_arr, q)
+        return np.where(np.isnan(ppt_arr).any(axis=-1), np.nan, RRwn95)
+
+    def calc(self, ppt_arr, daily_date_arr, mRRwn95, start_year, end_year, RRwn95=None):
+        """合成期間ごとのPRCPTOT, R95p, mR95p, R95pT, mR95pTを求める
+
+        Args:
+            ppt_arr (Array like): 日降水量. (日,) または (地点/ピクセル, 日)
+            daily_date_arr (pandas.DatetimeIndex): ppt_arrの最終軸の日付
+            mRRwn95 (Array like): DOY別の95%ileしきい値. (366,) または (地点/ピクセル, 366)
+            start_year (int): 集計する期間の開始年
+            end_year (int): 集計する期間の終了年
+            RRwn95 (float or Array like, optional): 全期間の95%ile値. Defaults to None (ppt_arrから求める).
+
+        Returns:
+            dict: 'date_arr'(合成期間の開始日), 'daycnt', 'PRCPTOT', 'R95p', 'mR95p', 'R95pT', 'mR95pT', 'RRwn95'
+                (各値は(..., 合成期間数))
+        """
+        ppt_arr = np.asarray(ppt_arr, dtype=np.float64)
+        daily_date_arr = pd.to_datetime(daily_date_arr)
+        start_arr, daycnt_arr = self.composite_dates(start_year, end_year)
+        comp_idx = self.composite_index(daily_date_arr, start_year, end_year)
+        n_comp = len(start_arr)
+        if RRwn95 is None:
+            RRwn95 = self.calc_RRwn95(ppt_arr)
+        RRwn95 = np.asarray(RRwn95, dtype=np.float64)
+
+        threshold_arr = np.asarray(mRRwn95)[..., daily_date_arr.dayofyear.values-1]
+        PRCPTOT_arr = self.segment_sum(ppt_arr, comp_idx, n_comp)
+        mR95p_arr = self.segment_sum(np.where(ppt_arr>=threshold_arr, ppt_arr, 0), comp_idx, n_comp)
+        R95p_arr = self.segment_sum(np.where(ppt_arr>=RRwn95[..., None], ppt_arr, 0), comp_idx, n_comp)
+
+        # 期間長をそろえた平均総降水量(年ごとの同じ期間の平均)で正規化する
+        year_shape = ppt_arr.shape[:-1] + (-1, self.n_per_year)
+        mean_PRCPTOT = np.nanmean((PRCPTOT_arr / daycnt_arr * self.nominal_days).reshape(year_shape), axis=-2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mR95pT_arr = np.where(
+                mean_PRCPTOT[..., None, :]!=0,
+                (mR95p_arr / daycnt_arr * self.nominal_days).reshape(year_shape) / mean_PRCPTOT[..., None, :],
+                0
+            ).reshape(PRCPTOT_arr.shape)
+            R95pT_arr = np.where(PRCPTOT_arr!=0, R95p_arr / PRCPTOT_arr, 0)
+
+        return {
+            'date_arr': start_arr,
+            'daycnt'  : daycnt_arr,
+            'PRCPTOT' : PRCPTOT_arr,
+            'R95p'    : R95p_arr,
+            'mR95p'   : mR95p_arr,
+            'R95pT'   : R95pT_arr,
+            'mR95pT'  : mR95pT_arr,
+            'RRwn95'  : RRwn95,
+        }
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# IncrementalUpdater.py: 平年値を保存しておき, 新しい16日合成期間のSPI3(3ヶ月)・mR95pTだけを計算する
+
+# %%
+import numpy as np
+import pandas as pd
+import datetime
+import json
+import os
+
+from .calc_doy_percentile import calc_doy_percentile
+from .SPIGrid import SPIGrid
+from ..Convert.DatasetCatalog import DatasetCatalog
+from ..Convert.RasterCube import RasterCube
+
+# %%
+class IncrementalUpdater:
+    def __init__(
+        self, state_dir, catalog=None, normal_start_year=1991, normal_end_year=2020,
+        rain_key='chirps_005', prcptot_key='PRCPTOT', spi_key='SPI3', mr95pt_key='mR95pT',
+        spi_scale=3, spi_min_sample_size=30, window_half=7, min_sample_size=30, Rnnmm=10
+        ):
+        """16日合成期間のSPI3・mR95pTを, 保存済みの平年値から1期間ずつ追加計算する
+
+        平年値(mRRwn95, 合成期間別の平均総降水量PPT_mean, SPIの月別のガンマ分布のパラメータ)は
+        build_climatologyで1回だけ計算してstate_dirに保存する. updateは新しい期間の日降水量だけを読み,
+        PRCPTOT・mR95pT・SPI3を1枚ずつ書き出す.
+        SPI3はSPI_3と同じ3ヶ月積算・月別パラメータの指数で, 合成期間の開始日が含まれる月の値を書き出す
+        (その月の日降水量がそろうまで, その月の合成期間は計算しない).
+
+        Args:
+            state_dir (str, path): 平年値の保存先
+            catalog (DatasetCatalog, optional): データセットのカタログ. Defaults to None (既定のカタログ).
+            normal_start_year (int): 平年値算出に使うデータの開始年. Defaults to 1991.
+            normal_end_year (int): 平年値算出に使うデータの終了年. Defaults to 2020.
+            rain_key (str): 日降水量の変数名. Defaults to 'chirps_005'.
+            prcptot_key (str): 16日合成期間の総降水量の変数名. Defaults to 'PRCPTOT'.
+            spi_key (str): SPIの変数名. Defaults to 'SPI3'.
+            mr95pt_key (str): mR95pTの変数名. Defaults to 'mR95pT'.
+            spi_scale (int): SPIで積算する月数. Defaults to 3.
+            spi_min_sample_size (int): ガンマ分布の推定に最低限必要な降水ありの月数. Defaults to 30.
+            window_half (int): mRRwn95の各DOY計算に使用するウィンドウのサイズ. Defaults to 7.
+            min_sample_size (int): mRRwn95の計算に最低限必要な降雨日数. Defaults to 30.
+            Rnnmm (float): ユーザー定義の最低豪雨しきい値. Defaults to 10.
+        """
+        self.state_dir = state_dir
+        self.catalog = DatasetCatalog() if catalog is None else catalog
+        self.normal_start_year = normal_start_year
+        self.normal_end_year = normal_end_year
+        self.rain_key = rain_key
+        self.prcptot_key = prcptot_key
+        self.spi_key = spi_key
+        self.mr95pt_key = mr95pt_key
+        self.spi_scale = spi_scale
+        self.spi_min_sample_size = spi_min_sample_size
+        self.window_half = window_half
+        self.min_sample_size = min_sample_size
+        self.Rnnmm = Rnnmm
+
+        self.state_path_dict = {
+            'mRRwn95' : f'{state_dir}/mRRwn95.cube',
+            'PPT_mean': f'{state_dir}/PPT_mean.cube',
+            'spi'     : f'{state_dir}/spi_params.npz',
+            'meta'    : f'{state_dir}/climatology.json',
+        }
+        self.mRRwn95 = None  # (366, h, w)のRasterCube
+        self.PPT_mean = None  # (23, h, w)のRasterCube
+        self.spi = None  # SPIGrid
+
+    @staticmethod
+    def composite_end(date):
+        """16日合成期間の最終日(年末の期間は12/31まで)"""
+        return min(date + datetime.timedelta(days=15), datetime.datetime(date.year, 12, 31))
+
+    @staticmethod
+    def month_end(date):
+        """月の最終日"""
+        return date + pd.offsets.MonthEnd(0)
+
+    @staticmethod
+    def composite_id(daily_date_arr):
+        """日付ごとの16日合成期間の通し番号(年×23 + 年内の番号)"""
+        return daily_date_arr.year.values*23 + (daily_date_arr.dayofyear.values-1)//16
+
+    def params(self):
+        """平年値の計算条件(変われば平年値を作り直す)"""
+        return {
+            'normal_start_year'  : self.normal_start_year,
+            'normal_end_year'    : self.normal_end_year,
+            'rain_key'           : self.rain_key,
+            'spi_scale'          : self.spi_scale,
+            'spi_cadence'        : 'monthly',
+            'spi_min_sample_size': self.spi_min_sample_size,
+            'window_half'        : self.window_half,
+            'min_sample_size'    : self.min_sample_size,
+            'Rnnmm'              : self.Rnnmm,
+        }
+
+    def fingerprint(self):
+        """平年期間の入力データの状態. カタログの定義, 存在する日付, 最終更新時刻をまとめる"""
+        date_arr = self.catalog.date_arr(self.rain_key, self.normal_start_year, self.normal_end_year)
+        available_arr = self.catalog.available(self.rain_key, date_arr)
+        if self.catalog.has_cube(self.rain_key):
+            mtime = os.path.getmtime(self.catalog.cube_path(self.rain_key))
+        else:
+            mtime = max([os.path.getmtime(self.catalog.path(self.rain_key, date)) for date in date_arr[available_arr]], default=0)
+        return {
+            'variable'   : self.catalog.variable(self.rain_key),
+            'n_available': int(np.sum(available_arr)),
+            'missing'    : [date.strftime('%Y-%m-%d') for date in date_arr[~available_arr]],
+            'mtime'      : mtime,
+        }
+
+    def stale_reasons(self):
+        """保存済みの平年値が古くなっている理由のリスト(空なら最新)"""
+        if not all([os.path.exists(path) for path in self.state_path_dict.values()]):
+            return ['climatology files are missing']
+        with open(self.state_path_dict['meta'], 'r') as f:
+            meta = json.load(f)
+
+        reason_ls = []
+        if meta['params']!=self.params():
+            reason_ls.append('parameters changed')
+        fingerprint = json.loads(json.dumps(self.fingerprint()))  # 保存時と同じ型にそろえる
+        for name, value in fingerprint.items():
+            if meta['fingerprint'][name]!=value:
+                reason_ls.append(f'{self.rain_key} {name} changed')
+        return reason_ls
+
+    def is_stale(self):
+        return len(self.stale_reasons())>0
+
+    def build_climatology(self, block_rows=8, n_workers=1):
+        """日降水量のキューブから平年値を計算して保存する. 行ブロックごとに読み込むので全画像をメモリに載せない
+
+        Args:
+            block_rows (int): 一度に読み込む行数. Defaults to 8.
+            n_workers (int): mRRwn95の計算に使うスレッド数. Defaults to 1.
+        """
+        if not self.catalog.has_cube(self.rain_key):
+            raise FileNotFoundError(
+                f'{self.rain_key} has no pixel cube. Pack it first: catalog.pack_cube("{self.rain_key}", date_arr, layout="pixel")'
+            )
+        cube = RasterCube(self.catalog.cube_path(self.rain_key))
+        h, w = cube.h, cube.w
+        normal_date_arr = self.catalog.date_arr(self.rain_key, self.normal_start_year, self.normal_end_year)
+        n_years = self.normal_end_year - self.normal_start_year + 1
+
+        # 合成期間の区切り
+        comp_id_arr = self.composite_id(normal_date_arr)
+        starts = np.r_[0, np.where(np.diff(comp_id_arr)!=0)[0]+1]
+        daycnt_arr = np.diff(np.r_[starts, len(normal_date_arr)])
+        comp_date_arr = normal_date_arr[starts]
+        # 月の区切り(SPI用)
+        month_id_arr = normal_date_arr.year.values*12 + normal_date_arr.month.values
+        month_starts = np.r_[0, np.where(np.diff(month_id_arr)!=0)[0]+1]
+        month_date_arr = normal_date_arr[month_starts]
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        mRRwn95_cube = RasterCube.create(
+            self.state_path_dict['mRRwn95'], pd.date_range('2000-01-01', '2000-12-31', freq='D'),
+            np.float32, h, w, cube.geotrans, layout='time'
+        )
+        PPT_mean_cube = RasterCube.create(
+            self.state_path_dict['PPT_mean'], comp_date_arr[:23], np.float32, h, w, cube.geotrans, layout='time'
+        )
+        spi = SPIGrid(self.spi_scale, self.spi_min_sample_size, cadence='monthly')
+        spi_param_dict = {name: np.full((h, w, 12), np.nan) for name in ['alpha', 'beta', 'q']}
+        spi_param_dict['available'] = np.zeros((h, w, 12), dtype=bool)
+
+        for row in range(0, h, block_rows):
+            rows = min(block_rows, h-row)
+            rain30_arr = cube.get_window(row, 0, rows, w, normal_date_arr).astype(np.float64)
+
+            mRRwn95_cube.cube[:, row:row+rows] = calc_doy_percentile(
+                rain30_arr, normal_date_arr, 95, self.window_half, self.min_sample_size, self.Rnnmm,
+                n_workers=n_workers
+            ).transpose(2, 0, 1)
+
+            PRCPTOT_arr = np.add.reduceat(np.nan_to_num(rain30_arr), starts, axis=-1)
+            PPT_mean_cube.cube[:, row:row+rows] = np.mean(
+                (PRCPTOT_arr / daycnt_arr * 16).reshape(rows, w, n_years, 23), axis=2
+            ).transpose(2, 0, 1)
+
+            spi.fit(np.add.reduceat(np.nan_to_num(rain30_arr), month_starts, axis=-1), month_date_arr)
+            for name in spi_param_dict.keys():
+                spi_param_dict[name][row:row+rows] = getattr(spi, name)
+            print(f'build climatology (row:{row+rows}/{h})')  # CHECK LOG
+
+        mRRwn95_cube.cube.flush()
+        PPT_mean_cube.cube.flush()
+        for name, value in spi_param_dict.items():
+            setattr(spi, name, value)
+        spi.SPI_arr = None
+        spi.save(self.state_path_dict['spi'])
+
+        with open(self.state_path_dict['meta'], 'w') as f:
+            json.dump({
+                'params'     : self.params(),
+                'fingerprint': self.fingerprint(),
+                'built_at'   : datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }, f, indent=1)
+        return self.load_state()
+
+    def load_state(self):
+        """保存済みの平年値を開く"""
+        self.mRRwn95 = RasterCube(self.state_path_dict['mRRwn95'])
+        self.PPT_mean = RasterCube(self.state_path_dict['PPT_mean'])
+        self.spi = SPIGrid.load(self.state_path_dict['spi'])
+        return self
+
+    def pending_dates(self, start_year=None):
+        """日降水量がそろっていて, mR95pTかSPI3がまだ無い合成期間の開始日
+        SPI3のため, 合成期間の開始日が含まれる月の日降水量もそろっている必要がある
+
+        Args:
+            start_year (int, optional): 探索を始める年. Defaults to None (平年期間の翌年).
+        """
+        start_year = self.normal_end_year+1 if start_year is None else start_year
+        rain_date_arr = self.catalog.scan(self.rain_key, rescan=True)
+        if len(rain_date_arr)==0:
+            return pd.DatetimeIndex([])
+        comp_date_arr = self.catalog.date_arr(self.mr95pt_key, start_year, rain_date_arr[-1].year)
+        done_arr = (
+            comp_date_arr.isin(self.catalog.scan(self.mr95pt_key, rescan=True))
+            & comp_date_arr.isin(self.catalog.scan(self.spi_key, rescan=True))
+        )
+
+        pending_ls = []
+        for comp_date, done in zip(comp_date_arr, done_arr):
+            if done:
+                continue
+            day_arr = pd.date_range(comp_date, max(self.composite_end(comp_date), self.month_end(comp_date)), freq='D')
+            if day_arr.isin(rain_date_arr).all():
+                pending_ls.append(comp_date)
+        return pd.DatetimeIndex(pending_ls)
+
+    def update(self, date_arr=None, rebuild=False):
+        """新しい合成期間のPRCPTOT・mR95pT・SPI3を計算し, 1期間1枚ずつ書き出す
+
+        Args:
+            date_arr (pandas.DatetimeIndex, optional): 計算する合成期間の開始日. Defaults to None (pending_dates).
+            rebuild (bool): 平年値が古ければ作り直すかどうか. Falseなら例外を出す. Defaults to False.
+
+        Returns:
+            pandas.DatetimeIndex: 書き出した合成期間
+        """
+        reason_ls = self.stale_reasons()
+        if len(reason_ls)>0:
+            if not rebuild:
+                raise RuntimeError(f'climatology in {self.state_dir} is stale: {", ".join(reason_ls)}')
+            self.build_climatology()
+        if self.spi is None:
+            self.load_state()
+
+        date_arr = self.pending_dates() if date_arr is None else pd.to_datetime(date_arr)
+        for comp_date in sorted(date_arr):
+            PRCPTOT_img, mR95pT_img, SPI_img = self.calc_period(comp_date)
+            for key, img in [(self.prcptot_key, PRCPTOT_img), (self.mr95pt_key, mR95pT_img), (self.spi_key, SPI_img)]:
+                out_path = self.catalog.path(key, comp_date)
+                if key==self.prcptot_key and os.path.exists(out_path):
+                    continue  # 既存のPRCPTOTは上書きしない
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                img.astype(self.catalog.dtype(key)).tofile(out_path)
+            print(f'update {comp_date.strftime("%Y-%m-%d")}')  # CHECK LOG
+        return pd.DatetimeIndex(sorted(date_arr))
+
+    def read_monthly_prcptot(self, month_date):
+        """月の総降水量を日降水量から求める"""
+        day_arr = pd.date_range(month_date, self.month_end(month_date), freq='D')
+        return np.nansum([self.catalog.read(self.rain_key, day) for day in day_arr], axis=0)
+
+    def calc_period(self, comp_date):
+        """1合成期間のPRCPTOT・mR95pT・SPI3を計算する
+        (その期間の日降水量と, SPI3の積算に使う開始日の月までのspi_scaleヶ月の日降水量だけを読む)"""
+        day_arr = pd.date_range(comp_date, self.composite_end(comp_date), freq='D')
+        rain_arr = np.stack([self.catalog.read(self.rain_key, day) for day in day_arr]).astype(np.float64)
+        threshold_arr = self.mRRwn95.cube[day_arr.dayofyear.values-1]
+
+        PRCPTOT_img = np.nansum(rain_arr, axis=0)
+        mR95p_img = np.nansum(np.where(rain_arr>=threshold_arr, rain_arr, 0), axis=0)
+        PPT_mean_img = self.PPT_mean.cube[(comp_date.dayofyear-1)//16]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mR95pT_img = np.where(PPT_mean_img!=0, mR95p_img/len(day_arr)*16/PPT_mean_img, 0)
+
+        # SPI3: 開始日が含まれる月までのspi_scaleヶ月の総降水量を, 月別のパラメータで評価する(SPI_3と同じ)
+        month_date_arr = pd.date_range(end=comp_date.replace(day=1), periods=self.spi_scale, freq='MS')
+        PRCPTOT_stack = np.stack(
+            [self.read_monthly_prcptot(month_date) for month_date in month_date_arr], axis=-1
+        ).astype(np.float64)
+        SPI_img = self.spi.score(PRCPTOT_stack, month_date_arr)[..., -1]
+        return PRCPTOT_img, mR95pT_img, SPI_img
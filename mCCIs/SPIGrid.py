@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# SPIGrid.py: (h, w, T)のPRCPTOTキューブから全ピクセルのSPIをまとめて求める
+
+# %%
+import numpy as np
+import pandas as pd
+from scipy import special
+
+# %%
+class SPIGrid:
+    def __init__(self, scale=3, min_sample_size=30, cadence='monthly'):
+        """全ピクセル・全月のSPIをまとめて求める(SPI_3のグリッド版)
+        ガンマ分布のパラメータはThomの最尤推定の近似式で求め, 無降水の割合を混合する
+
+        Args:
+            scale (int): 積算するステップ数(cadence='monthly'なら月数). Defaults to 3.
+            min_sample_size (int): ガンマ分布の推定に最低限必要な降水ありのステップ数. Defaults to 30.
+            cadence (str): 'monthly'なら月別, '16days'/'8days'なら合成期間(年内の何番目か)別にパラメータを推定する. Defaults to 'monthly'.
+
+        Attributes:
+            .alpha (Array like, (..., 期間数))      : 期間別のガンマ分布の形状パラメータ
+            .beta (Array like, (..., 期間数))       : 期間別のガンマ分布の尺度パラメータ
+            .q (Array like, (..., 期間数))          : 期間別の無降水の割合
+            .available (Array like, (..., 期間数))  : 期間別にガンマ分布を推定できたかどうか
+            .SPI_arr (Array like, (..., T))         : fitに使ったデータのSPI
+        """
+        self.scale = scale
+        self.min_sample_size = min_sample_size
+        self.cadence = cadence
+        self.alpha = None
+        self.beta = None
+        self.q = None
+        self.available = None
+        self.SPI_arr = None
+
+    @staticmethod
+    def rolling_sum(prcptot_arr, scale=3):
+        """最終軸方向に, 各月までのscaleヶ月の積算値を累積和で求める
+        S[t] = x[t-scale+1] + ... + x[t]. 最初のscale-1ヶ月と, 窓内に欠損を含む月はnan
+        (累積和の差なので, 直接足した値とは丸め誤差の範囲で異なる)
+
+        Args:
+            prcptot_arr (Array like): (..., T)の月降水量
+            scale (int): 積算する月数. Defaults to 3.
+        """
+        prcptot_arr = np.asarray(prcptot_arr, dtype=np.float64)
+        is_nan = np.isnan(prcptot_arr)
+        pad = np.zeros(prcptot_arr.shape[:-1] + (1,))
+        value_cumsum = np.concatenate([pad, np.cumsum(np.where(is_nan, 0, prcptot_arr), axis=-1)], axis=-1)
+        nan_cumsum = np.concatenate([pad, np.cumsum(is_nan, axis=-1)], axis=-1)
+        positive_cumsum = np.concatenate([pad, np.cumsum(prcptot_arr>0, axis=-1)], axis=-1)
+
+        sum_arr = np.full(prcptot_arr.shape, np.nan)
+        sum_arr[..., scale-1:] = value_cumsum[..., scale:] - value_cumsum[..., :-scale]
+        nan_count = nan_cumsum[..., scale:] - nan_cumsum[..., :-scale]
+        positive_count = positive_cumsum[..., scale:] - positive_cumsum[..., :-scale]
+        sum_arr[..., scale-1:][positive_count==0] = 0  # 無降水は丸め誤差を残さず0にする
+        sum_arr[..., scale-1:][nan_count>0] = np.nan
+        return sum_arr
+
+    def group_index(self, in_date_arr):
+        """各日付のパラメータの期間番号(0始まり)と期間数を返す"""
+        if self.cadence=='monthly':
+            return in_date_arr.month.values - 1, 12
+        elif self.cadence=='16days':
+            return (in_date_arr.dayofyear.values - 1) // 16, 23
+        elif self.cadence=='8days':
+            return (in_date_arr.dayofyear.values - 1) // 8, 46
+        raise ValueError(f'cadence must be "monthly", "16days" or "8days" (got {self.cadence})')
+
+    def fit(self, prcptot_arr, in_date_arr):
+        """月別のガンマ分布のパラメータを推定し, 入力データのSPIを求める
+
+        Args:
+            prcptot_arr (Array like): (h, w, T) または (N, T)の月降水量(PRCPTOT)
+            in_date_arr (pandas.DatetimeIndex): 最終軸の月(長さT)
+        """
+        in_date_arr = pd.to_datetime(in_date_arr)
+        sum_arr = self.rolling_sum(prcptot_arr, self.scale)
+        spatial_shape = sum_arr.shape[:-1]
+        group_idx, n_groups = self.group_index(in_date_arr)
+        self.alpha = np.full(spatial_shape + (n_groups,), np.nan)
+        self.beta = np.full(spatial_shape + (n_groups,), np.nan)
+        self.q = np.full(spatial_shape + (n_groups,), np.nan)
+        n_positive_arr = np.zeros(spatial_shape + (n_groups,), dtype=int)
+
+        for group in range(n_groups):
+            using_arr = sum_arr[..., group_idx==group]
+            valid = ~np.isnan(using_arr)
+            positive = valid & (using_arr>0)
+            n_valid = valid.sum(axis=-1)
+            n_positive = positive.sum(axis=-1)
+            n_positive_arr[..., group] = n_positive
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # Thomの近似: A = ln(平均) - 平均(ln x), α = (1 + sqrt(1 + 4A/3)) / 4A, β = 平均 / α
+                mean = np.where(positive, using_arr, 0).sum(axis=-1) / n_positive
+                log_mean = np.where(positive, np.log(np.where(positive, using_arr, 1)), 0).sum(axis=-1) / n_positive
+                A = np.log(mean) - log_mean
+                alpha = (1 + np.sqrt(1 + 4*A/3)) / (4*A)
+                self.alpha[..., group] = alpha
+                self.beta[..., group] = mean / alpha
+                self.q[..., group] = (n_valid - n_positive) / n_valid
+
+        self.available = np.isfinite(self.alpha) & (self.alpha>0) & (n_positive_arr>=self.min_sample_size)
+        self.SPI_arr = self.score_sum(sum_arr, in_date_arr)
+        return self
+
+    def score(self, prcptot_arr, in_date_arr):
+        """推定済みのパラメータで新しい月のSPIを求める(再推定はしない)
+        最初のscale-1ヶ月はnanになるので, 求めたい月の前scale-1ヶ月分も含めて渡す
+
+        Args:
+            prcptot_arr (Array like): (..., T)の月降水量(PRCPTOT)
+            in_date_arr (pandas.DatetimeIndex): 最終軸の月(長さT)
+
+        Returns:
+            Array like: (..., T)のSPI
+        """
+        return self.score_sum(self.rolling_sum(prcptot_arr, self.scale), pd.to_datetime(in_date_arr))
+
+    def score_sum(self, sum_arr, in_date_arr):
+        """積算降水量からSPIを求める: H = q + (1-q)G(x), SPI = Φ^-1(H)"""
+        group_idx = self.group_index(in_date_arr)[0]
+        alpha = self.alpha[..., group_idx]
+        beta = self.beta[..., group_idx]
+        q = self.q[..., group_idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cdf = np.where(sum_arr>0, special.gammainc(alpha, sum_arr/beta), 0)
+            H = q + (1-q)*cdf
+            SPI = special.ndtri(H)
+        return np.where(self.available[..., group_idx] & ~np.isnan(sum_arr), SPI, np.nan)
+
+    def save(self, out_path):
+        """推定したパラメータを保存する(.npz)"""
+        np.savez(
+            out_path, scale=self.scale, min_sample_size=self.min_sample_size, cadence=self.cadence,
+            alpha=self.alpha, beta=self.beta, q=self.q, available=self.available
+        )
+        return self
+
+    @classmethod
+    def load(cls, in_path):
+        """保存したパラメータを読み込む(scoreで新しい月を計算できる)"""
+        params = np.load(in_path)
+        cadence = str(params['cadence']) if 'cadence' in params.files else 'monthly'  # cadenceが無いファイルは月別
+        spi_grid = cls(int(params['scale']), int(params['min_sample_size']), cadence)
+        spi_grid.alpha = params['alpha']
+        spi_grid.beta = params['beta']
+        spi_grid.q = params['q']
+        spi_grid.available = params['available']
+        return spi_grid
@@ -30,8 +30,9 @@ class SPI_3:
         self.SPI_arr = None
 
     def fit(self):
+        self.make_conv_dataset()
         for month in range(1, 12+1):
-            self.make_conv_dataset().calc_gamma_params(month)
+            self.calc_gamma_params(month)
         
         SPI_ls = []
         for PRCPTOT, month in zip(self.sorted_PRCPTOT, self.sorted_date_arr.month):
@@ -2,4 +2,9 @@ from .mR95pMonthly1D import mR95pMonthly1D
 from .mR95pT_16days_from_amedas import make_r95pT_df_from_amedas
 from .GroundTruth_plot import GroundTruth_plot
 from .mR95p import mR95pBase
-from .SPI_3 import SPI_3
\ No newline at end of file
+from .SPI_3 import SPI_3
+from .calc_doy_percentile import calc_doy_percentile
+from .mR95pTileExecutor import mR95pTileExecutor
+from .SPIGrid import SPIGrid
+from .IncrementalUpdater import IncrementalUpdater
+from .CompositeEngine import CompositeEngine
\ No newline at end of file
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# calc_doy_percentile.py: DOYごとの降雨日%ile値(mRRwn95)を全DOY・全ピクセルまとめて計算する
+
+# %%
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# %%
+def sorted_percentile(sorted_arr, count_arr, q):
+    """昇順に並べた配列(nanは末尾)の先頭count個からq%ile値を求める
+    np.percentile(method='linear')と同じ補間を行う
+
+    Args:
+        sorted_arr (Array like): 最終軸で昇順に並べた配列. 有効値の後ろはnan
+        count_arr (Array like): 最終軸ごとの有効値の個数
+        q (float): %ile (0-100)
+
+    Returns:
+        Array like: q%ile値. 有効値が無い場合はnan
+    """
+    count_arr = np.asarray(count_arr)
+    virtual_idx = (count_arr - 1) * (q / 100)
+    prev_idx = np.floor(virtual_idx)
+    above = virtual_idx >= count_arr - 1  # 上端を超える場合は最大値を使う
+    gamma = virtual_idx - prev_idx
+
+    prev_idx = np.clip(np.where(above, count_arr-1, prev_idx), 0, None).astype(np.intp)
+    next_idx = np.clip(np.where(above, count_arr-1, prev_idx+1), 0, None).astype(np.intp)
+    a = np.take_along_axis(sorted_arr, prev_idx[..., None], axis=-1)[..., 0]
+    b = np.take_along_axis(sorted_arr, next_idx[..., None], axis=-1)[..., 0]
+
+    diff_b_a = b - a
+    out = np.where(gamma>=0.5, b - diff_b_a*(1-gamma), a + diff_b_a*gamma)
+    return np.where(count_arr>0, out, np.nan)
+
+
+def calc_doy_percentile(
+    rain30_arr, date_arr, q=95, window_half=7, min_sample_size=30, Rnnmm=10,
+    dtype=np.float64, block_size=64, n_workers=1
+    ):
+    """全DOY(1-366)の降雨日q%ile値を, ピクセルブロックごとに時間軸1回の走査でまとめて計算する
+
+    DOY dの値には, 全年のDOYが d-window_half ~ d+window_half の日の降雨(>0)を使う.
+    0以下のDOYは365を足して前年末に回し, 366より後のDOYは存在しないものとして扱う
+    (mR95pMonthly2D.calc_mRRwn95の np.isin(DOY, 窓) と同じ窓).
+
+    Args:
+        rain30_arr (Array like): 降水量データ. (h, w, T) または (N, T). numpy.memmapでもよい
+        date_arr (pandas.DatetimeIndex): 最終軸の日付(長さT)
+        q (float): %ile. Defaults to 95.
+        window_half (int): ウィンドウサイズ. Defaults to 7.
+        min_sample_size (int): 計算に最低限必要な降雨日数(全年合計). Defaults to 30.
+        Rnnmm (float): 降雨日数が足りない場合の値. Defaults to 10.
+        dtype (numpy.dtype): 計算に使う浮動小数点型. np.float32でメモリを半分にできる. Defaults to np.float64.
+        block_size (int): 1回に処理するピクセル数. Defaults to 64.
+        n_workers (int): ブロックを並列に処理するスレッド数. Defaults to 1.
+
+    Returns:
+        Array like: (h, w, 366) または (N, 366) のq%ile値
+    """
+    date_arr = pd.to_datetime(date_arr)
+    spatial_shape = rain30_arr.shape[:-1]
+    flat_arr = rain30_arr.reshape(-1, rain30_arr.shape[-1])
+    n_pixels = flat_arr.shape[0]
+
+    # (DOY枠, 年)への対応. DOY dは枠 window_half+d-1 に入れる
+    doy_arr = date_arr.dayofyear.values
+    year_idx = date_arr.year.values - date_arr.year.values.min()
+    n_years = year_idx.max() + 1
+    slot_idx = window_half + doy_arr - 1
+    n_slots = 366 + 2*window_half
+
+    out_arr = np.zeros((n_pixels, 366), dtype=dtype)
+
+    def process_block(start):
+        block = np.asarray(flat_arr[start:start+block_size], dtype=dtype)
+        nb = block.shape[0]
+
+        # (ピクセル, DOY枠, 年)に並べ替える. 前方はDOY365以前の値で循環させ, 後方はnanのまま
+        doy_year_arr = np.full((nb, n_slots, n_years), np.nan, dtype=dtype)
+        doy_year_arr[:, slot_idx, year_idx] = block
+        doy_year_arr[:, :window_half] = doy_year_arr[:, 365:365+window_half]
+        doy_year_arr[~(doy_year_arr>0)] = np.nan  # 降雨日以外(nanを含む)をnanに
+
+        # 各DOYの窓をコピーせずに取り出し(ピクセル, DOY, 年, 窓), 窓内の値をまとめて並べ替える
+        window_view = np.lib.stride_tricks.sliding_window_view(doy_year_arr, 2*window_half+1, axis=1)
+        window_arr = np.sort(window_view.reshape(nb, 366, -1), axis=-1)
+        count_arr = np.sum(~np.isnan(window_arr), axis=-1)
+
+        out_arr[start:start+nb] = np.where(
+            count_arr<min_sample_size,
+            Rnnmm,
+            sorted_percentile(window_arr, count_arr, q)
+        )
+
+    starts = range(0, n_pixels, block_size)
+    if n_workers==1:
+        for start in starts:
+            process_block(start)
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(process_block, starts))
+
+    return out_arr.reshape(*spatial_shape, 366)
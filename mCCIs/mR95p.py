@@ -9,6 +9,11 @@ import datetime
 import pandas as pd
 from matplotlib import pyplot as plt
 
+if __name__=='__main__':
+    from calc_doy_percentile import sorted_percentile
+else:
+    from .calc_doy_percentile import sorted_percentile
+
 # %%
 # 各DOYごとにR95inを算出する
 
@@ -34,37 +39,49 @@ class mR95pBase:
         self.mR95p = None  # 月別のmR95p(mm)
         self.mR95pT = None  # 月別のmR95pを30年平均降水量で正規化
 
-    def calc_mRRwn95(self, rain30_arr, window_half=7, min_sample_size=30, Rnnmm=10):
+    def calc_mRRwn95(self, rain30_arr, window_half=7, min_sample_size=30, Rnnmm=10, block_size=256):
         """各平年値(mRRwn95, PPT)を計算する
+        全DOYの窓を1回で切り出して並べ替え, 95%ile値をまとめて求める
 
         Args:
-            rain30_arr (_type_): 30年平年値を算出するために使用するデータ
+            rain30_arr (Array like): 30年平年値を算出するために使用するデータ. (日,) または (地点, 日)
             window_half (int, optional): ウィンドウサイズ. Defaults to 7.
             min_sample_size (int, optional): 計算に最低限必要な降雨日数(30年間). Defaults to 30.
             Rnnmm (float): ユーザー定義の最低豪雨しきい値. Defaults to 10.
+            block_size (int): 1回に処理する地点数. Defaults to 256.
 
         """
 
         doy_arr = self.normal_date_arr.dayofyear.values  # 入力データのDOYリスト
-        
-        no366_ppt_arr = rain30_arr[doy_arr!=366].reshape(-1, 365)  # DOY366は計算しない
-        clean_ppt_arr = np.concatenate([
-            no366_ppt_arr.reshape(-1, 365)[:, -1*window_half:],
-            no366_ppt_arr.reshape(-1, 365),
-            no366_ppt_arr.reshape(-1, 365)[:, :window_half]
-        ], axis=1)
-        
-        RRwn95_ls = []
-        for i in range(365):
-            target_period = clean_ppt_arr[:, i:i+window_half*2+1]
-            if len(target_period[target_period!=0])<min_sample_size:
-                RRwn95 = Rnnmm
-            else:
-                RRwn95 = np.percentile(target_period[target_period!=0], 95)
-            RRwn95_ls.append(RRwn95)
-        RRwn95_ls.append(RRwn95)  # DOY366用のデータを入れる
-        self.mRRwn95 = np.array(RRwn95_ls)
-        self.mRRwn95[self.mRRwn95<Rnnmm] = Rnnmm
+        rain30_arr = np.asarray(rain30_arr)
+        flat_arr = rain30_arr.reshape(-1, rain30_arr.shape[-1])[:, doy_arr!=366]  # DOY366は計算しない
+        mRRwn95 = np.empty((flat_arr.shape[0], 366))
+
+        for start in range(0, flat_arr.shape[0], block_size):
+            no366_ppt_arr = flat_arr[start:start+block_size].reshape(-1, len(flat_arr[0])//365, 365)  # (地点, 年, DOY)
+            clean_ppt_arr = np.concatenate([
+                no366_ppt_arr[:, :, -1*window_half:],
+                no366_ppt_arr,
+                no366_ppt_arr[:, :, :window_half]
+            ], axis=2)
+
+            # (地点, DOY, 年×窓)に並べ, 降雨日(0以外)だけを前に詰めて並べ替える
+            window_arr = np.lib.stride_tricks.sliding_window_view(clean_ppt_arr, window_half*2+1, axis=2)
+            window_arr = window_arr.transpose(0, 2, 1, 3).reshape(no366_ppt_arr.shape[0], 365, -1)
+            rain_day_arr = window_arr!=0
+            count_arr = np.sum(rain_day_arr, axis=-1)
+            sorted_arr = np.sort(np.where(rain_day_arr, window_arr, np.inf), axis=-1)
+
+            RRwn95_arr = np.where(
+                count_arr<min_sample_size,
+                Rnnmm,
+                np.where(np.isnan(window_arr).any(axis=-1), np.nan, sorted_percentile(sorted_arr, count_arr, 95))
+            )
+            mRRwn95[start:start+block_size, :365] = RRwn95_arr
+            mRRwn95[start:start+block_size, 365] = RRwn95_arr[:, -1]  # DOY366用のデータを入れる
+
+        mRRwn95[mRRwn95<Rnnmm] = Rnnmm
+        self.mRRwn95 = mRRwn95.reshape(rain30_arr.shape[:-1] + (366,))
 
         return self
     
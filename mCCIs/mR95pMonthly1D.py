@@ -23,31 +23,29 @@ class mR95pMonthly1D(mR95pMonthlyBase):
         """
         super().__init__(normal_start_year, normal_end_year)
 
+    @staticmethod
+    def month_starts(date_arr):
+        """日付リストの(年, 月)が切り替わる位置(np.add.reduceatの区切り)"""
+        ym_arr = date_arr.year.values*12 + date_arr.month.values
+        return np.r_[0, np.where(np.diff(ym_arr)!=0)[0]+1]
+
     def calc_PPT_mean(self, rain30_arr):
         """各スパンごとの平均総降水量を計算(オーバーライド)
 
         Args:
-            rain30_arr (Array like, 1D): 30年平年値を算出するために使用するデータ
+            rain30_arr (Array like): 30年平年値を算出するために使用するデータ. (日,) または (地点, 日)
         """
-        year_arr = self.normal_date_arr.year.values
-        month_arr = self.normal_date_arr.month.values
-        PRCP_ls = []
-        for year in range(self.normal_start_year, self.normal_end_year+1):
-            for month in range(1, 12+1):
-                all_rain_arr = np.where(
-                    (year_arr==year)&(month_arr==month),
-                    rain30_arr, np.nan
-                )
-                PRCP = np.nansum(all_rain_arr)
-                PRCP_ls.append(PRCP)
-        self.PPT_mean = np.nanmean(np.array(PRCP_ls).reshape(-1, 12), axis=0)
+        rain30_arr = np.asarray(rain30_arr, dtype=np.float64)
+        # (年, 月)ごとの総降水量を1回の区切り和で求める(nanは0として足す)
+        PRCP_arr = np.add.reduceat(np.nan_to_num(rain30_arr), self.month_starts(self.normal_date_arr), axis=-1)
+        self.PPT_mean = np.nanmean(PRCP_arr.reshape(rain30_arr.shape[:-1] + (-1, 12)), axis=-2)
         return self
 
     def calc_mR95pT(self, rain_arr, start_year, end_year):
         """入力データ・入力期間の期間毎mR95p, mR95pTを計算する
 
         Args:
-            rain_arr (Array like): 計算したい期間の降水量データ
+            rain_arr (Array like): 計算したい期間の降水量データ. (日,) または (地点, 日)
             start_year (int): 計算したい期間の開始年
             end_year (int): 計算したい期間の終了年
 
@@ -59,24 +57,16 @@ class mR95pMonthly1D(mR95pMonthlyBase):
             datetime.timedelta(days=1)
             ))
         doy_arr = date_arr.dayofyear.values
-        year_arr = date_arr.year.values
-        month_arr = date_arr.month.values
-        
-        year_unique = np.unique(year_arr)[~np.isnan(np.unique(year_arr))]
-        start_year = int(year_unique[0])
-        end_year = int(year_unique[-1])
-        R95p_ls = []
-        threshold_arr = self.mRRwn95[list((doy_arr-1).astype(int))]
-        for year in range(start_year, end_year+1):
-            for month in range(1, 12+1):
-                over_rain_arr = np.where(
-                    (year_arr==year)&(month_arr==month)&(rain_arr>=threshold_arr),
-                    rain_arr, np.nan
-                )
-                R95p = np.nansum(over_rain_arr)
-                R95p_ls.append(R95p)
-        self.mR95p = np.array(R95p_ls)
-        self.mR95pT =(self.mR95p.reshape(-1, 12)/self.PPT_mean).flatten()  # mR95p/PPT_meanを計算
+        rain_arr = np.asarray(rain_arr, dtype=np.float64)
+
+        threshold_arr = self.mRRwn95[..., doy_arr-1]
+        over_rain_arr = np.where(rain_arr>=threshold_arr, rain_arr, 0)  # しきい値以上の降水のみ(nanは除く)
+        self.mR95p = np.add.reduceat(over_rain_arr, self.month_starts(date_arr), axis=-1)
+
+        n_years = end_year - start_year + 1
+        self.mR95pT = (
+            self.mR95p.reshape(rain_arr.shape[:-1] + (n_years, 12)) / self.PPT_mean[..., None, :]
+        ).reshape(self.mR95p.shape)  # mR95p/PPT_meanを計算
         self.mR95pT = np.where(~np.isnan(self.mR95pT), self.mR95pT, 0)
         return self
 
@@ -9,27 +9,27 @@ import datetime
 
 if __name__=='__main__':
     from mR95p import mR95pMonthlyBase
+    from calc_doy_percentile import calc_doy_percentile
 else:
     from .mR95p import mR95pMonthlyBase
+    from .calc_doy_percentile import calc_doy_percentile
 
 import warnings
 warnings.simplefilter('ignore')
 
 # %%
 if __name__=='__main__':
-    date_arr = pd.to_datetime(np.arange(
-        datetime.datetime(1991,1,1),
-        datetime.datetime(2020,12,31,1),
-        datetime.timedelta(days=1)
-    ))
-
-    all_img = np.zeros((200,200,len(date_arr)))
-
-    for i, date in enumerate(date_arr):
-        get_img = np.fromfile(
-            f'D:/ResearchData3/Level3/chirps005_RAW_f32/chirps_005.A{date.year}{str(date.dayofyear).zfill(3)}.float32_h1600w1500.raw',
-            count=1600*1500, dtype=np.float32
-        ).reshape(1600, 1500)
+    from GeoTool.Convert import DatasetCatalog
+    catalog = DatasetCatalog()  # 保存先はカタログで変更する
+    date_arr = catalog.date_arr('chirps_005', 1991, 2020)
+    available_arr = catalog.available('chirps_005', date_arr)  # 欠損ファイルを先に確認
+
+    all_img = np.full((200,200,len(date_arr)), np.nan)
+
+    for i, (date, available) in enumerate(zip(date_arr, available_arr)):
+        if not available:
+            continue
+        get_img = catalog.read('chirps_005', date)
         all_img[:,:,i] = get_img[800:1000, 800:1000]
         if date.dayofyear==1:
             print(date.year)
@@ -46,38 +46,25 @@ class mR95pMonthly2D(mR95pMonthlyBase):
         """
         super().__init__(normal_start_year, normal_end_year)
     
-    def calc_mRRwn95(self, rain30_arr, window_half=7, min_sample_size=30, Rnnmm=10):
+    def calc_mRRwn95(self, rain30_arr, window_half=7, min_sample_size=30, Rnnmm=10, dtype=np.float64, block_size=64, n_workers=1):
         """各平年値(mRRwn95, PPT)を計算する
+        全DOYの95%ile値をピクセルブロックごとにまとめて計算する(calc_doy_percentile)
 
         Args:
             rain30_arr (Array like (3D)): 30年平年値を算出するために使用するデータ
             window_half (int, optional): ウィンドウサイズ. Defaults to 7.
             min_sample_size (int, optional): 計算に最低限必要な降雨日数(30年間). Defaults to 30.
             Rnnmm (float): ユーザー定義の最低豪雨しきい値. Defaults to 10.
+            dtype (numpy.dtype): 計算に使う浮動小数点型. Defaults to np.float64.
+            block_size (int): 1回に処理するピクセル数. Defaults to 64.
+            n_workers (int): 並列に処理するスレッド数. Defaults to 1.
 
         """
-        h,w,_ = rain30_arr.shape
-        
-        self.mRRwn95 = np.zeros((h, w, 366))
-        for i, doy in enumerate(range(1, 365)):
-            using_doy_arr = np.arange(doy-window_half, doy+window_half+1)
-            using_doy_arr = np.where(using_doy_arr<=0, using_doy_arr+365, using_doy_arr)  # 使用するDOYリストをまとめる
-
-
-            using_rain30_arr = rain30_arr[:,:,np.isin(self.normal_date_arr.dayofyear, using_doy_arr)]  # 使用するrain30リストをまとめる
-            rainy_ppt_arr = np.where(using_rain30_arr>0, using_rain30_arr, np.nan)  # 雨の日の降水量以外をnullに変換
-            rainy_days_arr = np.nansum(~np.isnan(rainy_ppt_arr), axis=2)  # 雨の日の日数をカウント
-
-            # mRRwn95を計算
-            self.mRRwn95[:,:,i] = np.where(
-                rainy_days_arr<min_sample_size,
-                Rnnmm,
-                np.nanpercentile(rainy_ppt_arr, 95, axis=2)
-            )
-            if doy%10==0:
-                print(f'calc mRRwn95 (doy:{str(doy).zfill(3)})')  # CHECK LOG
-            del using_doy_arr, using_rain30_arr, rainy_ppt_arr, rainy_days_arr  # メモリの開放
-        self.mRRwn95[:,:,365-1] = self.mRRwn95[:,:,366-1]
+        self.mRRwn95 = calc_doy_percentile(
+            rain30_arr, self.normal_date_arr, q=95,
+            window_half=window_half, min_sample_size=min_sample_size, Rnnmm=Rnnmm,
+            dtype=dtype, block_size=block_size, n_workers=n_workers
+        )
         return self
     
     def calc_PPT_mean(self, rain30_arr):
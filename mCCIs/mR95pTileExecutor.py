@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# mR95pTileExecutor.py: 全球・大陸スケールの月次mR95p(2D)を空間タイルごとに並列計算する
+
+# %%
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import datetime
+import json
+import time
+import os
+
+from .mR95pMonthly2D import mR95pMonthly2D
+from ..Convert.RasterCube import RasterCube
+
+# %%
+class mR95pTileExecutor:
+    def __init__(
+        self, cube_path, out_dir, normal_start_year=1991, normal_end_year=2020,
+        start_year=1991, end_year=2020, tile_size=100, out_dtype=np.float32
+        ):
+        """日別降水量のキューブ(RasterCube)から, 空間タイルごとに時系列を読み込んで月次mR95pを計算する
+        結果は出力ディレクトリのキューブ(メモリマップ)に直接書き込むので, 全画像をメモリに載せる必要がない
+
+        Args:
+            cube_path (str, path): 日別降水量のキューブのパス. タイルの読み込みが速い'pixel'レイアウトを推奨
+            out_dir (str, path): 出力ディレクトリ
+            normal_start_year (int): 平年値算出に使うデータの開始年. Defaults to 1991.
+            normal_end_year (int): 平年値算出に使うデータの終了年. Defaults to 2020.
+            start_year (int): mR95pTを計算する期間の開始年. Defaults to 1991.
+            end_year (int): mR95pTを計算する期間の終了年. Defaults to 2020.
+            tile_size (int or set(int, int)): タイルの大きさ(高さ, 幅). Defaults to 100.
+            out_dtype (numpy.dtype): 出力キューブのdtype. Defaults to np.float32.
+
+        Attributes:
+            .cube (RasterCube)      : 入力キューブ
+            .out_path_dict (dict)   : 出力キューブのパス(mRRwn95, PPT_mean, mR95p, mR95pT)
+            .progress_path (str)    : 完了したタイルを記録する進捗ファイル(jsonl)のパス
+        """
+        self.cube_path = cube_path
+        self.out_dir = out_dir
+        self.normal_start_year = normal_start_year
+        self.normal_end_year = normal_end_year
+        self.start_year = start_year
+        self.end_year = end_year
+        self.tile_size = (tile_size, tile_size) if isinstance(tile_size, int) else tuple(tile_size)
+        self.out_dtype = np.dtype(out_dtype)
+
+        self.cube = RasterCube(cube_path)
+        self.h, self.w = self.cube.h, self.cube.w
+        self.out_path_dict = {name: f'{out_dir}/{name}.cube' for name in ['mRRwn95', 'PPT_mean', 'mR95p', 'mR95pT']}
+        self.progress_path = f'{out_dir}/mR95p_tile_progress.jsonl'
+
+    def tiles(self):
+        """タイルの位置(row_off, col_off, height, width)のリストを返す"""
+        tile_h, tile_w = self.tile_size
+        return [
+            (row, col, min(tile_h, self.h-row), min(tile_w, self.w-col))
+            for row in range(0, self.h, tile_h)
+            for col in range(0, self.w, tile_w)
+        ]
+
+    def out_date_dict(self):
+        """出力キューブの最終軸の日付. mRRwn95はDOY(閏年2000年の日付), PPT_meanは月(2000年の各月1日)で表す"""
+        return {
+            'mRRwn95' : pd.date_range('2000-01-01', '2000-12-31', freq='D'),
+            'PPT_mean': pd.date_range('2000-01-01', periods=12, freq='MS'),
+            'mR95p'   : pd.date_range(f'{self.start_year}-01-01', f'{self.end_year}-12-01', freq='MS'),
+            'mR95pT'  : pd.date_range(f'{self.start_year}-01-01', f'{self.end_year}-12-01', freq='MS'),
+        }
+
+    def params(self):
+        """再開時に一致を確認する計算条件"""
+        return {
+            'cube_path'         : os.path.abspath(self.cube_path),
+            'normal_start_year' : self.normal_start_year,
+            'normal_end_year'   : self.normal_end_year,
+            'start_year'        : self.start_year,
+            'end_year'          : self.end_year,
+            'tile_size'         : list(self.tile_size),
+            'out_dtype'         : self.out_dtype.str,
+        }
+
+    def allocate(self):
+        """出力キューブ(h, w, T)を確保し, RasterCubeと同じ形式のインデックスを書き出す"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        for name, date_arr in self.out_date_dict().items():
+            RasterCube.create(
+                self.out_path_dict[name], date_arr, self.out_dtype,
+                self.h, self.w, self.cube.geotrans, layout='pixel'
+            )
+
+    def load_progress(self):
+        """進捗ファイルから完了済みのタイルを読み込む. 計算条件が変わっていればNoneを返す"""
+        if not os.path.exists(self.progress_path):
+            return None
+        done_set = set()
+        with open(self.progress_path, 'r') as f:
+            lines = f.readlines()
+        if len(lines)==0 or json.loads(lines[0])!=self.params():
+            return None
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 書き込み途中で止まった行は無視
+            done_set.add(tuple(record['tile']))
+        return done_set
+
+    def run(self, n_workers=1, window_half=7, min_sample_size=30, Rnnmm=10, overwrite=False):
+        """全タイルを計算して出力キューブに書き込む
+        完了したタイルは進捗ファイルに1つずつ追記するので, 途中で止まっても続きから再開できる
+
+        Args:
+            n_workers (int): 並列数. 1ならプロセスプールを使わず逐次処理(Windowsで並列化する場合は呼び出し側を if __name__=='__main__': で囲む). Defaults to 1.
+            window_half (int): 各DOY計算に使用するウィンドウのサイズ. Defaults to 7.
+            min_sample_size (int): 最低限必要な降雨日の日数. Defaults to 30.
+            Rnnmm (float): ユーザー定義の最低豪雨しきい値. Defaults to 10.
+            overwrite (bool): 完了済みのタイルも計算し直すかどうか. Defaults to False.
+
+        Returns:
+            dict: 出力キューブ(RasterCube)
+        """
+        done_set = None if overwrite else self.load_progress()
+        if done_set is None or not all([os.path.exists(path) for path in self.out_path_dict.values()]):
+            # 新規(または条件変更)なら出力を確保し直す
+            self.allocate()
+            with open(self.progress_path, 'w') as f:
+                f.write(json.dumps(self.params())+'\n')
+            done_set = set()
+
+        tile_ls = self.tiles()
+        todo_ls = [tile for tile in tile_ls if tile not in done_set]
+        print(f'{len(tile_ls)} tiles, {len(tile_ls)-len(todo_ls)} tiles already done')
+
+        args = (
+            self.cube_path, self.out_path_dict,
+            self.normal_start_year, self.normal_end_year, self.start_year, self.end_year,
+            window_half, min_sample_size, Rnnmm
+        )
+        start = time.perf_counter()
+        with open(self.progress_path, 'a') as progress:
+            if n_workers==1:
+                results = (_run_tile(tile, *args) for tile in todo_ls)
+            else:
+                executor = ProcessPoolExecutor(max_workers=n_workers)
+                futures = [executor.submit(_run_tile, tile, *args) for tile in todo_ls]
+                results = (future.result() for future in as_completed(futures))
+
+            for i, record in enumerate(results):
+                progress.write(json.dumps(record)+'\n')  # 1タイルごとに記録
+                progress.flush()
+                elapsed = time.perf_counter() - start
+                remain = elapsed / (i+1) * (len(todo_ls)-i-1)
+                print(f'tile {record["tile"]} done ({i+1}/{len(todo_ls)}, {record["seconds"]:.1f}s, elapsed {elapsed:.0f}s, remain {remain:.0f}s)')  # CHECK LOG
+
+            if n_workers!=1:
+                executor.shutdown()
+
+        return {name: RasterCube(path) for name, path in self.out_path_dict.items()}
+
+
+# %%
+def _run_tile(
+    tile, cube_path, out_path_dict,
+    normal_start_year, normal_end_year, start_year, end_year,
+    window_half, min_sample_size, Rnnmm
+    ):
+    """1タイルを計算して出力キューブに書き込む(プロセスプールから呼ぶためモジュール直下に置く)"""
+    start = time.perf_counter()
+    row_off, col_off, height, width = tile
+    cube = RasterCube(cube_path)
+
+    m95m2d = mR95pMonthly2D(normal_start_year, normal_end_year)
+    target_date_arr = pd.to_datetime(np.arange(
+        datetime.datetime(start_year, 1, 1),
+        datetime.datetime(end_year, 12, 31, 1),
+        datetime.timedelta(days=1)
+    ))
+
+    rain30_arr = cube.get_window(row_off, col_off, height, width, m95m2d.normal_date_arr)
+    m95m2d.calc_normalyear(rain30_arr, window_half, min_sample_size, Rnnmm)
+    del rain30_arr
+    rain_arr = cube.get_window(row_off, col_off, height, width, target_date_arr)
+    m95m2d.calc_mR95pT(rain_arr, start_year, end_year)
+
+    result_dict = {
+        'mRRwn95' : m95m2d.mRRwn95,
+        'PPT_mean': m95m2d.PPT_mean[:, :, :12],
+        'mR95p'   : m95m2d.mR95p,
+        'mR95pT'  : m95m2d.mR95pT,
+    }
+    for name, result in result_dict.items():
+        out_cube = RasterCube(out_path_dict[name], mode='r+')
+        out_cube.cube[row_off:row_off+height, col_off:col_off+width] = result
+        out_cube.cube.flush()
+        del out_cube
+
+    return {'tile': list(tile), 'seconds': time.perf_counter()-start}